@@ -19,6 +19,22 @@ import errno
 import urlparse
 import sys
 import getpass
+
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "hooks", "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig import cachetier
+from vfxconfig import cachetrim
+from vfxconfig import pathcache
+from vfxconfig import cacheshard
+from vfxconfig.memo import process_memo
+from vfxconfig.dircache import known_folders
+
+# name of the process wide memo of the resolved cache locations
+MEMO_NAME = "cache_location"
+
 HookBaseClass = sgtk.get_hook_baseclass()
 
 class CacheLocation(HookBaseClass):
@@ -41,10 +57,33 @@ class CacheLocation(HookBaseClass):
         :param pipeline_configuration_id: The shotgun pipeline config id to store caches for
         :returns: The path to a path cache file. This file should exist when this method returns.
         """
+        # resolved once per process, see _memo_key()
+        key = self._memo_key("path_cache", project_id, pipeline_configuration_id)
+        locations = process_memo(MEMO_NAME)
+        if key in locations:
+            return locations[key]
+
         cache_root = self._get_cache_root(project_id, pipeline_configuration_id)
         self._ensure_folder_exists(cache_root)
-        target_path = os.path.join(cache_root, "path_cache.db")
+        shard_root = cacheshard.shard_root(cache_root, self._get_root())
+        if shard_root:
+            # each machine has its own path cache, seeded from the
+            # project snapshot below, see vfxconfig.cacheshard
+            self._ensure_folder_exists(shard_root)
+            target_path = os.path.join(shard_root, "path_cache.db")
+        elif cachetier.is_enabled():
+            # work on a copy on the local disk, written back to the
+            # cache root regularly, see vfxconfig.cachetier
+            tier = cachetier.get_tier(cache_root, self._get_root())
+            target_path = tier.database("path_cache.db")
+        else:
+            target_path = os.path.join(cache_root, "path_cache.db")
+        # seed a new path cache from the snapshot of the project, and
+        # add our indexes, see vfxconfig.pathcache
+        local = cacheshard.shard_mode() == "local" or (not shard_root and cachetier.is_enabled())
+        pathcache.prepare(target_path, project_id, local=local)
         self._ensure_file_exists(target_path)
+        locations[key] = target_path
         
         return target_path
     
@@ -64,9 +103,25 @@ class CacheLocation(HookBaseClass):
         :param bundle: The app, engine or framework object which is requesting the cache folder.
         :returns: The path to a folder which should exist on disk.
         """
+        key = self._memo_key("bundle_cache", project_id, pipeline_configuration_id, bundle.name)
+        locations = process_memo(MEMO_NAME)
+        if key in locations:
+            return locations[key]
+
         cache_root = self._get_cache_root(project_id, pipeline_configuration_id)
-        target_path = os.path.join(cache_root, bundle.name)
+        shard_root = cacheshard.shard_root(cache_root, self._get_root())
+        if shard_root:
+            target_path = os.path.join(shard_root, bundle.name)
+        elif cachetier.is_enabled():
+            tier = cachetier.get_tier(cache_root, self._get_root())
+            target_path = tier.folder(bundle.name)
+        else:
+            target_path = os.path.join(cache_root, bundle.name)
         self._ensure_folder_exists(target_path)
+        # nothing else removes the files cached by the apps, keep the
+        # bundle caches within their budgets, see vfxconfig.cachetrim
+        cachetrim.trim_in_background(os.path.dirname(target_path))
+        locations[key] = target_path
         
         return target_path
         
@@ -87,14 +142,14 @@ class CacheLocation(HookBaseClass):
         # windows: $APPDATA/Shotgun/SITE_NAME/project_xxx/config_yyy
         # linux: ~/.shotgun/SITE_NAME/project_xxx/config_yyy
         
+        key = self._memo_key("cache_root", project_id, pipeline_configuration_id)
+        locations = process_memo(MEMO_NAME)
+        if key in locations:
+            return locations[key]
+
         # first establish the root location
         tk = self.parent
-        if sys.platform == "darwin":
-            root = os.path.expanduser("~/Library/Caches/Shotgun")
-        elif sys.platform == "win32":
-            root = os.path.join(os.environ["APPDATA"], "Shotgun")
-        elif sys.platform.startswith("linux"):
-            root = "/datas"+os.sep + getpass.getuser() + os.sep + ".shotgun"
+        root = self._get_root()
 
         # get site only; https://www.foo.com:8080 -> www.foo.com
         base_url = urlparse.urlparse(tk.shotgun.base_url)[1].split(":")[0]
@@ -104,8 +159,40 @@ class CacheLocation(HookBaseClass):
                                   base_url, 
                                   "project_%d" % project_id,
                                   "config_%d" % pipeline_configuration_id)
+        locations[key] = cache_root
         return cache_root
+
+    def _memo_key(self, kind, *args):
+        """
+        Helper method returning the key of a location in the process wide
+        memo. Locations only depend on the site and the given arguments.
+        """
+        return (kind, self.parent.shotgun.base_url) + args
+
+    def _forget(self, path):
+        """
+        Helper method - forget everything known about a location which
+        turned out to be invalid, it is resolved and checked again next time.
+        """
+        locations = process_memo(MEMO_NAME)
+        for (key, value) in locations.items():
+            if value == path or value.startswith(path + os.sep):
+                locations.pop(key, None)
+        known_folders().forget(path)
     
+    def _get_root(self):
+        """
+        Helper method returning the folder holding the caches of all the
+        sites, projects and pipeline configurations.
+        """
+        if sys.platform == "darwin":
+            root = os.path.expanduser("~/Library/Caches/Shotgun")
+        elif sys.platform == "win32":
+            root = os.path.join(os.environ["APPDATA"], "Shotgun")
+        elif sys.platform.startswith("linux"):
+            root = "/datas"+os.sep + getpass.getuser() + os.sep + ".shotgun"
+        return root
+
     def _ensure_file_exists(self, path):
         """
         Helper method - creates a file if it doesn't already exists
@@ -123,6 +210,7 @@ class CacheLocation(HookBaseClass):
                 # so make sure that we ignore any file already exists errors, as they 
                 # are not really errors!
                 if e.errno != errno.EEXIST: 
+                    self._forget(os.path.dirname(path))
                     raise TankError("Could not create cache file '%s': %s" % (path, e))
             finally:
                 os.umask(old_umask)
@@ -133,6 +221,9 @@ class CacheLocation(HookBaseClass):
         
         :param path: path to create
         """
+        if path in known_folders():
+            # checked earlier by this process
+            return
         if not os.path.exists(path):
             old_umask = os.umask(0)
             try:
@@ -142,7 +233,9 @@ class CacheLocation(HookBaseClass):
                 # so make sure that we ignore any file already exists errors, as they 
                 # are not really errors!
                 if e.errno != errno.EEXIST: 
+                    self._forget(path)
                     raise TankError("Could not create cache folder '%s': %s" % (path, e))
             finally:
                 os.umask(old_umask)
+        known_folders().add(path)
             
@@ -27,7 +27,14 @@ introspection inside the hook.
 
 from tank import Hook
 import os
-import errno
+import sys
+
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "hooks", "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.dircache import ensure_folders_exist
 
 class EnsureFolderExists(Hook):
 
@@ -38,16 +45,24 @@ class EnsureFolderExists(Hook):
         :param path: path to create
         :param bundle_object: object requesting the creation
         """
-        if not os.path.exists(path):
-            old_umask = os.umask(0)
-            try:
-                os.makedirs(path, 0770)
-            except OSError, e:
-                # Race conditions are perfectly possible on some network storage setups
-                # so make sure that we ignore any file already exists errors, as they
-                # are not really errors!
-                if e.errno != errno.EEXIST:
-                    raise e
-            finally:
-                os.umask(old_umask)
+        self.ensure_folders_exist([path], bundle_obj)
+
+    def ensure_folders_exist(self, paths, bundle_obj, **kwargs):
+        """
+        Handle the creation of many folders at once, for example the folders
+        of all the frames of a render. Call it with:
 
+        > tk.execute_core_hook_method("ensure_folder_exists", "ensure_folders_exist",
+        >                             paths=paths, bundle_obj=self.parent)
+
+        Folders already created or found during the session are not checked
+        again, see vfxconfig.dircache.
+
+        :param paths: list of paths to create
+        :param bundle_object: object requesting the creation
+        """
+        old_umask = os.umask(0)
+        try:
+            ensure_folders_exist(paths, 0770)
+        finally:
+            os.umask(old_umask)
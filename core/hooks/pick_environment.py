@@ -14,39 +14,22 @@ Hook which chooses an environment file to use based on the current context.
 """
 
 from tank import Hook
+import os
+import sys
+
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "hooks", "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.envtable import get_table, context_signature
 
 class PickEnvironment(Hook):
 
     def execute(self, context, **kwargs):
         """
-        The default implementation assumes there are three environments, called shot, asset 
-        and project, and switches to these based on entity type.
+        Environments are picked from the entity type of the context and whether it
+        has a step and a task, following the decision table in core/pick_environment.yml.
+        See vfxconfig.envtable.
         """
-        
-        if context.project is None:
-            # our context is completely empty! 
-            # don't know how to handle this case.
-            return None
-        
-        if context.entity is None:
-            # we have a project but not an entity
-            return "project"
-        
-        if context.entity and context.step is None:
-            # we have an entity but no step!
-            if context.entity["type"] == "Shot":
-                return "shot"
-            if context.entity["type"] == "Asset":
-                return "asset"            
-            if context.entity["type"] == "Sequence":
-                return "sequence"            
-
-            
-        if context.entity and context.step:
-            # we have a step and an entity
-            if context.entity["type"] == "Shot":
-                return "shot_step"
-            if context.entity["type"] == "Asset":
-                return "asset_step"
-
-        return None
+        return get_table().pick(context_signature(context))
@@ -16,7 +16,23 @@ I/O Hook which creates folders on disk.
 from tank import Hook
 import os
 import sys
-import shutil
+
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "hooks", "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.folders import FolderCreationEngine
+from vfxconfig.blobstore import BlobStores
+from vfxconfig.replay import RemoteFolderReplay
+from vfxconfig.schema import load_manifest
+from vfxconfig.paths import ensure_folder
+from vfxconfig.cachefolders import STATS_FOLDER
+from vfxconfig import instrument
+from vfxconfig import pftrack
+
+# the folder schema of this configuration
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schema")
 
 class ProcessFolderCreation(Hook):
 
@@ -95,106 +111,70 @@ class ProcessFolderCreation(Hook):
         * "target": the target to which the symbolic link should point
         """
 
+        recorder = None
+        if instrument.is_enabled():
+            # time the items and count their file system calls,
+            # see vfxconfig.instrument
+            recorder = instrument.Recorder()
+
         # set the umask so that we get true permissions
         old_umask = os.umask(0)
-        folders = []
         try:
-
-            # loop through our list of items
-            for i in items:
-                action = i.get("action")
-
-                if action in ["entity_folder", "folder"]:
-                    # folder creation
-                    path = i.get("path")
-                    # print "entity_folder: %s"%path
-                    if not os.path.exists(path):
-                        if not preview_mode:
-                            # create the folder using open permissions
-                            os.makedirs(path, 0770)
-                            self.run_post_jobs(i)
-                        folders.append(path)
-
-
-                elif action == "remote_entity_folder":
-                    # Remote folder creation
-                    #
-                    # NOTE! This action happens when another user has created
-                    # a folder on their machine and we are syncing our local path
-                    # cache to be aware of this folder's existance.
-                    #
-                    # For a traditional setup, where the project storage is shared,
-                    # there is no need to do I/O for remote folders - these folders
-                    # have already been created on the remote storage so you have access
-                    # to them already.
-                    #
-                    # On a setup where each user or group of users is attached to
-                    # different, independendent file storages, which are synced,
-                    # it may be meaningful to "replay" the remote folder creation
-                    # on the local system. This would result in the same folder
-                    # scaffold on each disk which is storing project data.
-                    #
-                    # path = i.get("path")
-                    # if not os.path.exists(path):
-                    #     if not preview_mode:
-                    #         # create the folder using open permissions
-                    #         os.makedirs(path, 0777)
-                    #     folders.append(path)
-                    pass
-
-                elif action == "symlink":
-                    # symbolic link
-                    # print "symlink"
-                    if sys.platform == "win32":
-                        # no windows support
-                        continue
-                    path = i.get("path")
-                    target = i.get("target")
-                    # note use of lexists to check existance of symlink
-                    # rather than what symlink is pointing at
-                    if not os.path.lexists(path):
-                        if not preview_mode:
-                            os.symlink(target, path)
-                        folders.append(path)
-
-                elif action == "copy":
-                    # a file copy
-                    source_path = i.get("source_path")
-                    target_path = i.get("target_path")
-                    # print "copy %s--->%s"%(source_path,target_path)
-                    if not os.path.exists(target_path):
-                        if not preview_mode:
-                            # do a standard file copy
-                            shutil.copy(source_path, target_path)
-                            # set permissions to open
-                            os.chmod(target_path, 0660)
-                        folders.append(target_path)
-
-                elif action == "create_file":
-                    # create a new file based on content
-                    path = i.get("path")
-                    # print "create_file: %s"%path
-                    parent_folder = os.path.dirname(path)
-                    content = i.get("content")
-                    if not os.path.exists(parent_folder) and not preview_mode:
-                        os.makedirs(parent_folder, 0770)
-                    if not os.path.exists(path):
-                        if not preview_mode:
-                            # create the file
-                            fp = open(path, "wb")
-                            fp.write(content)
-                            fp.close()
-                            # and set permissions to open
-                            os.chmod(path, 0660)
-                        folders.append(path)
-
+            # folders are created depth level by depth level with a pool of
+            # threads, see vfxconfig.folders for the details.
+            blob_stores = None
+            if os.environ.get("TK_FOLDER_CREATION_BLOBS") == "1":
+                # opt-in: files created from content are read only hard
+                # links to a store of distinct contents, see
+                # vfxconfig.blobstore
+                blob_stores = BlobStores(self.parent.roots.values())
+            remote_replay = None
+            if os.environ.get("TK_REPLAY_REMOTE_FOLDERS") == "1":
+                # this site has its own synced storage, create the folders
+                # made at other sites, see vfxconfig.replay
+                remote_replay = RemoteFolderReplay()
+            # the schema files to copy are read from a compiled manifest,
+            # see vfxconfig.schema
+            try:
+                manifest = load_manifest(SCHEMA_PATH)
+            except Exception, e:
+                # the files are read from the schema instead
+                print "Could not load the schema manifest: %s" % e
+                manifest = None
+            engine = FolderCreationEngine(preview_mode,
+                                          post_job_cb=self.run_post_jobs,
+                                          blob_stores=blob_stores,
+                                          remote_replay=remote_replay,
+                                          manifest=manifest,
+                                          recorder=recorder)
+            folders = engine.execute(items)
 
         finally:
             # reset umask
             os.umask(old_umask)
 
+        if recorder:
+            self.write_stats(recorder)
+
         return folders
 
+    def write_stats(self, recorder):
+        """
+        Write the instrumentation of a run next to the bundle caches of
+        the project.
+        """
+        try:
+            # the bundle caches are folders next to the path cache
+            cache_root = os.path.dirname(self.parent.pipeline_configuration.get_path_cache_location())
+            stats_folder = os.path.join(cache_root, STATS_FOLDER)
+            ensure_folder(stats_folder, 0777)
+            (summary_path, trace_path) = recorder.write(stats_folder)
+        except Exception, e:
+            # instrumentation must never break folder creation
+            print "Could not write the folder creation stats: %s" % e
+            return
+        print "Folder creation stats written to %s and %s" % (summary_path, trace_path)
+
     def run_post_jobs(self,item):
         entity = item.get("entity")
         if entity is not None:
@@ -203,36 +183,9 @@ class ProcessFolderCreation(Hook):
                     self.tracking_post_job(item)
 
     def tracking_post_job(self,item):
-        # Creating project
-        print "-------------- Init Pftrack Project: --------------"
-        entity = item.get("entity")
-        path_to_folder =item.get("path")
+        # Creating project: this takes a while, so it is queued and done
+        # by background workers, see vfxconfig.pftrack.
+        path_to_folder = item.get("path")
         prod_name = os.environ['PROD']
-        split_path=path_to_folder.split(os.sep)
-        shot,seq = split_path[-2],split_path[-3]
-        project_name = "%s-%s_%s-TRACK"%(prod_name,seq,shot)
-        project_path = path_to_folder + os.sep + project_name
-        if not os.path.lexists(project_path):
-            cmd = "pftrack -new_project %s -exit"%project_path
-            os.system(cmd)
-
-        # Editing project file
-        import xml.etree.ElementTree as ET
-        import getpass
-
-        project_settings_path = project_path + os.sep + project_name + ".pfmp"
-        tree = ET.parse(project_settings_path)
-        root = tree.getroot()
-        for defaultFrameRate in root.findall('defaultFrameRate'):
-            rate = 23.976
-            defaultFrameRate.text = str(rate)
-            print "Updated Frame Rate: %s"%defaultFrameRate.text
-
-        for cache in root.findall('cache'):
-            new_cache =  os.sep + "datas" + os.sep + getpass.getuser() + os.sep + "cache"
-            cache.text = str(new_cache)
-            print cache.text
-
-        tree.write(project_settings_path)
-
-
+        job_id = pftrack.submit_bootstrap(path_to_folder, prod_name)
+        print "-------------- Queued Pftrack Project (job %d): %s --------------" % (job_id, path_to_folder)
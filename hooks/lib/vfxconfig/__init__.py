@@ -0,0 +1,17 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Helper library shared by the core hooks and app hooks of this configuration.
+
+Hooks are loaded by file path and cannot import each other, so code which is
+needed by more than one hook lives here. Hooks add the parent folder of this
+package to sys.path before importing from it.
+"""
@@ -0,0 +1,189 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Content addressed store for the files written by folder creation.
+
+The create_file items of the folder schema write the same content in every
+shot and asset. Each distinct content is stored once, in a blob named after
+its hash, and the files are hard links to that blob.
+
+Blobs are read only, and so are the files linked to them: all the files
+share the same data, so they must not be modified in place. A file can
+still be replaced by saving a new file over it.
+
+Linux only allows to hard link a read only file to its owner, so each user
+gets their own set of blobs.
+
+As the created files are no longer separate writable files, the store is
+only used by folder creation when the TK_FOLDER_CREATION_BLOBS environment
+variable is set to 1, for projects whose created files are never edited.
+"""
+
+import os
+import errno
+import hashlib
+import tempfile
+import threading
+
+# location of the store, relative to a project storage root
+STORE_FOLDER = os.path.join("_admin", ".tk_blobs")
+
+# shared by all the files linked to a blob, a chmod of one of them changes
+# all of them
+BLOB_MODE = 0444
+
+# errors meaning that a blob cannot be linked to the target
+_CANNOT_LINK = set([errno.EXDEV, errno.EMLINK, errno.EPERM,
+                    getattr(errno, "EOPNOTSUPP", errno.EPERM)])
+
+
+class BlobStore(object):
+    """
+    A folder holding blobs named after the sha1 of their content.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: Folder of the store, created when the first blob is stored
+        """
+        self._root = root
+        # digests known to be in the store
+        self._known = set()
+        self._lock = threading.Lock()
+
+    @property
+    def root(self):
+        """
+        Folder of the store
+        """
+        return self._root
+
+    def blob_path(self, digest):
+        """
+        Return the path of the blob with the given digest.
+        """
+        owner = str(os.getuid()) if hasattr(os, "getuid") else "all"
+        return os.path.join(self._root, owner, digest[:2], digest[2:])
+
+    def put(self, content):
+        """
+        Store some content.
+
+        :param content: The data to store
+        :returns: The path to the blob holding the content
+        """
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        digest = hashlib.sha1(content).hexdigest()
+        path = self.blob_path(digest)
+        with self._lock:
+            if digest in self._known:
+                return path
+
+        if not os.path.exists(path):
+            folder = os.path.dirname(path)
+            try:
+                os.makedirs(folder, 0770)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            # write it aside and move it in place, a blob is always complete
+            (fd, tmp_path) = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+            try:
+                while content:
+                    content = content[os.write(fd, content):]
+            finally:
+                os.close(fd)
+            os.chmod(tmp_path, BLOB_MODE)
+            os.rename(tmp_path, path)
+
+        with self._lock:
+            self._known.add(digest)
+        return path
+
+    def link(self, content, target):
+        """
+        Create a file with the given content as a hard link to its blob.
+
+        :param content: The file content
+        :param target:  Path of the new file, which must not exist
+        :returns: False if the target cannot be linked to the store, for
+                  example because it is on another file system
+        :raises OSError: With errno EEXIST if the target exists
+        """
+        try:
+            blob = self.put(content)
+        except (IOError, OSError):
+            # the store is not writable, this is not fatal
+            return False
+        try:
+            os.link(blob, target)
+        except OSError, e:
+            if e.errno == errno.ENOENT and not os.path.exists(blob):
+                # the blob was removed since we stored it, store it again
+                return self._link_again(content, target)
+            if e.errno in _CANNOT_LINK:
+                return False
+            raise
+        return True
+
+    def _link_again(self, content, target):
+        """
+        Store again some content whose blob went missing, and link it.
+        """
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        with self._lock:
+            self._known.discard(hashlib.sha1(content).hexdigest())
+        try:
+            blob = self.put(content)
+        except (IOError, OSError):
+            return False
+        try:
+            os.link(blob, target)
+        except OSError, e:
+            if e.errno in _CANNOT_LINK:
+                return False
+            raise
+        return True
+
+
+class BlobStores(object):
+    """
+    The blob stores of a set of project storage roots. A file is linked to
+    the store of the storage it belongs to.
+    """
+
+    def __init__(self, storage_roots):
+        """
+        :param storage_roots: List of project storage root paths
+        """
+        self._stores = []
+        for root in storage_roots:
+            prefix = os.path.normpath(root) + os.sep
+            self._stores.append((prefix, BlobStore(os.path.join(root, STORE_FOLDER))))
+        # most specific root first
+        self._stores.sort(key=lambda x: len(x[0]), reverse=True)
+
+    def link(self, content, target):
+        """
+        Create a file with the given content as a hard link to a blob of the
+        store of its storage.
+
+        :param content: The file content
+        :param target:  Path of the new file, which must not exist
+        :returns: False if the file could not be linked to a store
+        """
+        target_path = os.path.normpath(target)
+        for (prefix, store) in self._stores:
+            if target_path.startswith(prefix):
+                return store.link(content, target)
+        return False
@@ -0,0 +1,26 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Names of the folders this configuration keeps in a cache root, next to the
+bundle caches of the apps.
+"""
+
+# per host shards of the cache root, see cacheshard
+SHARDS_FOLDER = "hosts"
+
+# work file version indexes, see versionindex
+INDEX_FOLDER = "version_index"
+
+# folder creation instrumentation, see instrument and process_folder_creation
+STATS_FOLDER = "folder_creation"
+
+# folders of a cache root which are not bundle caches
+CONFIG_FOLDERS = (SHARDS_FOLDER, INDEX_FOLDER, STATS_FOLDER)
@@ -0,0 +1,71 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Per host shards of the cache roots.
+
+All the machines of a user share the same path cache in their home share,
+and when jobs fan out across the farm dozens of processes contend for its
+sqlite lock over NFS. The TK_CACHE_SHARD environment variable gives each
+machine its own cache root:
+
+* "host": a folder per host name below the shared cache root
+* "local": a folder on the local disk of the machine
+
+A new shard is seeded from the snapshot of its project when there is one,
+see pathcache, so it does not have to sync the whole history again. It is
+never copied from the live shared path cache: the copy would lock every
+writer out of it for its duration, and sqlite locks are not reliable over
+NFS anyway. Shards are never written back, the shared path cache stays with
+the workstations.
+"""
+
+import os
+import socket
+
+from .paths import local_cache_root
+from .cachefolders import SHARDS_FOLDER
+
+ENV_VAR = "TK_CACHE_SHARD"
+
+
+def shard_mode():
+    """
+    Return the shard mode: "host", "local", or None if disabled.
+    """
+    mode = os.environ.get(ENV_VAR)
+    if mode in ("host", "local"):
+        return mode
+    return None
+
+
+def host_name():
+    """
+    Return the short name of the machine.
+    """
+    return socket.gethostname().split(".")[0]
+
+
+def shard_root(cache_root, base_root):
+    """
+    Return the cache root of the current machine.
+
+    :param cache_root: Shared cache root
+    :param base_root:  Root of all the shared caches, the local shards mirror
+                       the folders below it
+    :returns: Path to the shard, or None if sharding is disabled
+    """
+    mode = shard_mode()
+    if mode == "host":
+        return os.path.join(cache_root, SHARDS_FOLDER, host_name())
+    if mode == "local":
+        relative = os.path.relpath(os.path.normpath(cache_root), base_root)
+        return os.path.join(local_cache_root(), "cache_shards", relative)
+    return None
@@ -0,0 +1,406 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Local disk tier for the toolkit caches.
+
+The path cache and the bundle caches live in the home share of the user,
+where every sqlite lookup pays the latency of the filer. When the
+TK_CACHE_TIER environment variable is set to "local", the cache_location
+hook hands out copies of them on the local disk instead:
+
+* the first time a cache is used on a machine, it is warmed up from the
+  copy on the share
+* the local copies are written back to the share periodically (every
+  TK_CACHE_WRITE_BACK_INTERVAL seconds, 300 by default) and when the
+  process exits
+
+A database is written back from a snapshot of the local copy, so the local
+copy is only locked while it is copied on the local disk. The snapshot
+replaces the copy on the share in one rename, once sqlite checked it, so the
+share never holds a partial file. When the copy on the share was written by
+another host since it was last pulled, the rows of the snapshot missing from
+it are merged into it instead (see MERGED_TABLES), rather than replacing the
+rows the other host wrote.
+"""
+
+import os
+import time
+import atexit
+import shutil
+import logging
+import sqlite3
+import threading
+
+from .paths import local_cache_root, ensure_folder
+
+log = logging.getLogger(__name__)
+
+ENV_VAR = "TK_CACHE_TIER"
+
+DEFAULT_WRITE_BACK_INTERVAL = 300
+
+# tables whose rows are merged into a copy on the share written by another
+# host. Their rows are identified by their content. The other tables, such
+# as the event log sync id of the path cache, keep the state of the share,
+# the toolkit syncs the rows it misses again.
+MERGED_TABLES = ("path_cache",)
+
+# attempts at merging into a copy on the share which keeps being written
+MERGE_ATTEMPTS = 3
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+_write_back_thread = None
+
+
+def is_enabled():
+    """
+    Check if the caches should be used from the local disk.
+    """
+    return os.environ.get(ENV_VAR) == "local"
+
+
+def get_tier(remote_root, base_root):
+    """
+    Return the local tier of a cache root, creating it the first time.
+
+    :param remote_root: Cache root on the share
+    :param base_root:   Root of all the caches on the share, the local tier
+                        mirrors the folders below it
+    :returns: A CacheTier
+    """
+    remote_root = os.path.normpath(remote_root)
+    with _tiers_lock:
+        tier = _tiers.get(remote_root)
+        if tier is None:
+            relative = os.path.relpath(remote_root, base_root)
+            local_root = os.path.join(local_cache_root(), "cache_tier", relative)
+            tier = _tiers[remote_root] = CacheTier(remote_root, local_root)
+            _start_write_back()
+        return tier
+
+
+def write_back_all():
+    """
+    Write back all the local tiers of the process to the share.
+    """
+    with _tiers_lock:
+        tiers = _tiers.values()
+    for tier in tiers:
+        try:
+            tier.write_back()
+        except Exception, e:
+            # the next write back will try again
+            log.warning("Could not write back %s: %s" % (tier.local_root, e))
+
+
+def _start_write_back():
+    """
+    Start the thread writing back the tiers periodically, and register the
+    final write back at exit.
+    """
+    global _write_back_thread
+    if _write_back_thread is not None:
+        return
+    try:
+        interval = float(os.environ.get("TK_CACHE_WRITE_BACK_INTERVAL", DEFAULT_WRITE_BACK_INTERVAL))
+    except ValueError:
+        interval = DEFAULT_WRITE_BACK_INTERVAL
+
+    def run():
+        while True:
+            time.sleep(interval)
+            write_back_all()
+
+    _write_back_thread = threading.Thread(target=run, name="cache_tier_write_back")
+    _write_back_thread.daemon = True
+    _write_back_thread.start()
+    atexit.register(write_back_all)
+
+
+def check_database(path):
+    """
+    Run the sqlite quick integrity check on a database.
+
+    :returns: True if the database is sound
+    """
+    try:
+        conn = sqlite3.connect(path, timeout=60)
+        try:
+            return conn.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+
+
+def copy_database(source, target, lock=True):
+    """
+    Copy a sqlite database to a new location, replacing the target in one go.
+
+    The source is locked against writers while it is copied, and the copy
+    is checked before it replaces the target. A source in WAL mode is copied
+    with its log, and the copy is switched back to a single file.
+
+    :param lock: False for a source which is never written in place, such as
+                 a path cache snapshot, which is then copied without a lock
+    :returns: False if the copy did not pass the integrity check
+    """
+    tmp_target = "%s.tmp-%d" % (target, os.getpid())
+    if lock:
+        conn = sqlite3.connect(source, timeout=60)
+        try:
+            # a reserved lock keeps the other connections from writing, and
+            # nothing of ours is pending, so the files on disk are consistent.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                shutil.copyfile(source, tmp_target)
+                if os.path.exists(source + "-wal"):
+                    shutil.copyfile(source + "-wal", tmp_target + "-wal")
+            finally:
+                conn.rollback()
+        finally:
+            conn.close()
+    else:
+        shutil.copyfile(source, tmp_target)
+    if not check_database(tmp_target):
+        for path in [tmp_target, tmp_target + "-wal", tmp_target + "-shm"]:
+            if os.path.exists(path):
+                os.remove(path)
+        return False
+    if os.path.exists(tmp_target + "-wal"):
+        # fold the log into the database, the copy may go to a share
+        conn = sqlite3.connect(tmp_target, timeout=60)
+        try:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            conn.close()
+    os.chmod(tmp_target, 0666)
+    os.rename(tmp_target, target)
+    return True
+
+
+def table_columns(conn, table, database="main"):
+    """
+    Return the column names of a table, in their order.
+
+    :param database: Name of the attached database holding the table
+    """
+    return [row[1] for row in conn.execute("PRAGMA %s.table_info(%s)" % (database, table))]
+
+
+def merge_database(source, target, tables):
+    """
+    Add the rows of tables of a database which are missing from another.
+
+    The rows are compared on the columns the tables have in common, so they
+    are added once, whatever their order or row ids.
+
+    :param source: Path to the database to read the rows from
+    :param target: Path to the database to add them to
+    :param tables: Names of the tables to merge, the ones missing from
+                   either database are skipped
+    :returns: Number of rows added
+    """
+    conn = sqlite3.connect(target, timeout=60)
+    try:
+        conn.execute("ATTACH DATABASE ? AS source", (source,))
+        try:
+            added = 0
+            with conn:
+                for table in tables:
+                    source_columns = table_columns(conn, table, "source")
+                    columns = [column for column in table_columns(conn, table) if column in source_columns]
+                    if not columns:
+                        continue
+                    columns = ", ".join(columns)
+                    added += conn.execute("INSERT INTO main.%s (%s) SELECT %s FROM source.%s "
+                                          "EXCEPT SELECT %s FROM main.%s"
+                                          % (table, columns, columns, table, columns, table)).rowcount
+            return added
+        finally:
+            conn.execute("DETACH DATABASE source")
+    finally:
+        conn.close()
+
+
+def file_state(path):
+    """
+    Return the modification time and size of a file, None if it is missing.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def sync_folder(source, target):
+    """
+    Copy the files of a folder which are missing or older in the target.
+    """
+    for folder, dirs, files in os.walk(source):
+        relative = os.path.relpath(folder, source)
+        target_folder = os.path.normpath(os.path.join(target, relative))
+        ensure_folder(target_folder, 0777)
+        for name in files:
+            source_path = os.path.join(folder, name)
+            target_path = os.path.join(target_folder, name)
+            try:
+                st = os.stat(source_path)
+                if os.path.exists(target_path):
+                    tst = os.stat(target_path)
+                    if tst.st_mtime >= st.st_mtime and tst.st_size == st.st_size:
+                        continue
+                # copy aside and rename, readers never see a partial file
+                tmp_path = "%s.tmp-%d" % (target_path, os.getpid())
+                shutil.copy2(source_path, tmp_path)
+                os.rename(tmp_path, target_path)
+            except (IOError, OSError), e:
+                # files of a cache come and go, this is not fatal
+                log.debug("Could not sync %s: %s" % (source_path, e))
+
+
+class CacheTier(object):
+    """
+    The local copy of a cache root.
+    """
+
+    def __init__(self, remote_root, local_root):
+        """
+        :param remote_root: Cache root on the share
+        :param local_root:  Cache root on the local disk
+        """
+        self._remote_root = remote_root
+        self._local_root = local_root
+        # local name -> True for a database, False for a folder
+        self._entries = {}
+        # database name -> modification time of its last write back
+        self._written = {}
+        # database name -> state of the copy on the share when it was last
+        # pulled or replaced, while it holds no rows the local copy does not,
+        # see file_state()
+        self._pulled = {}
+        self._lock = threading.Lock()
+
+    @property
+    def local_root(self):
+        """
+        Cache root on the local disk
+        """
+        return self._local_root
+
+    def database(self, name):
+        """
+        Return the local path of a sqlite database of the cache root, warming
+        it up from the share the first time.
+
+        :param name: File name of the database, for example path_cache.db
+        :returns: Path to the local database, which may not exist yet
+        """
+        local_path = os.path.join(self._local_root, name)
+        remote_path = os.path.join(self._remote_root, name)
+        with self._lock:
+            if name not in self._entries:
+                ensure_folder(self._local_root, 0777)
+                if not os.path.exists(local_path) or not check_database(local_path):
+                    if os.path.exists(remote_path) and os.path.getsize(remote_path):
+                        log.debug("Warming up %s from %s" % (local_path, remote_path))
+                        state = file_state(remote_path)
+                        if copy_database(remote_path, local_path):
+                            self._pulled[name] = state
+                        else:
+                            log.warning("Ignoring corrupt cache database %s" % remote_path)
+                self._entries[name] = True
+        return local_path
+
+    def folder(self, name):
+        """
+        Return the local path of a folder of the cache root, warming it up
+        from the share the first time.
+
+        :param name: Name of the folder, for example the name of a bundle
+        :returns: Path to the local folder, which may not exist yet
+        """
+        local_path = os.path.join(self._local_root, name)
+        remote_path = os.path.join(self._remote_root, name)
+        with self._lock:
+            if name not in self._entries:
+                if not os.path.exists(local_path) and os.path.isdir(remote_path):
+                    log.debug("Warming up %s from %s" % (local_path, remote_path))
+                    sync_folder(remote_path, local_path)
+                self._entries[name] = False
+        return local_path
+
+    def write_back(self):
+        """
+        Copy the local caches back to the share.
+        """
+        with self._lock:
+            entries = self._entries.items()
+        for (name, is_database) in entries:
+            local_path = os.path.join(self._local_root, name)
+            remote_path = os.path.join(self._remote_root, name)
+            if is_database:
+                if not os.path.exists(local_path) or not os.path.getsize(local_path):
+                    continue
+                # with WAL journaling, the changes may only be in the log
+                mtime = max(os.path.getmtime(path) for path in [local_path, local_path + "-wal"]
+                            if os.path.exists(path))
+                if self._written.get(name) == mtime:
+                    # unchanged since the last write back
+                    continue
+                if self._write_back_database(name, local_path, remote_path):
+                    self._written[name] = mtime
+            elif os.path.isdir(local_path):
+                sync_folder(local_path, remote_path)
+
+    def _write_back_database(self, name, local_path, remote_path):
+        """
+        Write back a local database to the share, from a snapshot of it.
+
+        :returns: True if the database was written back
+        """
+        snapshot = "%s.snapshot-%d" % (local_path, os.getpid())
+        # the local database is only locked for a copy on the local disk
+        if not copy_database(local_path, snapshot):
+            log.warning("Not writing back corrupt cache database %s" % local_path)
+            return False
+        merged = "%s.merge-%d" % (local_path, os.getpid())
+        try:
+            for attempt in range(MERGE_ATTEMPTS):
+                state = file_state(remote_path)
+                if state is None or state == self._pulled.get(name):
+                    # nobody wrote the share since we did, replace it
+                    copy_database(snapshot, remote_path, lock=False)
+                    self._pulled[name] = file_state(remote_path)
+                    return True
+                if not copy_database(remote_path, merged):
+                    log.warning("Replacing corrupt cache database %s" % remote_path)
+                    copy_database(snapshot, remote_path, lock=False)
+                    self._pulled[name] = file_state(remote_path)
+                    return True
+                added = merge_database(snapshot, merged, MERGED_TABLES)
+                if file_state(remote_path) != state:
+                    # written again while we merged, start over
+                    continue
+                log.debug("Merged %d rows of %s into %s" % (added, local_path, remote_path))
+                copy_database(merged, remote_path, lock=False)
+                # the share now holds rows the local copy does not, the next
+                # write backs merge as well
+                self._pulled.pop(name, None)
+                return True
+            log.warning("Not writing back %s, %s keeps changing" % (local_path, remote_path))
+            return False
+        finally:
+            for path in [snapshot, merged]:
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,350 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Size bounded eviction of the bundle caches.
+
+Apps cache thumbnails and query results in their bundle cache folder, and
+never remove them. The files of the bundle caches of a cache root are
+tracked in an index file (size and last access), and the least recently
+used ones are removed until each bundle fits in its budget, and all the
+bundles together fit in the global budget.
+
+The index is refreshed incrementally at each trim, which runs in a
+background thread, at most once an hour per cache root, and is skipped if
+another process is already at it. The modification time of every folder of
+a bundle is recorded, and only the folders whose modification time changed
+are listed again: a refresh costs one stat per folder. The files of a
+folder which did not change keep their recorded access time, so a file is
+checked again just before it is removed, and kept if it was used since.
+Bundles are scanned in full once a day, to catch the files rewritten in
+place.
+
+Folders of the cache root which are not bundle caches (the per host shards,
+the version indexes, the folder creation stats) are never trimmed.
+
+    TK_BUNDLE_CACHE_BUDGET_MB   budget of a bundle, 500 by default
+    TK_CACHE_BUDGET_MB          budget of all the bundles, 2000 by default
+"""
+
+import os
+import time
+import json
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+
+from .cachefolders import CONFIG_FOLDERS
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = ".cache_index.json"
+LOCK_FILE = ".cache_index.lock"
+
+DEFAULT_BUNDLE_BUDGET_MB = 500
+DEFAULT_GLOBAL_BUDGET_MB = 2000
+
+# seconds between two trims of a cache root
+TRIM_INTERVAL = 3600
+# seconds between two full scans of a bundle folder
+RESCAN_INTERVAL = 24 * 3600
+# folder modification times closer than this to the listing are not trusted
+MTIME_RESOLUTION = 2.0
+# files used more recently than this are never removed
+MIN_AGE = 600
+
+# folders of a cache root which are not bundle caches: the per host shards
+# are cache roots of their own, the others are written by this configuration
+EXCLUDED_FOLDERS = CONFIG_FOLDERS
+
+_started = set()
+_started_lock = threading.Lock()
+
+
+def _budget(env_var, default_mb):
+    try:
+        return int(float(os.environ.get(env_var, default_mb)) * 1024 * 1024)
+    except ValueError:
+        return default_mb * 1024 * 1024
+
+
+class BundleCacheManager(object):
+    """
+    Tracks the files of the bundle caches of a cache root and evicts the
+    least recently used ones.
+    """
+
+    def __init__(self, cache_root, bundle_budget=None, global_budget=None):
+        """
+        :param cache_root:    Folder holding the bundle cache folders
+        :param bundle_budget: Maximum size of a bundle cache in bytes, defaults
+                              to TK_BUNDLE_CACHE_BUDGET_MB
+        :param global_budget: Maximum size of all the bundle caches in bytes,
+                              defaults to TK_CACHE_BUDGET_MB
+        """
+        self._root = cache_root
+        self._bundle_budget = bundle_budget or _budget("TK_BUNDLE_CACHE_BUDGET_MB", DEFAULT_BUNDLE_BUDGET_MB)
+        self._global_budget = global_budget or _budget("TK_CACHE_BUDGET_MB", DEFAULT_GLOBAL_BUDGET_MB)
+        self._index_path = os.path.join(cache_root, INDEX_FILE)
+
+    def load_index(self):
+        """
+        Return the index of the cache root.
+
+        :returns: Dictionary with the keys "trimmed", the time of the last
+                  trim, and "bundles", a dictionary of bundle name ->
+                  {"scanned": time of the last full scan,
+                   "dirs": {relative folder: [modification time, listing time]},
+                   "files": {relative path: [size, last access]}}
+        """
+        if os.path.isfile(self._index_path):
+            fh = open(self._index_path, "r")
+            try:
+                return json.load(fh)
+            except ValueError:
+                # truncated file, everything is scanned again
+                pass
+            finally:
+                fh.close()
+        return {"trimmed": 0, "bundles": {}}
+
+    def save_index(self, index):
+        """
+        Write the index of the cache root.
+        """
+        tmp_path = "%s.tmp-%d" % (self._index_path, os.getpid())
+        fh = open(tmp_path, "w")
+        try:
+            json.dump(index, fh)
+        finally:
+            fh.close()
+        os.rename(tmp_path, self._index_path)
+
+    def needs_trim(self):
+        """
+        Check if the last trim of the cache root is old enough for a new one.
+        """
+        return time.time() - self.load_index().get("trimmed", 0) > TRIM_INTERVAL
+
+    def scan_bundle(self, name):
+        """
+        List all the files of a bundle cache.
+
+        :param name: Name of the bundle folder
+        :returns: Index entry of the bundle, see load_index()
+        """
+        entry = {"scanned": time.time(), "dirs": {}, "files": {}}
+        self.refresh_bundle(name, entry)
+        return entry
+
+    def refresh_bundle(self, name, entry):
+        """
+        Bring the index entry of a bundle up to date, listing only the
+        folders which changed since they were last listed.
+
+        :param name:  Name of the bundle folder
+        :param entry: Index entry of the bundle, updated in place
+        """
+        bundle_folder = os.path.join(self._root, name)
+        files = entry["files"]
+        dirs = entry["dirs"]
+        # recorded files and sub folders of each folder
+        folder_files = {}
+        for relative in files:
+            folder_files.setdefault(os.path.dirname(relative) or ".", []).append(relative)
+        children = {}
+        for relative in dirs:
+            if relative != ".":
+                children.setdefault(os.path.dirname(relative) or ".", []).append(relative)
+
+        visited = set()
+        pending = ["."]
+        while pending:
+            relative = pending.pop()
+            folder = os.path.normpath(os.path.join(bundle_folder, relative))
+            try:
+                mtime = os.stat(folder).st_mtime
+            except OSError:
+                continue
+            visited.add(relative)
+            recorded = dirs.get(relative)
+            if recorded and recorded[0] == mtime and recorded[1] - mtime > MTIME_RESOLUTION:
+                pending.extend(children.get(relative, []))
+                continue
+            now = time.time()
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                continue
+            dirs[relative] = [mtime, now]
+            for key in folder_files.get(relative, []):
+                files.pop(key, None)
+            prefix = "" if relative == "." else relative + os.sep
+            for file_name in names:
+                try:
+                    st = os.stat(os.path.join(folder, file_name))
+                except OSError:
+                    continue
+                if os.path.isdir(os.path.join(folder, file_name)):
+                    pending.append(prefix + file_name)
+                else:
+                    files[prefix + file_name] = [st.st_size, max(st.st_atime, st.st_mtime)]
+
+        # folders gone since the last refresh
+        for relative in set(dirs) - visited:
+            del dirs[relative]
+            for key in folder_files.get(relative, []):
+                files.pop(key, None)
+
+    def trim(self):
+        """
+        Refresh the index and evict files until the budgets are met.
+
+        :returns: Number of bytes freed, or None if another process is
+                  trimming this cache root
+        """
+        lock_fh = open(os.path.join(self._root, LOCK_FILE), "a")
+        try:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    return None
+            return self._trim()
+        finally:
+            lock_fh.close()
+
+    def _trim(self):
+        now = time.time()
+        index = self.load_index()
+        bundles = index.setdefault("bundles", {})
+
+        names = [n for n in os.listdir(self._root)
+                 if n not in EXCLUDED_FOLDERS and os.path.isdir(os.path.join(self._root, n))]
+        for name in bundles.keys():
+            if name not in names:
+                del bundles[name]
+        for name in names:
+            entry = bundles.get(name)
+            if entry is None or "dirs" not in entry or now - entry.get("scanned", 0) > RESCAN_INTERVAL:
+                bundles[name] = self.scan_bundle(name)
+            else:
+                self.refresh_bundle(name, entry)
+
+        freed = 0
+        # each bundle within its own budget
+        for (name, entry) in bundles.items():
+            freed += self._evict(name, entry["files"], self._bundle_budget, now)
+
+        # all of them within the global budget
+        all_files = {}
+        for (name, entry) in bundles.items():
+            for (relative, info) in entry["files"].items():
+                all_files[(name, relative)] = info
+        total = sum(info[0] for info in all_files.values())
+        for (name, relative) in self._candidates(all_files, now):
+            if total <= self._global_budget:
+                break
+            removed = self._remove(name, relative, bundles[name]["files"], now)
+            total -= removed
+            freed += removed
+
+        index["trimmed"] = now
+        self.save_index(index)
+        if freed:
+            log.info("Freed %d bytes of bundle caches in %s" % (freed, self._root))
+        return freed
+
+    def _candidates(self, files, now):
+        """
+        Return the keys of the files which may be removed, least recently
+        used first, according to the index.
+        """
+        candidates = []
+        for (key, info) in sorted(files.items(), key=lambda x: x[1][1]):
+            if now - info[1] < MIN_AGE:
+                # everything after this one is recent too
+                break
+            candidates.append(key)
+        return candidates
+
+    def _evict(self, name, files, budget, now):
+        """
+        Evict the least recently used files of a bundle above its budget.
+
+        :returns: Number of bytes freed
+        """
+        total = sum(info[0] for info in files.values())
+        freed = 0
+        for relative in self._candidates(files, now):
+            if total <= budget:
+                break
+            removed = self._remove(name, relative, files, now)
+            total -= removed
+            freed += removed
+        return freed
+
+    def _remove(self, name, relative, files, now):
+        """
+        Remove a file of a bundle cache and forget it, unless it was used
+        since the bundle was scanned.
+
+        :returns: Number of bytes freed
+        """
+        if relative not in files:
+            return 0
+        path = os.path.join(self._root, name, relative)
+        try:
+            st = os.stat(path)
+        except OSError:
+            # already gone
+            del files[relative]
+            return 0
+        last_access = max(st.st_atime, st.st_mtime)
+        if now - last_access < MIN_AGE:
+            # in use, keep it with its current size and access time
+            files[relative] = [st.st_size, last_access]
+            return 0
+        del files[relative]
+        try:
+            os.remove(path)
+        except OSError:
+            return 0
+        return st.st_size
+
+
+def trim_in_background(cache_root):
+    """
+    Trim the bundle caches of a cache root in a background thread, if it
+    was not trimmed recently. Does nothing if it was already requested by
+    this process.
+    """
+    with _started_lock:
+        if cache_root in _started:
+            return
+        _started.add(cache_root)
+
+    def run():
+        try:
+            manager = BundleCacheManager(cache_root)
+            if manager.needs_trim():
+                manager.trim()
+        except Exception, e:
+            # a cache which is not trimmed is not a problem
+            log.warning("Could not trim the bundle caches of %s: %s" % (cache_root, e))
+
+    thread = threading.Thread(target=run, name="bundle_cache_trim")
+    thread.daemon = True
+    thread.start()
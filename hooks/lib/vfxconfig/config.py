@@ -0,0 +1,43 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Access to the files of this configuration.
+"""
+
+import os
+
+# root of the configuration, this package lives in <config>/hooks/lib
+CONFIG_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def config_path(*parts):
+    """
+    Return the path to a file of the configuration.
+
+    :param parts: Path components relative to the configuration root
+    """
+    return os.path.join(CONFIG_ROOT, *parts)
+
+
+def load_yaml(path):
+    """
+    Parse a yml file, with the yaml module shipped with the toolkit if
+    there is no other one.
+    """
+    try:
+        import yaml
+    except ImportError:
+        from tank_vendor import yaml
+    fh = open(path, "r")
+    try:
+        return yaml.safe_load(fh)
+    finally:
+        fh.close()
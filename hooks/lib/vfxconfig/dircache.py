@@ -0,0 +1,144 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Process wide cache of the folders known to exist.
+
+The ensure_folder_exists hook is called from loops, for example once per
+rendered frame when a render is published. Every folder it has created or
+found on disk is remembered, so asking for the same folder again does not
+touch the disk. The cache is bounded, the least recently used folders are
+forgotten first.
+
+Folders can be removed behind our back, so a caller getting an error when
+writing into a folder from the cache must forget() it.
+"""
+
+import os
+import errno
+import threading
+from collections import OrderedDict
+
+from .replay import coalesce_leaves
+
+# maximum number of folders remembered.
+# Can be overridden with the TK_KNOWN_FOLDERS_SIZE environment variable.
+DEFAULT_SIZE = 10000
+
+_known_folders = None
+_known_folders_lock = threading.Lock()
+
+
+class KnownFolders(object):
+    """
+    Thread safe, bounded set of the folders known to exist.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        """
+        :param size: Maximum number of folders remembered
+        """
+        self._size = size
+        self._folders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, path):
+        path = os.path.normpath(path)
+        with self._lock:
+            if path not in self._folders:
+                return False
+            # most recently used last
+            del self._folders[path]
+            self._folders[path] = True
+            return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._folders)
+
+    def add(self, path):
+        """
+        Remember that a folder and all its parents exist.
+        """
+        path = os.path.normpath(path)
+        chain = [path]
+        while os.path.dirname(chain[-1]) != chain[-1]:
+            chain.append(os.path.dirname(chain[-1]))
+        with self._lock:
+            # the folder itself is the most recently used
+            for folder in reversed(chain):
+                if folder in self._folders:
+                    del self._folders[folder]
+                self._folders[folder] = True
+            while len(self._folders) > self._size:
+                self._folders.popitem(last=False)
+
+    def forget(self, path):
+        """
+        Forget a folder and all the folders below it.
+        """
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        with self._lock:
+            for folder in [f for f in self._folders if f == path or f.startswith(prefix)]:
+                del self._folders[folder]
+
+    def clear(self):
+        """
+        Forget all the folders.
+        """
+        with self._lock:
+            self._folders.clear()
+
+
+def known_folders():
+    """
+    Return the process wide cache of the folders known to exist.
+    """
+    global _known_folders
+    with _known_folders_lock:
+        if _known_folders is None:
+            try:
+                size = int(os.environ.get("TK_KNOWN_FOLDERS_SIZE", DEFAULT_SIZE))
+            except ValueError:
+                size = DEFAULT_SIZE
+            _known_folders = KnownFolders(size)
+        return _known_folders
+
+
+def ensure_folders_exist(paths, mode=0770):
+    """
+    Make sure that a list of folders exist, creating the missing ones.
+
+    The paths are deduplicated and only the leaf folders which are not known
+    to exist are looked at: a single makedirs per leaf creates it together
+    with its missing parents.
+
+    :param paths: List of folder paths
+    :param mode:  Permissions of the created folders, subject to the umask
+    :returns: List of the leaf folders which were created
+    """
+    cache = known_folders()
+    missing = [path for path in set(os.path.normpath(p) for p in paths) if path not in cache]
+    created = []
+    for leaf in coalesce_leaves(missing):
+        try:
+            os.makedirs(leaf, mode)
+            created.append(leaf)
+        except OSError, e:
+            # Race conditions are perfectly possible on some network storage setups
+            # so make sure that we ignore any file already exists errors, as they
+            # are not really errors!
+            if e.errno != errno.EEXIST or not os.path.isdir(leaf):
+                # some of our knowledge about this location is wrong
+                cache.forget(leaf)
+                raise
+        cache.add(leaf)
+    return created
@@ -0,0 +1,162 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Environment decision table used by the pick_environment core hook.
+
+The rules are read once from core/pick_environment.yml. The environment
+only depends on the signature of a context: its entity type and whether it
+has a step and a task, so the answer for each signature is memoized.
+
+A micro benchmark resolving the environment of many contexts in a row:
+
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.envtable [count]
+"""
+
+import sys
+import time
+import fnmatch
+import threading
+
+from .config import config_path, load_yaml
+
+TABLE_PATH = config_path("core", "pick_environment.yml")
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def context_signature(context):
+    """
+    Return the part of a context the environment depends on.
+
+    :param context: A toolkit context
+    :returns: Tuple (has project, entity type or None, has step, has task)
+    """
+    entity = context.entity
+    return (context.project is not None,
+            entity["type"] if entity else None,
+            context.step is not None,
+            context.task is not None)
+
+
+def _as_bool(value):
+    """
+    Convert a rule value read from yml to a boolean, or None for "any".
+    """
+    if value is None:
+        return None
+    if isinstance(value, basestring):
+        return value.lower() in ("true", "yes", "1")
+    return bool(value)
+
+
+class EnvironmentTable(object):
+    """
+    Ordered list of rules mapping context signatures to environment names.
+    """
+
+    def __init__(self, rules):
+        """
+        :param rules: List of rule dictionaries, see core/pick_environment.yml
+        """
+        self._rules = []
+        for rule in rules:
+            entity_type = rule.get("entity_type", "*")
+            if entity_type in (None, "None", "none"):
+                entity_type = None
+            self._rules.append((entity_type,
+                                _as_bool(rule.get("step")),
+                                _as_bool(rule.get("task")),
+                                rule["environment"]))
+        self._memo = {}
+
+    def pick(self, signature):
+        """
+        Return the environment of a context signature.
+
+        :param signature: See context_signature()
+        :returns: Environment name, or None
+        """
+        try:
+            return self._memo[signature]
+        except KeyError:
+            pass
+        environment = self._evaluate(signature)
+        self._memo[signature] = environment
+        return environment
+
+    def _evaluate(self, signature):
+        (has_project, entity_type, has_step, has_task) = signature
+        if not has_project:
+            # our context is completely empty!
+            # don't know how to handle this case.
+            return None
+        for (rule_type, rule_step, rule_task, environment) in self._rules:
+            if rule_type is None:
+                if entity_type is not None:
+                    continue
+            elif entity_type is None or not fnmatch.fnmatchcase(entity_type, rule_type):
+                continue
+            if rule_step is not None and rule_step != has_step:
+                continue
+            if rule_task is not None and rule_task != has_task:
+                continue
+            return environment
+        return None
+
+
+def get_table(path=TABLE_PATH):
+    """
+    Return the decision table of a rules file, loaded once per process.
+
+    :param path: Path to the rules file
+    :returns: An EnvironmentTable
+    """
+    with _tables_lock:
+        table = _tables.get(path)
+        if table is None:
+            data = load_yaml(path) or {}
+            table = _tables[path] = EnvironmentTable(data.get("rules") or [])
+        return table
+
+
+def main(argv):
+    """
+    Micro benchmark of the decision table.
+    """
+    count = int(argv[1]) if len(argv) > 1 else 100000
+    signatures = [(True, None, False, False),
+                  (True, "Shot", False, False),
+                  (True, "Shot", True, True),
+                  (True, "Asset", True, False),
+                  (True, "Sequence", True, True),
+                  (True, "CustomEntity03", False, False)]
+
+    table = get_table()
+    start = time.time()
+    for index in xrange(count):
+        table._evaluate(signatures[index % len(signatures)])
+    evaluated = time.time() - start
+
+    start = time.time()
+    for index in xrange(count):
+        table.pick(signatures[index % len(signatures)])
+    memoized = time.time() - start
+
+    for signature in signatures:
+        print "%-45s %s" % (signature, table.pick(signature))
+    print "%d contexts: %.3f us each evaluated, %.3f us each memoized" % (
+        count, evaluated * 1e6 / count, memoized * 1e6 / count)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,175 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+File copy backend which avoids moving the data through python when it can.
+
+The strategies are tried in order:
+
+* hard link, only if allowed by the caller and the source is read only
+* reflink (copy on write clone), on file systems which support it
+* in-kernel copy with os.copy_file_range or os.sendfile, when available
+* buffered copy with large blocks
+
+The target file is created with its final permissions, there is no need
+for a chmod afterwards.
+"""
+
+import os
+import stat
+import errno
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+
+# ioctl request cloning a file on linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+BUFFER_SIZE = 1024 * 1024
+KERNEL_CHUNK_SIZE = 64 * BUFFER_SIZE
+
+# errors meaning that a strategy is not supported for the given files
+_UNSUPPORTED = set([errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EINVAL,
+                    errno.ENOSYS, errno.ENOTTY, errno.EBADF,
+                    getattr(errno, "EOPNOTSUPP", errno.EINVAL),
+                    getattr(errno, "ENOTSUP", errno.EINVAL)])
+
+
+def is_immutable(path):
+    """
+    Check if a file is read only for everybody.
+
+    :param path: Path to the file
+    :returns: True if the file has no write permission bits
+    """
+    mode = os.stat(path).st_mode
+    return not (mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def copy_file(source, target, mode=0660, allow_link=False):
+    """
+    Copy a file to a new location.
+
+    :param source:     File to copy
+    :param target:     Path of the new file, which must not exist
+    :param mode:       Permissions of the new file, subject to the umask
+    :param allow_link: If True, a read only source is hard linked to the target.
+                       The target then keeps the permissions of the source.
+    :returns: Name of the strategy used: link, reflink, copy_file_range,
+              sendfile or buffered
+    :raises OSError: With errno EEXIST if the target exists
+    """
+    if allow_link and is_immutable(source):
+        try:
+            os.link(source, target)
+            return "link"
+        except OSError, e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+
+    src_fd = os.open(source, os.O_RDONLY)
+    try:
+        dst_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        try:
+            if _reflink(src_fd, dst_fd):
+                return "reflink"
+            for (name, func) in [("copy_file_range", _copy_file_range),
+                                 ("sendfile", _sendfile)]:
+                if func(src_fd, dst_fd):
+                    return name
+            _buffered_copy(src_fd, dst_fd)
+            return "buffered"
+        except:
+            os.close(dst_fd)
+            dst_fd = None
+            os.unlink(target)
+            raise
+        finally:
+            if dst_fd is not None:
+                os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def _reflink(src_fd, dst_fd):
+    """
+    Clone the source file into the target file.
+
+    :returns: False if the file system does not support it
+    """
+    if fcntl is None or not hasattr(fcntl, "ioctl"):
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except (IOError, OSError), e:
+        if e.errno in _UNSUPPORTED:
+            return False
+        raise
+    return True
+
+
+def _copy_file_range(src_fd, dst_fd):
+    """
+    Copy the file in the kernel with os.copy_file_range (python 3.8+).
+
+    :returns: False if not available or not supported
+    """
+    func = getattr(os, "copy_file_range", None)
+    if func is None:
+        return False
+    return _kernel_copy(lambda offset, count: func(src_fd, dst_fd, count, offset, offset))
+
+
+def _sendfile(src_fd, dst_fd):
+    """
+    Copy the file in the kernel with os.sendfile (python 3.3+).
+
+    :returns: False if not available or not supported
+    """
+    func = getattr(os, "sendfile", None)
+    if func is None:
+        return False
+    return _kernel_copy(lambda offset, count: func(dst_fd, src_fd, offset, count))
+
+
+def _kernel_copy(copy_chunk):
+    """
+    Run an in-kernel copy function until the end of the source file.
+
+    :param copy_chunk: Callable (offset, count) returning the number of bytes copied
+    :returns: False if the copy is not supported
+    """
+    offset = 0
+    try:
+        while True:
+            copied = copy_chunk(offset, KERNEL_CHUNK_SIZE)
+            if not copied:
+                return True
+            offset += copied
+    except OSError, e:
+        if offset == 0 and e.errno in _UNSUPPORTED:
+            return False
+        raise
+
+
+def _buffered_copy(src_fd, dst_fd):
+    """
+    Copy the data through user space, in large blocks.
+    """
+    while True:
+        data = os.read(src_fd, BUFFER_SIZE)
+        if not data:
+            return
+        while data:
+            written = os.write(dst_fd, data)
+            data = data[written:]
@@ -0,0 +1,275 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Fast extraction of the fields of the files of a folder.
+
+Finding versions parses every file of a folder with get_fields. The file
+name part of a template is compiled once to a regular expression, and the
+names of a folder listing are matched against it without building their
+paths. The fields of the folder part are the same for all the files of a
+folder, they are taken from a single get_fields call.
+
+The result is the same as get_fields: the values are converted and checked
+by the keys of the template, and a name is parsed by the template itself
+whenever the expression could split it in more than one way, or when its
+values disagree with the folder. Static parts of the file name must appear
+as is, names which do not match the expression are not work files.
+
+A self check comparing the extractor with get_fields on synthetic file names
+of every template of this configuration. It needs the toolkit core, found as
+for templatebench, and is also run, and fails the run, with the template
+benchmark:
+
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.fieldextract [samples]
+"""
+
+import os
+import re
+import sys
+import random
+
+_TOKENS = re.compile(r"(\{\w+\}|\[|\])")
+
+
+def _compile(file_part, keys, greedy):
+    """
+    Build the expression of the file name part of a template definition.
+
+    :returns: A compiled expression, or None if the definition uses
+              something the expression cannot express
+    """
+    pattern = ""
+    depth = 0
+    seen = set()
+    for token in _TOKENS.split(file_part):
+        if token == "[":
+            depth += 1
+            if depth > 1:
+                return None
+            pattern += "(?:"
+        elif token == "]":
+            depth -= 1
+            if depth < 0:
+                return None
+            pattern += ")?"
+        elif token.startswith("{") and token.endswith("}"):
+            name = token[1:-1]
+            if name not in keys:
+                return None
+            if name in seen:
+                # the same key must have the same value everywhere
+                pattern += "(?P=%s)" % name
+            else:
+                seen.add(name)
+                pattern += "(?P<%s>.+%s)" % (name, "" if greedy else "?")
+        elif "{" in token or "}" in token:
+            return None
+        else:
+            pattern += re.escape(token)
+    if depth:
+        return None
+    return re.compile(pattern + "$")
+
+
+class FieldExtractor(object):
+    """
+    Compiled file name parser of a template.
+    """
+
+    def __init__(self, template):
+        """
+        :param template: A path template
+        """
+        self._template = template
+        self._keys = template.keys
+        definition = template.definition.replace("\\", "/")
+        (folder_part, sep, file_part) = definition.rpartition("/")
+        self._file_keys = set(re.findall(r"\{(\w+)\}", file_part))
+        self._folder_keys = set(re.findall(r"\{(\w+)\}", folder_part))
+        self._lazy = None
+        self._greedy = None
+        if "[" not in folder_part[folder_part.rfind("]") + 1:]:
+            # the last folder separator is not inside an optional section
+            for (name, key) in self._keys.items():
+                if getattr(key, "alias", None) not in (None, name):
+                    # the field name differs from the key name
+                    break
+            else:
+                self._lazy = _compile(file_part, self._keys, False)
+                self._greedy = _compile(file_part, self._keys, True)
+
+    @property
+    def supported(self):
+        """
+        True if file names are parsed by the expression, False if every
+        file goes through the template.
+        """
+        return self._lazy is not None and self._greedy is not None
+
+    def _slow(self, path):
+        if self._template.validate(path):
+            return self._template.get_fields(path)
+        return None
+
+    def extract(self, folder, names, keys=None):
+        """
+        Parse the files of a folder.
+
+        :param folder: Folder of the files
+        :param names:  File names in the folder, for example a listing
+        :param keys:   Optional list of the fields to return
+        :returns: Generator of (name, fields) tuples, for the names matching
+                  the template
+        """
+        folder_fields = None
+        for name in names:
+            fields = None
+            if self.supported:
+                match = self._lazy.match(name)
+                if match is None:
+                    continue
+                values = match.groupdict()
+                if folder_fields is not None and values == self._greedy.match(name).groupdict():
+                    fields = self._convert(values, folder_fields)
+            if fields is None:
+                fields = self._slow(os.path.join(folder, name))
+                if fields is None:
+                    continue
+                if folder_fields is None:
+                    folder_fields = dict((k, v) for (k, v) in fields.items() if k in self._folder_keys)
+            if keys is not None:
+                fields = dict((k, fields[k]) for k in keys if k in fields)
+            yield (name, fields)
+
+    def _convert(self, values, folder_fields):
+        """
+        Convert the values matched in a file name to fields.
+
+        :returns: The fields, or None if the template has to decide
+        """
+        fields = dict(folder_fields)
+        for (name, value) in values.items():
+            if value is None:
+                # optional section not in the name
+                continue
+            try:
+                value = self._keys[name].value_from_str(value)
+            except Exception:
+                return None
+            if name in folder_fields and folder_fields[name] != value:
+                # a key of the folders with another value in the name
+                return None
+            fields[name] = value
+        return fields
+
+    def extract_paths(self, paths, keys=None):
+        """
+        Parse files given as paths, grouped by folder.
+
+        :returns: Dictionary of path -> fields, for the paths matching the
+                  template
+        """
+        folders = {}
+        for path in paths:
+            (folder, name) = os.path.split(path)
+            folders.setdefault(folder, []).append(name)
+        result = {}
+        for (folder, names) in folders.items():
+            for (name, fields) in self.extract(folder, names, keys):
+                result[os.path.join(folder, name)] = fields
+        return result
+
+
+def _mutations(name, rng):
+    """
+    Return variants of a file name, most of which are not valid work files.
+    """
+    variants = [name, name + "~", "." + name, name.upper(), name.replace("-", "--", 1),
+                name.replace("_", "-", 1), name.replace("v0", "v", 1), name[:-1]]
+    position = rng.randint(0, len(name))
+    variants.append(name[:position] + rng.choice("-_.vx0") + name[position:])
+    return variants
+
+
+def check(templates, samples=20, seed=0):
+    """
+    Compare the extractor with get_fields on synthetic file names of
+    templates, see templatebench for the synthetic fields.
+
+    :param templates: Dictionary of template name -> template
+    :param samples:   Synthetic field sets per template
+    :param seed:      Seed of the file name mutations
+    :returns: Tuple of the number of file names checked, a dictionary of
+              template name -> list of (file name, extracted fields,
+              get_fields result) for the templates with mismatches, and the
+              list of the templates parsed by the template only
+    """
+    from .templatebench import synthetic_fields
+    rng = random.Random(seed)
+    mismatches = {}
+    checked = 0
+    unsupported = []
+    for (template_name, template) in sorted(templates.items()):
+        if getattr(template, "root_path", None) is None:
+            continue
+        extractor = FieldExtractor(template)
+        if not extractor.supported:
+            unsupported.append(template_name)
+        names = set()
+        folder = None
+        for index in range(samples):
+            fields = synthetic_fields(template, index)
+            if fields is None:
+                continue
+            path = template.apply_fields(fields)
+            if folder is None:
+                folder = os.path.dirname(path)
+            if os.path.dirname(path) == folder:
+                names.update(_mutations(os.path.basename(path), rng))
+        if folder is None:
+            continue
+        expected = {}
+        for name in names:
+            path = os.path.join(folder, name)
+            if template.validate(path):
+                expected[name] = template.get_fields(path)
+        # extraction order must not matter
+        names = sorted(names)
+        rng.shuffle(names)
+        found = dict(extractor.extract(folder, names))
+        checked += len(names)
+        if found != expected:
+            mismatches[template_name] = [(name, found.get(name), expected.get(name))
+                                         for name in sorted(set(found) | set(expected))
+                                         if found.get(name) != expected.get(name)]
+    return (checked, mismatches, unsupported)
+
+
+def main(argv):
+    """
+    Compare the extractor with get_fields on the templates of this
+    configuration, see templatebench for how they are loaded.
+    """
+    from .templatebench import load_templates
+    samples = int(argv[1]) if len(argv) > 1 else 20
+    (checked, mismatches, unsupported) = check(load_templates(), samples)
+    for (template_name, differences) in sorted(mismatches.items()):
+        print "MISMATCH %s" % template_name
+        for (name, found, expected) in differences:
+            print "    %s: extracted %s, get_fields %s" % (name, found, expected)
+    print "%d file names checked, %d templates with mismatches" % (checked, len(mismatches))
+    if unsupported:
+        print "Parsed by the template only: %s" % ", ".join(unsupported)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
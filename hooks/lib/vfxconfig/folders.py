@@ -0,0 +1,328 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Folder creation engine used by the process_folder_creation core hook.
+
+The items handed to the hook are sorted into a plan ordered by path depth.
+Each depth level is created with a bounded pool of threads. Existence
+checks are answered by an ExistenceOracle which lists each parent folder
+once, and a folder whose parent was created earlier in the same run is
+known to be empty, so its children are created without touching the disk
+for existence checks.
+"""
+
+import os
+import sys
+import errno
+from multiprocessing.pool import ThreadPool
+
+from .oracle import ExistenceOracle
+from .fastcopy import copy_file
+from .instrument import NullRecorder
+
+# number of threads used to create the folders of one depth level.
+# Can be overridden with the TK_FOLDER_CREATION_THREADS environment variable.
+DEFAULT_THREADS = 8
+
+FOLDER_ACTIONS = ["entity_folder", "folder"]
+
+# if set to 1, read only files of the configuration are hard linked rather
+# than copied when the project storage is on the same file system.
+LINK_ENV_VAR = "TK_FOLDER_CREATION_LINK_CONFIG"
+
+
+def get_thread_count():
+    """
+    Return the number of worker threads to use for folder creation.
+    """
+    try:
+        return max(1, int(os.environ.get("TK_FOLDER_CREATION_THREADS", DEFAULT_THREADS)))
+    except ValueError:
+        return DEFAULT_THREADS
+
+
+def path_depth(path):
+    """
+    Return the number of components of a normalized path.
+    """
+    return len([token for token in path.split(os.sep) if token])
+
+
+class FolderCreationEngine(object):
+    """
+    Executes the list of items passed to the process_folder_creation hook.
+
+    Folder and symlink items are created level by level, shallowest first.
+    File items (copy and create_file) are processed concurrently once all
+    the folders exist. The list returned by execute() holds the same paths, in the same
+    order, as a serial walk over the items would have returned.
+    """
+
+    def __init__(self, preview_mode, post_job_cb=None, threads=None, blob_stores=None,
+                 remote_replay=None, manifest=None, recorder=None):
+        """
+        :param preview_mode:  If True, nothing is written to disk
+        :param post_job_cb:   Callable run with each folder item that was created
+        :param threads:       Number of worker threads, defaults to get_thread_count()
+        :param blob_stores:   Optional BlobStores the create_file items are linked to
+        :param remote_replay: Optional RemoteFolderReplay creating the remote folders
+        :param manifest:      Optional SchemaManifest holding the schema files to copy
+        :param recorder:      Optional instrument.Recorder timing the items and
+                              counting their file system calls
+        """
+        self._preview_mode = preview_mode
+        self._post_job_cb = post_job_cb
+        self._blob_stores = blob_stores
+        self._remote_replay = remote_replay
+        self._manifest = manifest
+        self._threads = threads or get_thread_count()
+        self._link_config = os.environ.get(LINK_ENV_VAR) == "1"
+        self._recorder = recorder or NullRecorder()
+        # answers existence checks, and knows about everything created
+        # by this run (or that would be created in preview mode)
+        self._oracle = ExistenceOracle(self._recorder)
+
+    def execute(self, items):
+        """
+        Create all the items on disk.
+
+        :param items: List of item dictionaries, see the process_folder_creation hook
+        :returns: List of paths which were created
+        """
+        results = []
+        levels = {}
+        file_items = []
+        remote_items = []
+        seen = set()
+
+        for index, item in enumerate(items):
+            action = item.get("action")
+
+            if action in FOLDER_ACTIONS or action == "symlink":
+                if action == "symlink" and sys.platform == "win32":
+                    # no windows support
+                    continue
+                key = os.path.normpath(item.get("path"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                levels.setdefault(path_depth(key), []).append((index, item, key))
+
+            elif action in ["copy", "create_file"]:
+                key = os.path.normpath(item.get("target_path") or item.get("path"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                file_items.append((index, item))
+
+            elif action == "remote_entity_folder" and self._remote_replay:
+                # NOTE! This action happens when another user has created
+                # a folder on their machine and we are syncing our local path
+                # cache to be aware of this folder's existance.
+                #
+                # For a traditional setup, where the project storage is shared,
+                # there is no need to do I/O for remote folders - these folders
+                # have already been created on the remote storage so you have access
+                # to them already, and no replay is configured.
+                #
+                # On a setup where each user or group of users is attached to
+                # different, independendent file storages, which are synced,
+                # the remote folder creation is replayed on the local system.
+                remote_items.append(item)
+
+        if remote_items:
+            # replayed first, the local items may live below them
+            with self._recorder.span("remote replay"):
+                replayed = self._remote_replay.replay(remote_items, self._preview_mode)
+            for path in replayed:
+                results.append((len(items), path))
+
+        created_items = []
+        pool = None
+        if self._threads > 1:
+            pool = ThreadPool(self._threads)
+        try:
+            for depth in sorted(levels):
+                level = levels[depth]
+                with self._recorder.span("depth %d" % depth):
+                    states = self._map(pool, self._process_node, level)
+                for (index, item, key), created in zip(level, states):
+                    if created:
+                        results.append((index, item.get("path")))
+                        if item.get("action") in FOLDER_ACTIONS:
+                            created_items.append((index, item))
+
+            with self._recorder.span("files"):
+                paths = self._map(pool, self._process_file, [item for (index, item) in file_items])
+            for (index, item), path in zip(file_items, paths):
+                if path:
+                    results.append((index, path))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        if self._post_job_cb and not self._preview_mode:
+            with self._recorder.span("post jobs"):
+                for index, item in sorted(created_items, key=lambda x: x[0]):
+                    self._post_job_cb(item)
+
+        return [path for (index, path) in sorted(results, key=lambda x: x[0])]
+
+    def _map(self, pool, func, args):
+        """
+        Run a function on a list of arguments, with the pool if there is one.
+        """
+        if pool and len(args) > 1:
+            return pool.map(func, args)
+        return [func(arg) for arg in args]
+
+    def _process_node(self, node):
+        """
+        Create a single folder or symlink item.
+
+        :param node: Tuple (index, item, normalized path)
+        :returns: True if the item was created
+        """
+        (index, item, key) = node
+        with self._recorder.item(item.get("action"), path_depth(key)):
+            return self._create_node(item, key)
+
+    def _create_node(self, item, key):
+        """
+        Create a folder or symlink item, see _process_node().
+        """
+        path = item.get("path")
+
+        if item.get("action") == "symlink":
+            # note that the oracle checks the existance of the symlink
+            # rather than what symlink is pointing at
+            if self._oracle.exists(key):
+                return False
+            if not self._preview_mode:
+                self._recorder.call("symlink")
+                os.symlink(item.get("target"), path)
+            self._oracle.add(key)
+            return True
+
+        if self._oracle.exists(key):
+            return False
+
+        if not self._preview_mode:
+            try:
+                if self._oracle.is_listed_folder(os.path.dirname(key)):
+                    # parent is there, a single mkdir is enough
+                    self._recorder.call("mkdir")
+                    os.mkdir(path, 0770)
+                else:
+                    # create the folder using open permissions
+                    self._recorder.call("makedirs")
+                    os.makedirs(path, 0770)
+            except OSError, e:
+                # Race conditions are perfectly possible on some network storage setups
+                # so make sure that we ignore any file already exists errors, as they
+                # are not really errors!
+                if e.errno != errno.EEXIST:
+                    raise
+                return False
+        self._oracle.add(key, folder=True)
+        return True
+
+    def _process_file(self, item):
+        """
+        Process a copy or create_file item.
+
+        :param item: Item dictionary
+        :returns: The path of the created file or None
+        """
+        path = item.get("target_path") or item.get("path")
+        with self._recorder.item(item.get("action"), path_depth(os.path.normpath(path))):
+            return self._create_file_item(item)
+
+    def _create_file_item(self, item):
+        """
+        Create a copy or create_file item, see _process_file().
+        """
+        if item.get("action") == "copy":
+            source_path = item.get("source_path")
+            target_path = item.get("target_path")
+            if not self._oracle.exists(target_path):
+                if not self._preview_mode:
+                    try:
+                        # small schema files are held by the manifest, there
+                        # is no need to read them from the configuration.
+                        content = None
+                        if self._manifest:
+                            content = self._manifest.file_content(source_path)
+                        if content is not None:
+                            self._write_file(target_path, content)
+                        else:
+                            # the file is created with open permissions
+                            self._recorder.call("copy")
+                            copy_file(source_path, target_path, 0660, allow_link=self._link_config)
+                    except OSError, e:
+                        if e.errno != errno.EEXIST:
+                            raise
+                        return None
+                self._oracle.add(target_path)
+                return target_path
+            return None
+
+        # create a new file based on content
+        path = item.get("path")
+        parent_folder = os.path.dirname(path)
+        content = item.get("content")
+        if not self._oracle.exists(parent_folder) and not self._preview_mode:
+            try:
+                self._recorder.call("makedirs")
+                os.makedirs(parent_folder, 0770)
+            except OSError, e:
+                # another file of this run may have created it
+                if e.errno != errno.EEXIST:
+                    raise
+            self._oracle.add(parent_folder, folder=True)
+        if not self._oracle.exists(path):
+            if not self._preview_mode:
+                try:
+                    self._create_file(path, content)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    return None
+            self._oracle.add(path)
+            return path
+        return None
+
+    def _create_file(self, path, content):
+        """
+        Create a new file with the given content, as a link to the blob
+        store when possible.
+        """
+        if self._blob_stores:
+            self._recorder.call("link")
+            if self._blob_stores.link(content, path):
+                return
+        self._write_file(path, content)
+
+    def _write_file(self, path, content):
+        """
+        Write a new file with open permissions.
+        """
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        self._recorder.call("write")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0660)
+        try:
+            while content:
+                written = os.write(fd, content)
+                content = content[written:]
+        finally:
+            os.close(fd)
@@ -0,0 +1,195 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Opt-in instrumentation of folder creation.
+
+When the TK_FOLDER_CREATION_STATS environment variable is set to 1, every
+run of the process_folder_creation hook records, per item action and per
+schema depth, the number of items, the wall time spent on them and the
+file system calls they made. Two files are written at the end of the run:
+
+* folder_creation_<time>.json, a summary of the counters
+* folder_creation_<time>.trace.json, a timeline in the Chrome trace event
+  format, which can be opened in chrome://tracing or https://ui.perfetto.dev
+
+When instrumentation is disabled a NullRecorder is used, which does nothing.
+"""
+
+import os
+import time
+import json
+import threading
+import contextlib
+
+ENV_VAR = "TK_FOLDER_CREATION_STATS"
+
+
+def is_enabled():
+    """
+    Check if folder creation instrumentation has been requested.
+    """
+    return os.environ.get(ENV_VAR) == "1"
+
+
+class NullRecorder(object):
+    """
+    Recorder which records nothing, used when instrumentation is disabled.
+    """
+
+    @contextlib.contextmanager
+    def item(self, action, depth):
+        yield
+
+    @contextlib.contextmanager
+    def span(self, name):
+        yield
+
+    def call(self, name, count=1):
+        pass
+
+
+class Recorder(object):
+    """
+    Thread safe recorder of the items and file system calls of a run.
+
+    File system calls are accounted to the item being processed by the
+    calling thread, calls made outside of an item are accounted to the
+    "run" action at depth 0.
+    """
+
+    def __init__(self):
+        self._start = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # (action, depth) -> {"items", "time", "calls": {name: count}}
+        self._buckets = {}
+        self._events = []
+
+    def _bucket(self, action, depth):
+        key = (action, depth)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {"items": 0, "time": 0.0, "calls": {}}
+        return bucket
+
+    def _add_event(self, name, category, start, duration, args=None):
+        event = {"name": name,
+                 "cat": category,
+                 "ph": "X",
+                 "ts": int((start - self._start) * 1000000),
+                 "dur": int(duration * 1000000),
+                 "pid": os.getpid(),
+                 "tid": threading.current_thread().ident}
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    @contextlib.contextmanager
+    def item(self, action, depth):
+        """
+        Context manager timing the processing of one item.
+
+        :param action: Action of the item, for example "folder"
+        :param depth:  Depth of the item path
+        """
+        previous = getattr(self._local, "current", None)
+        self._local.current = (action, depth)
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            self._local.current = previous
+            with self._lock:
+                bucket = self._bucket(action, depth)
+                bucket["items"] += 1
+                bucket["time"] += duration
+                self._add_event(action, "item", start, duration, {"depth": depth})
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """
+        Context manager timing a phase of the run, for example a depth level.
+
+        :param name: Name of the phase
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._add_event(name, "phase", start, time.time() - start)
+
+    def call(self, name, count=1):
+        """
+        Count a file system call made by the current thread.
+
+        :param name:  Name of the call, for example "mkdir"
+        :param count: Number of calls
+        """
+        (action, depth) = getattr(self._local, "current", None) or ("run", 0)
+        with self._lock:
+            calls = self._bucket(action, depth)["calls"]
+            calls[name] = calls.get(name, 0) + count
+
+    def summary(self):
+        """
+        Return the counters of the run.
+
+        :returns: Dictionary with the total wall time, the totals per call
+                  name and per action, and the detail per action and depth
+        """
+        with self._lock:
+            by_action = {}
+            calls = {}
+            detail = []
+            for ((action, depth), bucket) in sorted(self._buckets.items()):
+                total = by_action.setdefault(action, {"items": 0, "time": 0.0, "calls": {}})
+                total["items"] += bucket["items"]
+                total["time"] += bucket["time"]
+                for (name, count) in bucket["calls"].items():
+                    total["calls"][name] = total["calls"].get(name, 0) + count
+                    calls[name] = calls.get(name, 0) + count
+                detail.append({"action": action,
+                               "depth": depth,
+                               "items": bucket["items"],
+                               "time": bucket["time"],
+                               "calls": dict(bucket["calls"])})
+            return {"wall_time": time.time() - self._start,
+                    "calls": calls,
+                    "actions": by_action,
+                    "detail": detail}
+
+    def write(self, folder):
+        """
+        Write the summary and the trace of the run to a folder.
+
+        :param folder: Existing folder to write to
+        :returns: Tuple (summary path, trace path)
+        """
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._start))
+        base = os.path.join(folder, "folder_creation_%s-%d" % (stamp, os.getpid()))
+        summary_path = base + ".json"
+        trace_path = base + ".trace.json"
+        summary = self.summary()
+        fh = open(summary_path, "w")
+        try:
+            json.dump(summary, fh, indent=2, sort_keys=True)
+        finally:
+            fh.close()
+        with self._lock:
+            events = list(self._events)
+        fh = open(trace_path, "w")
+        try:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fh)
+        finally:
+            fh.close()
+        return summary_path, trace_path
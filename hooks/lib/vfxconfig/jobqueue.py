@@ -0,0 +1,431 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Persistent job queue drained by background worker threads.
+
+Jobs are stored in a small sqlite database on the local disk, so they
+survive the process which submitted them. A job claimed by a process which
+died before finishing it is handed out again the next time the queue is
+drained on the same machine.
+
+A job can be submitted after the jobs of other keys: it is only handed out
+once none of them is pending or running anymore.
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import sqlite3
+import logging
+import threading
+
+from .paths import ensure_folder
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job(object):
+    """
+    A job claimed from the queue.
+    """
+
+    def __init__(self, job_id, kind, payload, attempts):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+
+
+class JobQueue(object):
+    """
+    A queue of jobs stored in a sqlite database.
+
+    Each thread uses its own connection to the database, a JobQueue object
+    can be shared between threads.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the sqlite database, created if needed
+        """
+        self._path = path
+        ensure_folder(os.path.dirname(path))
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                         " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                         " kind TEXT NOT NULL,"
+                         " job_key TEXT,"
+                         " payload TEXT NOT NULL,"
+                         " status TEXT NOT NULL,"
+                         " attempts INTEGER NOT NULL DEFAULT 0,"
+                         " error TEXT,"
+                         " host TEXT,"
+                         " pid INTEGER,"
+                         " created REAL NOT NULL,"
+                         " updated REAL NOT NULL,"
+                         " not_before REAL NOT NULL DEFAULT 0)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (kind, job_key)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "result" not in columns:
+                # queues created before jobs could return a result
+                conn.execute("ALTER TABLE jobs ADD COLUMN result TEXT")
+            if "after" not in columns:
+                # queues created before jobs could wait for others
+                conn.execute("ALTER TABLE jobs ADD COLUMN after TEXT")
+        finally:
+            conn.close()
+
+    @property
+    def path(self):
+        """
+        Path to the database file
+        """
+        return self._path
+
+    def _connect(self):
+        """
+        Open a connection to the database in autocommit mode.
+        """
+        return sqlite3.connect(self._path, timeout=60, isolation_level=None)
+
+    def submit(self, kind, payload, key=None, after=None):
+        """
+        Add a job to the queue.
+
+        :param kind:    The type of job, used to pick the function which runs it
+        :param payload: Json serializable job data
+        :param key:     Optional key identifying the job. If a job with the same
+                        kind and key is still pending or running, no new job is
+                        added and the id of the existing one is returned.
+        :param after:   Optional list of keys of jobs of the same kind which
+                        must be done, or failed for good, before this one runs
+        :returns: The job id
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if key is not None:
+                row = conn.execute("SELECT id FROM jobs WHERE kind = ? AND job_key = ? AND status IN (?, ?)",
+                                   (kind, key, PENDING, RUNNING)).fetchone()
+                if row:
+                    conn.execute("COMMIT")
+                    return row[0]
+            cursor = conn.execute("INSERT INTO jobs (kind, job_key, payload, status, created, updated, after)"
+                                  " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (kind, key, json.dumps(payload), PENDING, now, now,
+                                   json.dumps(list(after)) if after else None))
+            conn.execute("COMMIT")
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def claim(self, kinds=None):
+        """
+        Take the oldest pending job which is not waiting for other jobs, and
+        mark it as running.
+
+        :param kinds: Optional list of job kinds to consider
+        :returns: A Job, or None if there is nothing to run
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            query = "SELECT id, kind, payload, attempts, after FROM jobs WHERE status = ? AND not_before <= ?"
+            args = [PENDING, now]
+            if kinds:
+                query += " AND kind IN (%s)" % ", ".join("?" * len(kinds))
+                args.extend(kinds)
+            row = None
+            for candidate in conn.execute(query + " ORDER BY id", args).fetchall():
+                if not candidate[4] or not self._waiting(conn, candidate[1], json.loads(candidate[4])):
+                    row = candidate
+                    break
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, host = ?, pid = ?, updated = ?"
+                         " WHERE id = ?", (RUNNING, socket.gethostname(), os.getpid(), now, row[0]))
+            conn.execute("COMMIT")
+            return Job(row[0], row[1], json.loads(row[2]), row[3] + 1)
+        finally:
+            conn.close()
+
+    def _waiting(self, conn, kind, keys):
+        """
+        Check if one of the jobs of some keys is still to be run.
+        """
+        query = ("SELECT 1 FROM jobs WHERE kind = ? AND status IN (?, ?) AND job_key IN (%s) LIMIT 1"
+                 % ", ".join("?" * len(keys)))
+        return conn.execute(query, [kind, PENDING, RUNNING] + list(keys)).fetchone() is not None
+
+    def complete(self, job_id, result=None):
+        """
+        Mark a job as successfully done.
+
+        :param job_id: Id of the job
+        :param result: Optional json serializable result of the job
+        """
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET status = ?, error = NULL, result = ?, updated = ? WHERE id = ?",
+                         (DONE, json.dumps(result, default=str), time.time(), job_id))
+        finally:
+            conn.close()
+
+    def fail(self, job_id, error, retry_in=None):
+        """
+        Mark a job as failed.
+
+        :param job_id:   Id of the job
+        :param error:    Error message to store with the job
+        :param retry_in: If set, the job is put back in the queue and will
+                         not be handed out before this many seconds.
+        """
+        if retry_in is None:
+            self._set_status(job_id, FAILED, error)
+        else:
+            self._set_status(job_id, PENDING, error, time.time() + retry_in)
+
+    def _set_status(self, job_id, status, error, not_before=0):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET status = ?, error = ?, not_before = ?, updated = ? WHERE id = ?",
+                         (status, error, not_before, time.time(), job_id))
+        finally:
+            conn.close()
+
+    def requeue_stale(self):
+        """
+        Put back in the queue the jobs which were claimed by a process of this
+        machine which no longer exists.
+
+        :returns: The number of jobs put back in the queue
+        """
+        host = socket.gethostname()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, pid FROM jobs WHERE status = ? AND host = ?",
+                                (RUNNING, host)).fetchall()
+            stale = [job_id for (job_id, pid) in rows if not _pid_alive(pid)]
+            for job_id in stale:
+                conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?",
+                             (PENDING, time.time(), job_id))
+            conn.execute("COMMIT")
+            return len(stale)
+        finally:
+            conn.close()
+
+    def status(self, job_id):
+        """
+        Return the state of a job.
+
+        :param job_id: Id of the job
+        :returns: Dictionary with the job fields, or None for an unknown job
+        """
+        jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def jobs(self, kind=None, status=None):
+        """
+        Return the jobs of the queue, oldest first.
+
+        :param kind:   Optional job kind to filter on
+        :param status: Optional status to filter on
+        :returns: List of dictionaries with the job fields
+        """
+        clauses = []
+        args = []
+        if kind:
+            clauses.append("kind = ?")
+            args.append(kind)
+        if status:
+            clauses.append("status = ?")
+            args.append(status)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        return self._select(where, args)
+
+    def next_retry(self, kinds=None):
+        """
+        Return the time at which the next pending job can be handed out.
+
+        :param kinds: Optional list of job kinds to consider
+        :returns: A time, or None if there is no pending job
+        """
+        query = "SELECT MIN(not_before) FROM jobs WHERE status = ?"
+        args = [PENDING]
+        if kinds:
+            query += " AND kind IN (%s)" % ", ".join("?" * len(kinds))
+            args.extend(kinds)
+        conn = self._connect()
+        try:
+            return conn.execute(query, args).fetchone()[0]
+        finally:
+            conn.close()
+
+    def retry_failed(self, kind=None):
+        """
+        Put the failed jobs back in the queue.
+
+        :param kind: Optional job kind to filter on
+        :returns: The number of jobs put back in the queue
+        """
+        query = "UPDATE jobs SET status = ?, attempts = 0, not_before = 0, updated = ? WHERE status = ?"
+        args = [PENDING, time.time(), FAILED]
+        if kind:
+            query += " AND kind = ?"
+            args.append(kind)
+        conn = self._connect()
+        try:
+            return conn.execute(query, args).rowcount
+        finally:
+            conn.close()
+
+    def purge(self, older_than):
+        """
+        Remove the finished jobs last updated more than the given number of seconds ago.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                         (DONE, FAILED, time.time() - older_than))
+        finally:
+            conn.close()
+
+    def _select(self, where, args):
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT id, kind, job_key, payload, status, attempts, error, host, pid,"
+                                " created, updated, result FROM jobs %s ORDER BY id" % where, args).fetchall()
+        finally:
+            conn.close()
+        keys = ["id", "kind", "key", "payload", "status", "attempts", "error", "host", "pid",
+                "created", "updated", "result"]
+        jobs = []
+        for row in rows:
+            job = dict(zip(keys, row))
+            job["payload"] = json.loads(job["payload"])
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            jobs.append(job)
+        return jobs
+
+
+def _pid_alive(pid):
+    """
+    Check if a process of this machine is still running.
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class JobRunner(object):
+    """
+    Drains a JobQueue with a set of worker threads.
+
+    Workers stop once the queue is empty, start() can be called again at any
+    time to process newly submitted jobs. Worker threads are not daemonic by
+    default, so a process which submitted jobs waits for them to be processed
+    before it exits.
+    """
+
+    def __init__(self, queue, handlers, workers=4, max_attempts=3, retry_delay=30, backoff=1, linger=False,
+                 daemon=False):
+        """
+        :param queue:        The JobQueue to drain
+        :param handlers:     Dictionary of job kind -> callable taking the job
+                             payload, its return value is stored as the job result
+        :param workers:      Maximum number of concurrent worker threads
+        :param max_attempts: Number of times a failing job is tried
+        :param retry_delay:  Minimum number of seconds before a failed job is tried
+                             again, the next time the queue is drained
+        :param backoff:      Factor the retry delay is multiplied by after each
+                             failed attempt of a job
+        :param linger:       If True, workers wait for the jobs to retry instead
+                             of stopping when only those are left
+        :param daemon:       If True, worker threads do not keep the process
+                             alive, the jobs left are drained by the next
+                             process starting a runner
+        """
+        self._queue = queue
+        self._handlers = handlers
+        self._workers = max(1, workers)
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._backoff = backoff
+        self._linger = linger
+        self._daemon = daemon
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Make sure enough worker threads are running to drain the queue.
+        """
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if not self._threads:
+                # nobody is draining the queue in this process, pick up the
+                # work left behind by processes which died.
+                self._queue.requeue_stale()
+            while len(self._threads) < self._workers:
+                thread = threading.Thread(target=self._work, name="JobRunner-%d" % len(self._threads))
+                thread.daemon = self._daemon
+                thread.start()
+                self._threads.append(thread)
+
+    def wait(self):
+        """
+        Block until all the worker threads have stopped.
+        """
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+
+    def _work(self):
+        """
+        Worker thread main loop.
+        """
+        while True:
+            job = self._queue.claim(self._handlers.keys())
+            if job is None:
+                retry = self._queue.next_retry(self._handlers.keys()) if self._linger else None
+                if retry is None:
+                    return
+                time.sleep(min(max(retry - time.time(), 0.1), self._retry_delay))
+                continue
+            try:
+                result = self._handlers[job.kind](job.payload)
+            except Exception, e:
+                log.exception("Job %d (%s) failed" % (job.id, job.kind))
+                if job.attempts < self._max_attempts:
+                    delay = self._retry_delay * self._backoff ** (job.attempts - 1)
+                    self._queue.fail(job.id, str(e), retry_in=delay)
+                else:
+                    self._queue.fail(job.id, str(e))
+            else:
+                self._queue.complete(job.id, result)
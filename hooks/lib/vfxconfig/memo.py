@@ -0,0 +1,36 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Process wide memos for hooks.
+
+The toolkit may load a hook file again, which resets its module globals.
+The modules of this package are only imported once per process, so hooks
+keep the values they want to compute once per process here.
+"""
+
+import threading
+
+_memos = {}
+_memos_lock = threading.Lock()
+
+
+def process_memo(name):
+    """
+    Return the memo dictionary with the given name, shared by the whole process.
+
+    Reading and setting single keys of a dictionary is thread safe.
+
+    :param name: Name of the memo, for example the name of the hook using it
+    :returns: Dictionary
+    """
+    with _memos_lock:
+        return _memos.setdefault(name, {})
+
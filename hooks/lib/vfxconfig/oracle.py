@@ -0,0 +1,147 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Existence oracle answering path existence checks from directory listings.
+
+On network storage a single directory listing is much cheaper than a stat
+call (and the negative lookup) for every entry of that directory. The oracle
+lists each distinct parent folder once and answers all the existence checks
+for its children from memory.
+"""
+
+import os
+import errno
+import threading
+
+from .instrument import NullRecorder
+
+
+class ExistenceOracle(object):
+    """
+    Answers existence checks from cached directory listings.
+
+    The oracle is meant to live for the duration of a single operation (for
+    example one call to the process_folder_creation hook). Entries created
+    during that time must be reported with add() so that the cached listings
+    stay in sync with the disk.
+
+    Existence is checked on the directory entry itself, like os.path.lexists:
+    a dangling symlink counts as existing.
+    """
+
+    def __init__(self, recorder=None):
+        """
+        :param recorder: Optional instrument.Recorder counting the disk accesses
+        """
+        self._recorder = recorder or NullRecorder()
+        # folder path -> set of entry names, or None if the folder does not exist
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def exists(self, path):
+        """
+        Check if a path exists.
+
+        :param path: Path to check
+        :returns: True if there is a directory entry for the path
+        """
+        path = os.path.normpath(path)
+        parent, name = os.path.split(path)
+        if not name:
+            # file system root
+            self._recorder.call("exists")
+            return os.path.exists(path)
+        entries = self._get_listing(parent)
+        return entries is not None and name in entries
+
+    def is_listed_folder(self, path):
+        """
+        Check if a path is a folder whose content has already been listed or
+        created by this oracle. This never touches the disk.
+
+        :param path: Path to check
+        :returns: True if the folder is known to exist
+        """
+        with self._lock:
+            return self._listings.get(os.path.normpath(path)) is not None
+
+    def add(self, path, folder=False):
+        """
+        Record that a new entry was created on disk.
+
+        Parent folders which were known to be missing are recorded as
+        existing, as os.makedirs creates them along the way.
+
+        :param path:   Path to the new entry
+        :param folder: True if the entry is a new, empty folder
+        """
+        path = os.path.normpath(path)
+        with self._lock:
+            if folder and self._listings.get(path) is None:
+                self._listings[path] = set()
+
+            child = path
+            parent = os.path.dirname(child)
+            while parent != child:
+                if parent not in self._listings:
+                    # nothing cached for this folder, nothing to update
+                    break
+                entries = self._listings[parent]
+                if entries is None:
+                    # the folder was missing and has been created
+                    entries = self._listings[parent] = set()
+                    entries.add(os.path.basename(child))
+                else:
+                    entries.add(os.path.basename(child))
+                    break
+                child = parent
+                parent = os.path.dirname(child)
+
+    def _get_listing(self, folder):
+        """
+        Return the entries of a folder, reading it from disk the first time.
+
+        :param folder: Normalized folder path
+        :returns: Set of entry names, or None if the folder does not exist
+        """
+        with self._lock:
+            if folder in self._listings:
+                return self._listings[folder]
+
+            # the listing of the parent folder may already tell us that
+            # this folder is missing, no need to go to the disk then.
+            parent, name = os.path.split(folder)
+            if name and parent in self._listings:
+                parent_entries = self._listings[parent]
+                if parent_entries is None or name not in parent_entries:
+                    self._listings[folder] = None
+                    return None
+
+        entries = self._read_folder(folder)
+
+        with self._lock:
+            # another thread may have listed (or updated) it in the meantime
+            return self._listings.setdefault(folder, entries)
+
+    def _read_folder(self, folder):
+        """
+        List a folder on disk.
+
+        :param folder: Folder path
+        :returns: Set of entry names, or None if the folder does not exist
+        """
+        self._recorder.call("listdir")
+        try:
+            return set(os.listdir(folder))
+        except OSError, e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise
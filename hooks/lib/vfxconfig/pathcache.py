@@ -0,0 +1,213 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Tuning and seeding of the path cache database.
+
+A new path cache is empty, and the toolkit fills it by replaying the whole
+folder creation history of the project, row by row. When the
+TK_PATH_CACHE_SNAPSHOTS environment variable points to a folder holding
+compacted snapshots of the path caches (project_<id>.db), a new path cache
+is seeded from the snapshot of its project instead. The snapshot records the
+last event it holds, so the toolkit only syncs the events created since.
+
+Path caches are also given covering indexes for the path -> entity and
+entity -> path lookups, and are switched to WAL journaling when they are on
+the local disk (WAL does not work over NFS).
+
+Snapshots are made from an up to date path cache with:
+
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.pathcache snapshot <path_cache.db> <snapshot.db>
+"""
+
+import os
+import sys
+import sqlite3
+import logging
+
+from .cachetier import copy_database, table_columns
+
+log = logging.getLogger(__name__)
+
+SNAPSHOTS_ENV_VAR = "TK_PATH_CACHE_SNAPSHOTS"
+
+COVERING_INDEXES = [
+    # path -> entity, see PathCache.get_entity()
+    "CREATE INDEX IF NOT EXISTS vfx_path_cache_by_path "
+    "ON path_cache (root, path, primary_entity, entity_type, entity_id, entity_name)",
+    # entity -> paths, see PathCache.get_paths()
+    "CREATE INDEX IF NOT EXISTS vfx_path_cache_by_entity "
+    "ON path_cache (entity_type, entity_id, primary_entity, root, path)",
+]
+
+
+def has_table(conn, name):
+    """
+    Check if a database holds a table.
+    """
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (name,)).fetchone() is not None
+
+
+def tune_database(path, wal=False):
+    """
+    Add the covering indexes to a path cache, and switch it to WAL journaling.
+
+    Does nothing on a path cache the toolkit has not initialized yet.
+
+    :param path: Path to the database
+    :param wal:  If True, use WAL journaling. Only for databases on the local disk.
+    """
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        if not has_table(conn, "path_cache"):
+            return
+        indexes = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+        with conn:
+            for statement in COVERING_INDEXES:
+                conn.execute(statement)
+        if len(indexes) != len(set(row[0] for row in conn.execute("SELECT name FROM sqlite_master "
+                                                                  "WHERE type = 'index'"))):
+            # new indexes, let the query planner know about them
+            conn.execute("ANALYZE")
+        if wal:
+            conn.execute("PRAGMA journal_mode = WAL")
+    finally:
+        conn.close()
+
+
+def find_snapshot(project_id):
+    """
+    Return the path to the snapshot of the path cache of a project.
+
+    :param project_id: Shotgun id of the project
+    :returns: Path to the snapshot, or None if there is none
+    """
+    folder = os.environ.get(SNAPSHOTS_ENV_VAR)
+    if not folder:
+        return None
+    path = os.path.join(folder, "project_%d.db" % project_id)
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
+def seed_database(path, snapshot):
+    """
+    Seed a new path cache from a snapshot.
+
+    :param path:     Path to the path cache, which must be missing or empty
+    :param snapshot: Path to the snapshot
+    :returns: True if the path cache was seeded
+    """
+    if os.path.exists(path) and os.path.getsize(path):
+        return False
+    # snapshots are replaced by a rename, never written in place
+    if not copy_database(snapshot, path, lock=False):
+        log.warning("Ignoring corrupt path cache snapshot %s" % snapshot)
+        return False
+    log.info("Seeded path cache %s from %s" % (path, snapshot))
+    return True
+
+
+def bulk_load(path, snapshot):
+    """
+    Load the rows of a snapshot into a path cache initialized by the
+    toolkit but still empty, in a single transaction.
+
+    :param path:     Path to the path cache
+    :param snapshot: Path to the snapshot
+    :returns: Number of path cache rows loaded
+    """
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        if not has_table(conn, "path_cache") or conn.execute("SELECT 1 FROM path_cache LIMIT 1").fetchone():
+            return 0
+        conn.execute("ATTACH DATABASE ? AS snapshot", (snapshot,))
+        try:
+            with conn:
+                for table in ["path_cache", "shotgun_status", "event_log_sync"]:
+                    in_snapshot = conn.execute("SELECT 1 FROM snapshot.sqlite_master WHERE type = 'table' "
+                                               "AND name = ?", (table,)).fetchone()
+                    if in_snapshot and has_table(conn, table):
+                        # by name, the columns may not be in the same order
+                        snapshot_columns = table_columns(conn, table, "snapshot")
+                        columns = ", ".join(column for column in table_columns(conn, table)
+                                            if column in snapshot_columns)
+                        conn.execute("DELETE FROM main.%s" % table)
+                        conn.execute("INSERT INTO main.%s (%s) SELECT %s FROM snapshot.%s"
+                                     % (table, columns, columns, table))
+            return conn.execute("SELECT COUNT(*) FROM path_cache").fetchone()[0]
+        finally:
+            conn.execute("DETACH DATABASE snapshot")
+    finally:
+        conn.close()
+
+
+def make_snapshot(source, target):
+    """
+    Make a compacted snapshot of a path cache.
+
+    :param source: Path to an up to date path cache
+    :param target: Path of the snapshot, replaced if it exists
+    """
+    tmp_target = "%s.build-%d" % (target, os.getpid())
+    if not copy_database(source, tmp_target):
+        raise ValueError("Path cache %s is corrupt" % source)
+    try:
+        tune_database(tmp_target)
+        conn = sqlite3.connect(tmp_target)
+        try:
+            # snapshots are read by many, keep them small and in one file
+            conn.execute("PRAGMA journal_mode = DELETE")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        os.chmod(tmp_target, 0444)
+        os.rename(tmp_target, target)
+    finally:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+
+
+def prepare(path, project_id, local=False):
+    """
+    Seed a path cache from its snapshot if it is new, and tune it.
+
+    :param path:       Path to the path cache
+    :param project_id: Shotgun id of the project
+    :param local:      True if the path cache is on the local disk
+    """
+    snapshot = find_snapshot(project_id)
+    if snapshot:
+        if not seed_database(path, snapshot):
+            bulk_load(path, snapshot)
+    if os.path.exists(path) and os.path.getsize(path):
+        tune_database(path, wal=local)
+
+
+def main(argv):
+    """
+    Command line entry point.
+    """
+    logging.basicConfig(level=logging.INFO)
+    if len(argv) == 4 and argv[1] == "snapshot":
+        make_snapshot(argv[2], argv[3])
+    elif len(argv) == 3 and argv[1] == "tune":
+        tune_database(argv[2])
+    else:
+        print "usage: python -m vfxconfig.pathcache snapshot <path_cache.db> <snapshot.db>"
+        print "       python -m vfxconfig.pathcache tune <path_cache.db>"
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
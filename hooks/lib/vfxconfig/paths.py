@@ -0,0 +1,55 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Well known locations used by the helpers of this configuration.
+"""
+
+import os
+import sys
+import getpass
+import tempfile
+
+
+def local_cache_root():
+    """
+    Return a folder on the local disk of the machine, private to the current user.
+
+    The location can be set with the TK_LOCAL_CACHE environment variable. It
+    defaults to /var/tmp/<user>/shotgun on linux and osx, which survives reboots,
+    and to the temp folder on windows.
+
+    :returns: Path to the folder, which is not guaranteed to exist
+    """
+    root = os.environ.get("TK_LOCAL_CACHE")
+    if root:
+        return root
+    if sys.platform == "win32":
+        return os.path.join(tempfile.gettempdir(), "shotgun")
+    return os.path.join("/var/tmp", getpass.getuser(), "shotgun")
+
+
+def ensure_folder(path, mode=0700):
+    """
+    Create a folder if it doesn't already exist.
+
+    :param path: Folder to create
+    :param mode: Permissions of the created folders
+    :returns: The path
+    """
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path, mode)
+        except OSError:
+            # Race conditions are perfectly possible, someone else
+            # may have created the folder in the meantime.
+            if not os.path.isdir(path):
+                raise
+    return path
@@ -0,0 +1,422 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+PFTrack project bootstrap for the tracking task folders.
+
+Creating a PFTrack project is slow, so folder creation only queues a
+bootstrap job and returns. The jobs are stored in a persistent queue on the
+local disk and run by background worker threads.
+
+Starting pftrack takes several seconds, so it is only run once per PFTrack
+version to create a pristine project skeleton. New projects are then copies
+of that skeleton with their project file patched.
+
+The queue can be inspected and drained from a shell:
+
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.pftrack status
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.pftrack drain
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import getpass
+import logging
+import tempfile
+import threading
+import xml.sax
+from xml.sax.saxutils import XMLGenerator
+
+from .paths import local_cache_root, ensure_folder
+from .jobqueue import JobQueue, JobRunner
+
+log = logging.getLogger(__name__)
+
+JOB_KIND = "pftrack_bootstrap"
+
+# number of projects bootstrapped in parallel.
+# Can be overridden with the TK_PFTRACK_WORKERS environment variable.
+DEFAULT_WORKERS = 4
+
+FRAME_RATE = 23.976
+
+# name of the projects used as skeletons for new projects
+SKELETON_NAME = "TK_SKELETON"
+# file next to a skeleton holding the path the skeleton was created at
+ORIGIN_FILE = "origin"
+
+# seconds before the skeleton of a PFTrack version is tried again after it
+# could not be made, multiplied by SKELETON_BACKOFF after each failure and
+# capped to SKELETON_MAX_RETRY_DELAY. Meanwhile projects are made with the
+# pftrack binary.
+SKELETON_RETRY_DELAY = 600
+SKELETON_BACKOFF = 2
+SKELETON_MAX_RETRY_DELAY = 24 * 3600
+
+_runner = None
+_runner_lock = threading.Lock()
+_skeleton_lock = threading.Lock()
+
+
+def get_queue():
+    """
+    Return the queue holding the bootstrap jobs of the current user.
+    """
+    return JobQueue(os.path.join(local_cache_root(), "pftrack_jobs.db"))
+
+
+def get_runner():
+    """
+    Return the process wide runner draining the bootstrap queue.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            try:
+                workers = int(os.environ.get("TK_PFTRACK_WORKERS", DEFAULT_WORKERS))
+            except ValueError:
+                workers = DEFAULT_WORKERS
+            _runner = JobRunner(get_queue(), {JOB_KIND: bootstrap_project}, workers=workers)
+        return _runner
+
+
+def submit_bootstrap(folder, prod_name):
+    """
+    Queue the creation of the PFTrack project of a tracking task folder
+    and make sure the queue is being drained.
+
+    :param folder:    Path to the tracking task folder
+    :param prod_name: Name of the production
+    :returns: The id of the bootstrap job
+    """
+    payload = {"folder": folder,
+               "prod": prod_name,
+               "user": getpass.getuser()}
+    runner = get_runner()
+    job_id = get_queue().submit(JOB_KIND, payload, key=folder)
+    runner.start()
+    return job_id
+
+
+def bootstrap_status(job_id=None):
+    """
+    Return the state of the bootstrap jobs.
+
+    :param job_id: Optional job id, by default all the jobs are returned
+    :returns: A job dictionary, or a list of them if no job id was given
+    """
+    queue = get_queue()
+    if job_id is not None:
+        return queue.status(job_id)
+    return queue.jobs(kind=JOB_KIND)
+
+
+def project_location(folder, prod_name):
+    """
+    Return the name and path of the PFTrack project of a tracking task folder.
+
+    :param folder:    Path to the tracking task folder
+    :param prod_name: Name of the production
+    :returns: Tuple (project name, project path)
+    """
+    split_path = folder.split(os.sep)
+    shot, seq = split_path[-2], split_path[-3]
+    project_name = "%s-%s_%s-TRACK" % (prod_name, seq, shot)
+    project_path = folder + os.sep + project_name
+    return project_name, project_path
+
+
+def bootstrap_project(payload):
+    """
+    Create the PFTrack project of a tracking task folder and set its
+    frame rate and cache location.
+
+    New projects are cloned from the skeleton of the current PFTrack version
+    when the TK_PFTRACK_BOOTSTRAP environment variable is "clone" (the
+    default). The pftrack binary is used when it is set to "binary", or when
+    no skeleton is available.
+
+    :param payload: Job payload, see submit_bootstrap()
+    """
+    (project_name, project_path) = project_location(payload["folder"], payload["prod"])
+    fields = {"defaultFrameRate": str(FRAME_RATE),
+              "cache": os.sep + "datas" + os.sep + payload["user"] + os.sep + "cache"}
+
+    if not os.path.lexists(project_path):
+        skeleton = None
+        if os.environ.get("TK_PFTRACK_BOOTSTRAP", "clone") == "clone":
+            skeleton = get_skeleton()
+        if skeleton:
+            clone_project(skeleton, project_path, project_name, fields)
+            log.info("Cloned Pftrack project %s from %s" % (project_path, skeleton))
+            return
+        cmd = "pftrack -new_project %s -exit" % project_path
+        os.system(cmd)
+
+    # Editing project file
+    project_settings_path = project_path + os.sep + project_name + ".pfmp"
+    rewrite_project_file(project_settings_path, project_settings_path, fields)
+    log.info("Initialized Pftrack project %s" % project_path)
+
+
+def pftrack_version():
+    """
+    Return a key identifying the installed PFTrack version, without running it.
+
+    The TK_PFTRACK_VERSION environment variable is used if set, otherwise the
+    key is derived from the resolved location of the pftrack executable.
+
+    :returns: Version key, or None if pftrack cannot be found
+    """
+    version = os.environ.get("TK_PFTRACK_VERSION")
+    if version:
+        return version
+    for folder in os.environ.get("PATH", "").split(os.pathsep):
+        executable = os.path.join(folder, "pftrack")
+        if os.path.isfile(executable) and os.access(executable, os.X_OK):
+            real_path = os.path.realpath(executable)
+            return hashlib.md5(real_path).hexdigest()[:12]
+    return None
+
+
+def get_skeleton():
+    """
+    Return the pristine project skeleton of the installed PFTrack version,
+    creating it with the pftrack binary the first time.
+
+    :returns: Path to the skeleton project folder, or None if it could not be made
+    """
+    version = pftrack_version()
+    if not version:
+        return None
+
+    cache_folder = ensure_folder(os.path.join(local_cache_root(), "pftrack_skeletons"))
+    skeleton_root = os.path.join(cache_folder, version)
+    skeleton = os.path.join(skeleton_root, SKELETON_NAME)
+    failure_file = skeleton_root + ".failed"
+
+    with _skeleton_lock:
+        if os.path.isdir(skeleton):
+            return skeleton
+
+        attempts = _skeleton_failures(failure_file)
+        if attempts:
+            delay = min(SKELETON_RETRY_DELAY * SKELETON_BACKOFF ** (attempts - 1), SKELETON_MAX_RETRY_DELAY)
+            if time.time() < os.path.getmtime(failure_file) + delay:
+                return None
+
+        # build it next to its final location and move it in place in one go,
+        # so that a concurrent clone never sees a partial skeleton.
+        build_root = tempfile.mkdtemp(prefix="%s." % version, dir=cache_folder)
+        try:
+            build = os.path.join(build_root, SKELETON_NAME)
+            os.system("pftrack -new_project %s -exit" % build)
+            if not os.path.isfile(os.path.join(build, SKELETON_NAME + ".pfmp")):
+                log.warning("Could not create a Pftrack project skeleton in %s" % build)
+                # the failure time is the modification time of the file
+                fh = open(failure_file, "w")
+                fh.write(str(attempts + 1))
+                fh.close()
+                return None
+            if attempts:
+                os.remove(failure_file)
+            # the project file refers to the location it was created at
+            fh = open(os.path.join(build_root, ORIGIN_FILE), "w")
+            fh.write(build)
+            fh.close()
+            try:
+                os.rename(build_root, skeleton_root)
+            except OSError:
+                # someone else was faster
+                if not os.path.isdir(skeleton):
+                    raise
+            return skeleton
+        finally:
+            if os.path.isdir(build_root):
+                shutil.rmtree(build_root, ignore_errors=True)
+
+
+def _skeleton_failures(failure_file):
+    """
+    Return the number of times in a row a skeleton could not be made.
+    """
+    try:
+        fh = open(failure_file)
+        try:
+            return int(fh.read().strip() or 0)
+        finally:
+            fh.close()
+    except (IOError, ValueError):
+        return 0
+
+
+def clone_project(skeleton, project_path, project_name, fields):
+    """
+    Create a project by copying a skeleton.
+
+    Files and folders named after the skeleton are renamed after the new
+    project, and the project file is rewritten on the fly.
+
+    :param skeleton:     Path to the skeleton project folder
+    :param project_path: Path of the new project folder
+    :param project_name: Name of the new project
+    :param fields:       Dictionary of project file element name -> new value
+    """
+    renames = [(skeleton, project_path)]
+    origin_file = os.path.join(os.path.dirname(skeleton), ORIGIN_FILE)
+    if os.path.isfile(origin_file):
+        fh = open(origin_file)
+        renames.insert(0, (fh.read().strip(), project_path))
+        fh.close()
+    renames.append((SKELETON_NAME, project_name))
+    # copy into a temporary folder first, the project only appears once complete
+    build_path = "%s.tmp-%d" % (project_path, os.getpid())
+    os.mkdir(build_path)
+    try:
+        for folder, dirs, files in os.walk(skeleton):
+            relative = os.path.relpath(folder, skeleton).replace(SKELETON_NAME, project_name)
+            target_folder = build_path if relative == "." else os.path.join(build_path, relative)
+            for name in dirs:
+                os.mkdir(os.path.join(target_folder, name.replace(SKELETON_NAME, project_name)))
+            for name in files:
+                source = os.path.join(folder, name)
+                target = os.path.join(target_folder, name.replace(SKELETON_NAME, project_name))
+                if name.endswith(".pfmp"):
+                    rewrite_project_file(source, target, fields, renames)
+                else:
+                    shutil.copy2(source, target)
+        os.rename(build_path, project_path)
+    finally:
+        if os.path.isdir(build_path):
+            shutil.rmtree(build_path, ignore_errors=True)
+
+
+def _unicode(value):
+    if isinstance(value, str):
+        return value.decode("utf-8")
+    return value
+
+
+class _ProjectFileFilter(XMLGenerator):
+    """
+    Writes back the SAX events of a project file, with the text of some
+    elements of the project replaced and some strings renamed.
+    """
+
+    def __init__(self, out, fields, renames):
+        XMLGenerator.__init__(self, out, "utf-8")
+        self._fields = dict((tag, _unicode(value)) for (tag, value) in fields.items())
+        self._renames = [(_unicode(old), _unicode(new)) for (old, new) in renames]
+        self._depth = 0
+        # text is buffered until the next tag, the parser may split it
+        self._text = []
+        self._replacing = None
+        self.rewritten = set()
+
+    def _rename(self, value):
+        for (old, new) in self._renames:
+            value = value.replace(old, new)
+        return value
+
+    def _write_text(self):
+        text = "".join(self._text)
+        self._text = []
+        if text:
+            XMLGenerator.characters(self, self._rename(text))
+
+    def startElement(self, name, attrs):
+        if self._replacing is not None:
+            raise ValueError("Project file element %s has child elements" % self._replacing)
+        self._write_text()
+        self._depth += 1
+        XMLGenerator.startElement(self, name, dict((key, self._rename(value)) for (key, value) in attrs.items()))
+        # the settings are elements of the project, the root element
+        if self._depth == 2 and name in self._fields:
+            self._replacing = name
+
+    def endElement(self, name):
+        if self._replacing is not None:
+            self._text = [self._fields[name]]
+            self._replacing = None
+            self.rewritten.add(name)
+        self._write_text()
+        XMLGenerator.endElement(self, name)
+        self._depth -= 1
+
+    def characters(self, content):
+        self._text.append(content)
+
+    def ignorableWhitespace(self, content):
+        self._text.append(content)
+
+    def processingInstruction(self, target, data):
+        self._write_text()
+        XMLGenerator.processingInstruction(self, target, data)
+
+
+def rewrite_project_file(source, target, fields, renames=None):
+    """
+    Stream a PFTrack project file, replacing the text of some elements of
+    the project. Elements missing from the project file are skipped.
+
+    The file goes through a SAX parser, it is never loaded in memory as a
+    whole. Text and attribute values are written back escaped, CDATA
+    sections as plain text.
+
+    :param source:  Project file to read
+    :param target:  Project file to write, can be the same as source
+    :param fields:  Dictionary of element name -> new text value
+    :param renames: Optional list of (old, new) strings to replace in the
+                    text and attribute values
+    :raises: ValueError if an element of fields has child elements,
+             xml.sax.SAXException if the file is not valid XML
+    """
+    tmp_target = "%s.tmp-%d" % (target, os.getpid())
+    try:
+        dst = open(tmp_target, "wb")
+        try:
+            rewriter = _ProjectFileFilter(dst, fields, renames or [])
+            xml.sax.parse(source, rewriter)
+        finally:
+            dst.close()
+        missing = set(fields) - rewriter.rewritten
+        if missing:
+            log.warning("No %s element in the project file %s" % (", ".join(sorted(missing)), source))
+        shutil.copymode(source, tmp_target)
+        os.rename(tmp_target, target)
+    finally:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+
+
+def main(argv):
+    """
+    Command line entry point.
+    """
+    logging.basicConfig(level=logging.INFO)
+    command = argv[1] if len(argv) > 1 else "status"
+    if command == "drain":
+        runner = get_runner()
+        runner.start()
+        runner.wait()
+    elif command != "status":
+        print "usage: python -m vfxconfig.pftrack [status|drain]"
+        return 1
+
+    for job in bootstrap_status():
+        print "%6d %-8s %s %s" % (job["id"], job["status"], job["payload"]["folder"], job["error"] or "")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
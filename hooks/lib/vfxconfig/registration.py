@@ -0,0 +1,329 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Background registration of the publishes in Shotgun.
+
+Registering a publish takes a Shotgun round trip, plus a thumbnail upload,
+and used to freeze the application for each publish. The publish hooks now
+only queue the registration once the files are on disk, and return. The
+registrations are stored in a persistent queue on the local disk and sent
+to Shotgun by background worker threads, which retry failed ones with an
+increasing delay. Thumbnails are copied next to the queue, as the files
+given by the publish app are temporary.
+
+A registration waits for the queued registrations of its dependency paths,
+for example a secondary publish for its primary publish: Shotgun silently
+drops the dependencies it cannot find yet. Registrations which failed for
+good are reported to the artist by the post-publish hook, see
+take_failed_registrations().
+
+Worker threads are daemonic, so that a failing registration retried with
+its increasing delay does not keep an application from exiting. On exit, an
+application waits TK_REGISTRATION_EXIT_TIMEOUT seconds (10 by default) for
+the registrations it submitted, and logs the ones still pending: they are
+sent by the next process draining the queue, as the ones of a process which
+died. Callers which need the Shotgun entity of a publish wait for it with
+wait_for_registration().
+
+Finished registrations are kept in the queue for
+TK_REGISTRATION_RETENTION seconds, a week by default, and purged by the next
+process starting to drain it.
+
+The queue can be inspected, drained, and its failed registrations retried
+from a shell:
+
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.registration status
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.registration drain
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.registration retry
+"""
+
+import os
+import sys
+import time
+import atexit
+import base64
+import shutil
+import logging
+import threading
+
+from .paths import local_cache_root, ensure_folder
+from .jobqueue import JobQueue, JobRunner, PENDING, RUNNING, DONE, FAILED
+
+log = logging.getLogger(__name__)
+
+JOB_KIND = "shotgun_registration"
+
+# number of registrations sent in parallel.
+# Can be overridden with the TK_REGISTRATION_WORKERS environment variable.
+DEFAULT_WORKERS = 2
+
+# attempts of a registration, the delay between two attempts doubles
+MAX_ATTEMPTS = 6
+RETRY_DELAY = 5
+
+# seconds an application waits for its registrations on exit.
+# Can be overridden with the TK_REGISTRATION_EXIT_TIMEOUT environment variable.
+DEFAULT_EXIT_TIMEOUT = 10
+
+# seconds finished registrations are kept in the queue.
+# Can be overridden with the TK_REGISTRATION_RETENTION environment variable.
+DEFAULT_RETENTION = 7 * 24 * 3600
+
+THUMBNAILS_FOLDER = "registration_thumbnails"
+
+_runner = None
+_runner_lock = threading.Lock()
+# ids of the registrations submitted by this process
+_submitted = set()
+# ids of the failed registrations already reported
+_reported = set()
+# toolkit instances of the worker threads, one per thread and configuration
+_local = threading.local()
+
+
+class RegistrationError(Exception):
+    """
+    A registration failed for good, or was not done in time.
+    """
+
+
+def get_queue():
+    """
+    Return the queue holding the registrations of the current user.
+    """
+    return JobQueue(os.path.join(local_cache_root(), "registration_jobs.db"))
+
+
+def _env_number(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def get_runner():
+    """
+    Return the process wide runner draining the registration queue.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            queue = get_queue()
+            queue.purge(_env_number("TK_REGISTRATION_RETENTION", DEFAULT_RETENTION))
+            workers = int(_env_number("TK_REGISTRATION_WORKERS", DEFAULT_WORKERS))
+            _runner = JobRunner(queue, {JOB_KIND: register_publish}, workers=workers,
+                                max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY, backoff=2,
+                                linger=True, daemon=True)
+            atexit.register(_wait_on_exit)
+        return _runner
+
+
+def _keep_thumbnail(thumbnail_path):
+    """
+    Copy a thumbnail next to the queue, it is removed once registered.
+    """
+    if not thumbnail_path or not os.path.isfile(thumbnail_path):
+        return None
+    folder = os.path.join(local_cache_root(), THUMBNAILS_FOLDER)
+    ensure_folder(folder)
+    (base, ext) = os.path.splitext(os.path.basename(thumbnail_path))
+    kept = os.path.join(folder, "%s-%d-%f%s" % (base, os.getpid(), time.time(), ext))
+    shutil.copyfile(thumbnail_path, kept)
+    return kept
+
+
+def submit_registration(tk, context, **kwargs):
+    """
+    Queue the registration of a publish and make sure the queue is being
+    drained.
+
+    :param tk:      Toolkit API instance
+    :param context: Context of the publish
+    :param kwargs:  Arguments of tank.util.register_publish: path, name,
+                    version_number, thumbnail_path, task, comment,
+                    dependency_paths, published_file_type...
+    :returns: The id of the registration job
+    """
+    import tank
+    args = dict(kwargs)
+    args["thumbnail_path"] = _keep_thumbnail(args.get("thumbnail_path"))
+    payload = {"config": tk.pipeline_configuration.get_path(),
+               "context": base64.b64encode(tank.context.serialize(context)),
+               "args": args}
+    runner = get_runner()
+    job_id = get_queue().submit(JOB_KIND, payload, key=args.get("path"), after=args.get("dependency_paths"))
+    with _runner_lock:
+        _submitted.add(job_id)
+    runner.start()
+    return job_id
+
+
+def _get_tk(config):
+    """
+    Return the toolkit instance of a configuration for the current thread,
+    as Shotgun connections cannot be shared between threads.
+    """
+    import tank
+    instances = getattr(_local, "instances", None)
+    if instances is None:
+        instances = _local.instances = {}
+    if config not in instances:
+        instances[config] = tank.tank_from_path(config)
+    return instances[config]
+
+
+def register_publish(payload):
+    """
+    Register a queued publish in Shotgun.
+
+    :param payload: Job payload, see submit_registration()
+    :returns: The Shotgun entity of the publish
+    """
+    import tank
+    tk = _get_tk(payload["config"])
+    context = tank.context.deserialize(base64.b64decode(payload["context"]))
+    args = dict(payload["args"])
+    thumbnail_path = args.get("thumbnail_path")
+    if thumbnail_path and not os.path.isfile(thumbnail_path):
+        # removed by an earlier attempt which registered it
+        args["thumbnail_path"] = None
+    sg_data = tank.util.register_publish(tk=tk, context=context, **args)
+    if thumbnail_path and os.path.isfile(thumbnail_path):
+        os.remove(thumbnail_path)
+    return sg_data
+
+
+def registration_status(job_id=None):
+    """
+    Return the state of the registrations.
+
+    :param job_id: Optional job id, by default all the registrations are
+                   returned
+    :returns: A job dictionary, or a list of them if no job id was given.
+              The Shotgun entity of a done registration is its "result".
+    """
+    queue = get_queue()
+    if job_id is not None:
+        return queue.status(job_id)
+    return queue.jobs(kind=JOB_KIND)
+
+
+def flush(job_ids=None, timeout=None):
+    """
+    Block until registrations are done.
+
+    :param job_ids: Ids of the registrations to wait for, by default the
+                    ones submitted by this process
+    :param timeout: Optional maximum number of seconds to wait
+    :returns: Dictionary of job id -> Shotgun entity
+    :raises: RegistrationError if a registration failed for good, or if
+             they are not all done in time
+    """
+    if job_ids is None:
+        with _runner_lock:
+            job_ids = sorted(_submitted)
+    queue = get_queue()
+    get_runner().start()
+    deadline = time.time() + timeout if timeout is not None else None
+    delay = 0.05
+    while True:
+        jobs = [job for job in (queue.status(job_id) for job_id in job_ids) if job]
+        failed = [job for job in jobs if job["status"] == FAILED]
+        if failed:
+            raise RegistrationError("Registration of %s failed: %s"
+                                    % (failed[0]["payload"]["args"].get("path"), failed[0]["error"]))
+        if all(job["status"] == DONE for job in jobs):
+            return dict((job["id"], job["result"]) for job in jobs)
+        if deadline is not None and time.time() > deadline:
+            raise RegistrationError("Registrations still pending after %s seconds" % timeout)
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+
+def take_failed_registrations():
+    """
+    Return the registrations submitted by this process which failed for
+    good, and were not returned by a previous call.
+
+    :returns: List of job dictionaries, the error of a registration is its
+              "error"
+    """
+    with _runner_lock:
+        job_ids = sorted(_submitted - _reported)
+    if not job_ids:
+        return []
+    queue = get_queue()
+    failed = [job for job in (queue.status(job_id) for job_id in job_ids) if job and job["status"] == FAILED]
+    with _runner_lock:
+        _reported.update(job["id"] for job in failed)
+    return failed
+
+
+def wait_for_registration(job_id, timeout=None):
+    """
+    Return the Shotgun entity of a publish, waiting for its registration.
+
+    :param job_id:  Id of the registration job
+    :param timeout: Optional maximum number of seconds to wait
+    :returns: The Shotgun entity dictionary
+    """
+    return flush([job_id], timeout)[job_id]
+
+
+def _wait_on_exit():
+    """
+    Give the registrations of this process some time to be sent before it
+    exits, and log the ones left to the next process.
+    """
+    with _runner_lock:
+        job_ids = sorted(_submitted)
+    if not job_ids:
+        return
+    queue = get_queue()
+    deadline = time.time() + _env_number("TK_REGISTRATION_EXIT_TIMEOUT", DEFAULT_EXIT_TIMEOUT)
+    while True:
+        pending = [job for job in (queue.status(job_id) for job_id in job_ids)
+                   if job and job["status"] in (PENDING, RUNNING)]
+        if not pending or time.time() > deadline:
+            break
+        time.sleep(0.2)
+    for job in pending:
+        log.warning("Registration of %s not sent yet, it will be sent by the next application publishing"
+                    " or by 'python -m vfxconfig.registration drain'" % job["payload"]["args"].get("path"))
+
+
+def main(argv):
+    """
+    Command line entry point.
+    """
+    logging.basicConfig(level=logging.INFO)
+    command = argv[1] if len(argv) > 1 else "status"
+    if command == "status":
+        for job in registration_status():
+            print "%5d %-8s %d attempts  %s  %s" % (job["id"], job["status"], job["attempts"],
+                                                     job["payload"]["args"].get("path"), job["error"] or "")
+    elif command == "drain":
+        runner = get_runner()
+        runner.start()
+        runner.wait()
+    elif command == "retry":
+        print "%d registrations queued again" % get_queue().retry_failed(JOB_KIND)
+        runner = get_runner()
+        runner.start()
+        runner.wait()
+    else:
+        print "usage: python -m vfxconfig.registration [status|drain|retry]"
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
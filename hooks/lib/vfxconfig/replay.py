@@ -0,0 +1,242 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Replay of the folders created at another site.
+
+A "remote_entity_folder" item is a folder which was created by another user,
+possibly on another file storage. Where each site has its own synced
+storage, those folders have to be created again locally.
+
+All the remote items of a path cache sync are replayed in one batch: they
+are coalesced into the minimal set of leaf folders, which are created in
+parallel with a bounded rate. A journal on the local disk records which
+folders were replayed, so that syncing the same events again (for example a
+full re-sync) only touches the disk for the new ones.
+
+Folders are kept in the journal for TK_REPLAY_RETENTION seconds, 30 days by
+default. A folder forgotten by the journal is only created again, which
+does nothing if it exists.
+"""
+
+import os
+import time
+import errno
+import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .paths import local_cache_root, ensure_folder
+
+# maximum number of folders created per second, all threads included.
+# Can be overridden with the TK_REPLAY_MAX_RATE environment variable.
+DEFAULT_MAX_RATE = 200
+
+DEFAULT_THREADS = 8
+
+# seconds replayed folders are kept in the journal.
+# Can be overridden with the TK_REPLAY_RETENTION environment variable.
+DEFAULT_RETENTION = 30 * 24 * 3600
+
+
+def coalesce_leaves(paths):
+    """
+    Reduce a list of folders to the ones which are not a parent of another.
+
+    Creating the leaves with os.makedirs creates all the other folders.
+
+    :param paths: List of folder paths
+    :returns: Sorted list of normalized leaf paths
+    """
+    normalized = sorted(set(os.path.normpath(path) for path in paths))
+    leaves = []
+    for (index, path) in enumerate(normalized):
+        # in sorted order, the children of a folder come right after it
+        # (possibly after siblings sharing the same prefix, like "a-b" for "a")
+        is_parent = False
+        prefix = path + os.sep
+        for other in normalized[index + 1:]:
+            if other.startswith(prefix):
+                is_parent = True
+                break
+            if not other.startswith(path):
+                break
+        if not is_parent:
+            leaves.append(path)
+    return leaves
+
+
+class RateLimiter(object):
+    """
+    Thread safe limiter spacing out operations to a maximum rate.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: Maximum number of operations per second, 0 for no limit
+        """
+        self._interval = 1.0 / rate if rate > 0 else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next operation is allowed.
+        """
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next)
+            self._next = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ReplayJournal(object):
+    """
+    Local record of the folders which have been replayed.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the sqlite journal, created if needed
+        """
+        self._path = path
+        ensure_folder(os.path.dirname(path))
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS replayed (path TEXT PRIMARY KEY, replayed REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS replayed_time ON replayed (replayed)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=60)
+
+    def filter_new(self, paths):
+        """
+        Return the paths which have not been replayed yet.
+        """
+        conn = self._connect()
+        try:
+            known = set()
+            paths = list(paths)
+            # stay below the sqlite limit of variables per statement
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                rows = conn.execute("SELECT path FROM replayed WHERE path IN (%s)" % ", ".join("?" * len(chunk)),
+                                    chunk).fetchall()
+                known.update(row[0] for row in rows)
+        finally:
+            conn.close()
+        return [path for path in paths if path not in known]
+
+    def record(self, paths):
+        """
+        Record that the given folders exist on the local storage.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO replayed (path, replayed) VALUES (?, ?)",
+                                 [(path, now) for path in paths])
+        finally:
+            conn.close()
+
+
+    def purge(self, older_than):
+        """
+        Forget the folders replayed more than the given number of seconds ago.
+
+        :returns: Number of folders forgotten
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM replayed WHERE replayed < ?",
+                                    (time.time() - older_than,)).rowcount
+        finally:
+            conn.close()
+
+
+class RemoteFolderReplay(object):
+    """
+    Creates the folders of a batch of remote_entity_folder items.
+    """
+
+    def __init__(self, journal=None, threads=DEFAULT_THREADS, max_rate=None):
+        """
+        :param journal:  ReplayJournal to use, defaults to one in the local cache,
+                         purged of the folders older than TK_REPLAY_RETENTION
+        :param threads:  Number of worker threads
+        :param max_rate: Maximum number of folders created per second, defaults
+                         to TK_REPLAY_MAX_RATE or DEFAULT_MAX_RATE
+        """
+        if journal is None:
+            journal = ReplayJournal(os.path.join(local_cache_root(), "remote_folders.db"))
+            try:
+                retention = float(os.environ.get("TK_REPLAY_RETENTION", DEFAULT_RETENTION))
+            except ValueError:
+                retention = DEFAULT_RETENTION
+            journal.purge(retention)
+        if max_rate is None:
+            try:
+                max_rate = float(os.environ.get("TK_REPLAY_MAX_RATE", DEFAULT_MAX_RATE))
+            except ValueError:
+                max_rate = DEFAULT_MAX_RATE
+        self._journal = journal
+        self._threads = threads
+        self._limiter = RateLimiter(max_rate)
+
+    def replay(self, items, preview_mode):
+        """
+        Create the folders of remote items which are missing on the local storage.
+
+        :param items:        List of remote_entity_folder item dictionaries
+        :param preview_mode: If True, nothing is written to disk
+        :returns: List of the leaf folders which were created
+        """
+        all_paths = [os.path.normpath(item.get("path")) for item in items]
+        new_paths = self._journal.filter_new(all_paths)
+        leaves = coalesce_leaves(new_paths)
+        if not leaves:
+            return []
+
+        if preview_mode:
+            return [path for path in leaves if not os.path.exists(path)]
+
+        pool = ThreadPool(min(self._threads, len(leaves)))
+        try:
+            states = pool.map(self._create, leaves)
+        finally:
+            pool.close()
+            pool.join()
+
+        # every folder of the batch now exists locally
+        self._journal.record(new_paths)
+        return [path for (path, created) in zip(leaves, states) if created]
+
+    def _create(self, path):
+        """
+        Create a leaf folder and its parents.
+
+        :returns: True if the folder was created
+        """
+        self._limiter.wait()
+        try:
+            # create the folder using open permissions
+            os.makedirs(path, 0770)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        return True
@@ -0,0 +1,139 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Directory scans shared by all the hooks of a publish.
+
+The pre-publish, publish and post-publish hooks look for the versions of
+the same work area several times. A scan session is opened by the
+pre-publish hook and closed by the post-publish hook. While it is open, the
+version index of a work area, see versionindex, is refreshed once, with the
+user folders checked concurrently.
+
+Publish areas are not cached by the session: deciding whether a publish
+would overwrite a file is always done on the file system, as another artist
+may have published it since.
+
+Files written by the publish are reported to the session, and the indexes
+are refreshed again the next time they are used. A session left open by a
+publish which failed half way expires after TK_SCAN_SESSION_TTL seconds,
+600 by default.
+"""
+
+import os
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+
+DEFAULT_TTL = 600
+DEFAULT_THREADS = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def parallel_map(func, items, threads=DEFAULT_THREADS):
+    """
+    Call a function on each item, from several threads if there are a few.
+
+    :returns: List of the results, in the order of the items
+    """
+    items = list(items)
+    if len(items) < 2 or threads < 2:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(threads, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class ScanSession(object):
+    """
+    Indexes refreshed during a publish.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        """
+        :param ttl: Seconds after which the session is no longer used
+        """
+        self._expires = time.time() + ttl
+        self._lock = threading.Lock()
+        # keys of the indexes refreshed during the session
+        self._refreshed = set()
+
+    def expired(self):
+        return time.time() > self._expires
+
+    def written(self, path):
+        """
+        Report a file written during the publish.
+        """
+        with self._lock:
+            self._refreshed.clear()
+
+    def first_refresh(self, key):
+        """
+        Check if an index needs refreshing during the session, and mark it
+        as refreshed.
+
+        :param key: Key of the index
+        :returns: True the first time a key is given, and after files were
+                  written
+        """
+        with self._lock:
+            if key in self._refreshed:
+                return False
+            self._refreshed.add(key)
+            return True
+
+
+def begin_session():
+    """
+    Open the scan session of a publish, replacing any previous one.
+    """
+    global _session
+    try:
+        ttl = float(os.environ.get("TK_SCAN_SESSION_TTL", DEFAULT_TTL))
+    except ValueError:
+        ttl = DEFAULT_TTL
+    with _session_lock:
+        _session = ScanSession(ttl)
+        return _session
+
+
+def end_session():
+    """
+    Close the scan session of the publish.
+    """
+    global _session
+    with _session_lock:
+        _session = None
+
+
+def current_session():
+    """
+    Return the scan session of the publish, or None.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None and _session.expired():
+            _session = None
+        return _session
+
+
+def session_written(path):
+    """
+    Report a file written by the publish to the scan session, if there is one.
+    """
+    session = current_session()
+    if session is not None:
+        session.written(path)
@@ -0,0 +1,245 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compiled manifest of the files of the folder schema.
+
+The files of the schema tree under core/schema which folder creation copies
+into the project are compiled into a single manifest holding their content.
+The folder creation hook writes them from memory, rather than reading them
+from the configuration storage for every shot and asset.
+
+The manifest is cached on the local disk and in memory, keyed by a digest of
+the name, size, modification time and inode of every entry of the schema
+tree: any file or folder added, removed or edited gives a new manifest. The
+digest costs a stat walk of the schema per folder creation run, a small part
+of the walk the toolkit core does itself to build the folder creation items,
+which the manifest does not replace.
+
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.schema <config>/core/schema
+"""
+
+import os
+import sys
+import json
+import base64
+import fnmatch
+import hashlib
+import threading
+
+from .paths import local_cache_root, ensure_folder
+
+MANIFEST_VERSION = 3
+
+# files larger than this are copied from the schema, not kept in the manifest
+MAX_INLINE_SIZE = 256 * 1024
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def read_ignore_patterns(schema_root):
+    """
+    Return the file patterns listed in the ignore_files file of a schema.
+    """
+    path = os.path.join(schema_root, "ignore_files")
+    if not os.path.isfile(path):
+        return []
+    patterns = []
+    fh = open(path, "r")
+    try:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                patterns.append(line)
+    finally:
+        fh.close()
+    return patterns
+
+
+def schema_digest(schema_root):
+    """
+    Compute a digest of the schema tree from the stat of all its entries.
+    No file is read.
+
+    :param schema_root: Path to the schema folder
+    :returns: Hex digest
+    """
+    digest = hashlib.sha1()
+    for folder, dirs, files in os.walk(schema_root):
+        dirs.sort()
+        relative = os.path.relpath(folder, schema_root)
+        for name in sorted(files):
+            st = os.stat(os.path.join(folder, name))
+            # the modification time to the sub second, and the inode as a
+            # file saved by renaming a new one over it gets a new one
+            digest.update("%s\0%s\0%d\0%r\0%d\n" % (relative, name, st.st_size, st.st_mtime, st.st_ino))
+        digest.update("%s\0\n" % relative)
+    return digest.hexdigest()
+
+
+def compile_manifest(schema_root):
+    """
+    Walk a schema tree and compile the files folder creation copies.
+
+    :param schema_root: Path to the schema folder
+    :returns: Manifest dictionary with the keys:
+              - files: dictionary of relative path -> {mode, size, content}
+                for every file to copy, content being base64 encoded or None
+                for large files
+              - ignore: the ignore_files patterns
+    """
+    ignore = read_ignore_patterns(schema_root)
+
+    def ignored(name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in ignore)
+
+    files = {}
+    for folder, dirs, names in os.walk(schema_root):
+        dirs[:] = sorted(d for d in dirs if not ignored(d))
+        relative = os.path.relpath(folder, schema_root)
+        for name in sorted(names):
+            if ignored(name) or relative == ".":
+                continue
+            # yml files are node configurations, unless there is no matching folder
+            if name.endswith(".yml") and os.path.isdir(os.path.join(folder, name[:-4])):
+                continue
+            path = os.path.join(folder, name)
+            st = os.stat(path)
+            content = None
+            if st.st_size <= MAX_INLINE_SIZE:
+                fh = open(path, "rb")
+                try:
+                    content = base64.b64encode(fh.read())
+                finally:
+                    fh.close()
+            files[os.path.normpath(os.path.join(relative, name))] = {"mode": st.st_mode & 0777,
+                                                                      "size": st.st_size,
+                                                                      "content": content}
+
+    return {"version": MANIFEST_VERSION,
+            "files": files,
+            "ignore": ignore}
+
+
+def load_manifest(schema_root):
+    """
+    Return the manifest of the current state of a schema, compiling it if
+    it is not cached yet.
+
+    :param schema_root: Path to the schema folder
+    :returns: A SchemaManifest
+    """
+    schema_root = os.path.normpath(os.path.abspath(schema_root))
+    digest = schema_digest(schema_root)
+    with _manifests_lock:
+        manifest = _manifests.get(schema_root)
+        if manifest is not None and manifest.digest == digest:
+            return manifest
+
+        prefix = hashlib.sha1(schema_root).hexdigest()
+        cache_folder = ensure_folder(os.path.join(local_cache_root(), "schema_manifests"))
+        cache_path = os.path.join(cache_folder, "%s-%s.json" % (prefix, digest))
+        data = None
+        if os.path.isfile(cache_path):
+            fh = open(cache_path, "r")
+            try:
+                data = json.load(fh)
+            except ValueError:
+                # truncated file, compile it again
+                data = None
+            finally:
+                fh.close()
+        if not data or data.get("version") != MANIFEST_VERSION:
+            data = compile_manifest(schema_root)
+            tmp_path = "%s.tmp-%d" % (cache_path, os.getpid())
+            fh = open(tmp_path, "w")
+            try:
+                json.dump(data, fh)
+            finally:
+                fh.close()
+            os.rename(tmp_path, cache_path)
+            # manifests of the previous states of the schema
+            for name in os.listdir(cache_folder):
+                if name.startswith(prefix + "-") and name.endswith(".json") and name != os.path.basename(cache_path):
+                    try:
+                        os.remove(os.path.join(cache_folder, name))
+                    except OSError:
+                        pass
+
+        manifest = SchemaManifest(schema_root, data, digest)
+        _manifests[schema_root] = manifest
+        return manifest
+
+
+class SchemaManifest(object):
+    """
+    Read access to a compiled schema manifest.
+    """
+
+    def __init__(self, schema_root, data, digest=None):
+        """
+        :param schema_root: Path to the schema folder
+        :param data:        Manifest dictionary, see compile_manifest()
+        :param digest:      Digest of the schema the manifest was compiled
+                            from, see schema_digest()
+        """
+        self._root = schema_root
+        self._data = data
+        self.digest = digest
+        self._contents = {}
+        self._lock = threading.Lock()
+
+    @property
+    def files(self):
+        """
+        Dictionary of relative path -> {mode, size, content} of the schema
+        files
+        """
+        return self._data["files"]
+
+    def file_content(self, source_path):
+        """
+        Return the content of a schema file, if it is held by the manifest.
+
+        :param source_path: Absolute path of a file of the schema
+        :returns: The file content, or None
+        """
+        source_path = os.path.normpath(source_path)
+        if not source_path.startswith(self._root + os.sep):
+            return None
+        relative = source_path[len(self._root) + 1:]
+        entry = self._data["files"].get(relative)
+        if not entry or entry["content"] is None:
+            return None
+        with self._lock:
+            content = self._contents.get(relative)
+            if content is None:
+                content = self._contents[relative] = base64.b64decode(entry["content"])
+        return content
+
+
+def main(argv):
+    """
+    Command line entry point, prints a summary of the manifest of a schema.
+    """
+    if len(argv) != 2:
+        print "usage: python -m vfxconfig.schema <schema folder>"
+        return 1
+    manifest = load_manifest(argv[1])
+    inline = [entry for entry in manifest.files.values() if entry["content"] is not None]
+    print "%-20s %s" % ("digest", manifest.digest)
+    print "%-20s %d" % ("files", len(manifest.files))
+    print "%-20s %d (%d bytes)" % ("held in memory", len(inline), sum(entry["size"] for entry in inline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,115 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Mapping of the frames of an image sequence from one template to others.
+
+Only the frame number changes between the files of a sequence, so the
+source template is only resolved once per sequence: the source path and the
+target paths are built with a marker frame number, which splits each of
+them in a static prefix and suffix. The path of every frame is then found
+by putting the frame number of the source file between them.
+
+The frame key must be the same in the source and target templates, the
+frame number text is copied from the source path as is.
+"""
+
+# frame number used to find where the frame goes in a path
+MARKER_FRAME = 987654321
+
+
+class SequenceMapper(object):
+    """
+    Maps the files of image sequences to the paths of target templates.
+    """
+
+    def __init__(self, source_template, target_templates, extra_fields=None, frame_key="SEQ"):
+        """
+        :param source_template:  Template of the source files
+        :param target_templates: List of templates to map the files to
+        :param extra_fields:     Dictionary of fields to set on top of the
+                                 fields of the source files
+        :param frame_key:        Name of the frame number key
+        """
+        self._source_template = source_template
+        self._target_templates = target_templates
+        self._extra_fields = extra_fields or {}
+        self._frame_key = frame_key
+        # list of ((source prefix, source suffix), [(target prefix, target suffix)])
+        self._patterns = []
+
+    def _split(self, path):
+        """
+        Split a path built with the marker frame around the marker.
+
+        :returns: Tuple (prefix, suffix), or None if the marker is not found once
+        """
+        marker = str(MARKER_FRAME)
+        if path.count(marker) != 1:
+            return None
+        return tuple(path.split(marker))
+
+    def _add_pattern(self, path):
+        """
+        Resolve the source template for a file, and record the prefix and
+        suffix of the source and target paths of its sequence.
+
+        :returns: List of the target paths of the file
+        """
+        fields = self._source_template.get_fields(path)
+        fields.update(self._extra_fields)
+        if self._frame_key in fields:
+            marked = dict(fields)
+            marked[self._frame_key] = MARKER_FRAME
+            source = self._split(self._source_template.apply_fields(marked))
+            targets = [self._split(template.apply_fields(marked)) for template in self._target_templates]
+            # files matching a known pattern but with a frame which is not
+            # all digits, such as "####", come back here every time
+            if source and None not in targets and (source, targets) not in self._patterns:
+                self._patterns.append((source, targets))
+        # the file itself is resolved the slow way
+        return [template.apply_fields(fields) for template in self._target_templates]
+
+    def _match(self, path):
+        """
+        Return the target paths of a file of a known sequence, or None.
+        """
+        for ((prefix, suffix), targets) in self._patterns:
+            if path.startswith(prefix) and path.endswith(suffix):
+                frame = path[len(prefix):len(path) - len(suffix)]
+                if frame.isdigit():
+                    return [target_prefix + frame + target_suffix
+                            for (target_prefix, target_suffix) in targets]
+        return None
+
+    def targets(self, path):
+        """
+        Return the target paths of a file.
+
+        :param path: Path of a source file
+        :returns: List of paths, one per target template
+        """
+        targets = self._match(path)
+        if targets is None:
+            targets = self._add_pattern(path)
+        return targets
+
+    def pairs(self, paths):
+        """
+        Map files to all the target templates.
+
+        :param paths: List of source files
+        :returns: List of (source, target) tuples, all the files for the
+                  first target template first
+        """
+        per_file = [(path, self.targets(path)) for path in paths]
+        return [(path, targets[index])
+                for index in range(len(self._target_templates))
+                for (path, targets) in per_file]
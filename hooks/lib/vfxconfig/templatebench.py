@@ -0,0 +1,322 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Performance and ambiguity benchmark of the templates of this configuration.
+
+The templates are read from core/templates.yml with the template classes of
+the toolkit core, without any Shotgun connection or project: the path
+templates are rooted in a fake storage root. For each template, a few
+synthetic sets of fields are generated from its keys, and the time taken by
+apply_fields, validate and get_fields is measured on them. Every synthetic
+path is then validated against all the other templates, and the other
+templates accepting it are reported as ambiguous matches.
+
+    PYTHONPATH=<config>/hooks/lib python -m vfxconfig.templatebench [options]
+
+The report is written as json, and can be compared with the report of a
+previous run with --baseline: the run fails if new ambiguous matches showed
+up, or if a template got much slower. The run also fails if the file name
+parser of fieldextract, used to find work file versions, disagrees with
+get_fields on the synthetic files of a template.
+
+The toolkit core is imported from the python path, from TK_CORE_PYTHON, or
+from the install folder next to this configuration.
+"""
+
+import os
+import sys
+import json
+import time
+import optparse
+
+from .config import config_path, CONFIG_ROOT, load_yaml
+from . import fieldextract
+
+# storage root of the path templates
+FAKE_ROOT = os.path.join(os.sep, "templatebench", "primary")
+
+# number of synthetic field sets per template
+DEFAULT_SAMPLES = 5
+# number of calls timed per synthetic field set and operation
+DEFAULT_ITERATIONS = 200
+# a template is slower than in the baseline above this ratio
+DEFAULT_TOLERANCE = 2.0
+
+OPERATIONS = ("apply_fields", "validate", "get_fields")
+
+
+def _import_tank():
+    """
+    Import the toolkit core, looking for it next to this configuration if
+    it is not on the python path.
+    """
+    try:
+        import tank
+        return tank
+    except ImportError:
+        pass
+    candidates = [os.environ.get("TK_CORE_PYTHON"),
+                  os.path.join(os.path.dirname(CONFIG_ROOT), "install", "core", "python")]
+    for path in candidates:
+        if path and os.path.isdir(path) and path not in sys.path:
+            sys.path.append(path)
+    import tank
+    return tank
+
+
+def load_templates(root=FAKE_ROOT):
+    """
+    Read the templates of this configuration, without a project.
+
+    :param root: Storage root of the path templates
+    :returns: Dictionary of template name -> template
+    """
+    _import_tank()
+    from tank import template_includes
+    from tank.templatekey import make_keys
+    from tank.template import make_template_paths, make_template_strings
+
+    path = config_path("core", "templates.yml")
+    data = template_includes.process_includes(path, load_yaml(path) or {})
+    keys = make_keys(data.get("keys") or {})
+    template_paths = make_template_paths(data.get("paths") or {}, keys, {"primary": root})
+    template_strings = make_template_strings(data.get("strings") or {}, keys, template_paths)
+    templates = {}
+    templates.update(template_paths)
+    templates.update(template_strings)
+    return templates
+
+
+def _letters(index):
+    """
+    Return a short lower case word for a number, "a", "b", ... "ba", ...
+    Letters only, so that the value never contains a template separator.
+    """
+    word = ""
+    while True:
+        word = chr(ord("a") + index % 26) + word
+        index = index // 26
+        if not index:
+            return "x" + word
+
+
+def _key_values(key, index):
+    """
+    Return candidate values of a key for a synthetic field set, best first.
+    """
+    values = []
+    if getattr(key, "default", None) is not None:
+        values.append(key.default)
+    values.extend(getattr(key, "choices", None) or [])
+    from tank.templatekey import IntegerKey, SequenceKey
+    if isinstance(key, SequenceKey):
+        values.extend([1001 + index, "%04d" % (1001 + index)])
+    elif isinstance(key, IntegerKey):
+        values.extend([index + 1, 2013 if key.name == "YYYY" else 1])
+    else:
+        values.extend([_letters(index), "x%d" % index])
+    # choices and defaults are the same for every sample, put them last
+    # after the first one so that samples differ when they can
+    if index and len(values) > 1:
+        values = values[1:] + values[:1]
+    return values
+
+
+def synthetic_fields(template, index):
+    """
+    Build a set of fields covering all the keys of a template.
+
+    :param template: Template to build the fields for
+    :param index:    Number of the sample, to vary the values
+    :returns: Dictionary of fields, or None if some key accepts none of the
+              generated values
+    """
+    fields = {}
+    for (name, key) in template.keys.items():
+        for value in _key_values(key, index):
+            if key.validate(value):
+                fields[name] = value
+                break
+        else:
+            return None
+    return fields
+
+
+def _time(func, iterations):
+    """
+    Return the average duration of a call in microseconds.
+    """
+    start = time.time()
+    for _ in xrange(iterations):
+        func()
+    return (time.time() - start) * 1e6 / iterations
+
+
+def _is_path_template(template):
+    return getattr(template, "root_path", None) is not None
+
+
+def benchmark(templates, samples=DEFAULT_SAMPLES, iterations=DEFAULT_ITERATIONS):
+    """
+    Time the templates and look for ambiguous matches.
+
+    :param templates:  Dictionary of template name -> template
+    :param samples:    Number of synthetic field sets per template
+    :param iterations: Number of timed calls per field set and operation
+    :returns: Report dictionary, see main()
+    """
+    report = {"templates": {}, "ambiguous": {}, "errors": {}}
+    names = sorted(templates)
+    for name in names:
+        template = templates[name]
+        timings = dict((operation, 0.0) for operation in OPERATIONS)
+        generated = []
+        try:
+            for index in range(samples):
+                fields = synthetic_fields(template, index)
+                if fields is None:
+                    raise ValueError("no valid value generated for some keys of %s" % template.definition)
+                value = template.apply_fields(fields)
+                if not template.validate(value):
+                    raise ValueError("%s does not validate its own result %s" % (name, value))
+                timings["apply_fields"] += _time(lambda: template.apply_fields(fields), iterations)
+                timings["validate"] += _time(lambda: template.validate(value), iterations)
+                timings["get_fields"] += _time(lambda: template.get_fields(value), iterations)
+                generated.append(value)
+        except Exception, e:
+            report["errors"][name] = str(e)
+            continue
+
+        entry = dict((operation, timings[operation] / samples) for operation in OPERATIONS)
+        entry["total"] = sum(entry[operation] for operation in OPERATIONS)
+        entry["definition"] = template.definition
+        report["templates"][name] = entry
+
+        # the other templates of the same kind accepting the synthetic values
+        others = set()
+        for value in generated:
+            for other_name in names:
+                other = templates[other_name]
+                if other_name == name or _is_path_template(other) != _is_path_template(template):
+                    continue
+                try:
+                    if other.validate(value):
+                        others.add(other_name)
+                except Exception:
+                    # not a kind of value this template can validate
+                    pass
+        if others:
+            report["ambiguous"][name] = sorted(others)
+
+    report["ranking"] = sorted(report["templates"],
+                               key=lambda n: report["templates"][n]["total"], reverse=True)
+    return report
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare a report with the report of a previous run.
+
+    :param report:    Report of this run
+    :param baseline:  Report of a previous run
+    :param tolerance: Ratio of total time above which a template is reported
+                      as slower
+    :returns: List of regression messages, empty if there is none
+    """
+    problems = []
+    for (name, others) in sorted(report["ambiguous"].items()):
+        new = set(others) - set(baseline.get("ambiguous", {}).get(name, []))
+        if new:
+            problems.append("%s: new ambiguous matches %s" % (name, ", ".join(sorted(new))))
+    for (name, entry) in sorted(report["templates"].items()):
+        previous = baseline.get("templates", {}).get(name)
+        if previous and previous["total"] > 0 and entry["total"] / previous["total"] > tolerance:
+            problems.append("%s: %.1f us per call set, was %.1f us" % (name, entry["total"], previous["total"]))
+    for name in sorted(report["errors"]):
+        if name not in baseline.get("errors", {}):
+            problems.append("%s: %s" % (name, report["errors"][name]))
+    return problems
+
+
+def load_json(path):
+    """
+    Read a report written by a previous run.
+    """
+    fh = open(path, "r")
+    try:
+        return json.load(fh)
+    finally:
+        fh.close()
+
+
+def main(argv):
+    """
+    Command line entry point.
+    """
+    parser = optparse.OptionParser(usage="python -m vfxconfig.templatebench [options]")
+    parser.add_option("-o", "--output", default="template_benchmark.json",
+                      help="json report to write [%default]")
+    parser.add_option("-b", "--baseline", help="json report of a previous run to compare with")
+    parser.add_option("-s", "--samples", type="int", default=DEFAULT_SAMPLES,
+                      help="synthetic field sets per template [%default]")
+    parser.add_option("-i", "--iterations", type="int", default=DEFAULT_ITERATIONS,
+                      help="timed calls per field set and operation [%default]")
+    parser.add_option("-t", "--tolerance", type="float", default=DEFAULT_TOLERANCE,
+                      help="slowdown ratio reported as a regression [%default]")
+    parser.add_option("-n", "--top", type="int", default=20,
+                      help="number of templates in the printed ranking [%default]")
+    (options, args) = parser.parse_args(argv[1:])
+
+    templates = load_templates()
+    report = benchmark(templates, options.samples, options.iterations)
+    (checked, mismatches, unsupported) = fieldextract.check(templates)
+    report["extract_mismatches"] = sorted(mismatches)
+
+    fh = open(options.output, "w")
+    try:
+        json.dump(report, fh, indent=2, sort_keys=True)
+    finally:
+        fh.close()
+
+    print "Slowest templates, microseconds per call:"
+    print "%-45s %12s %12s %12s" % ("template", "apply_fields", "validate", "get_fields")
+    for name in report["ranking"][:options.top]:
+        entry = report["templates"][name]
+        print "%-45s %12.1f %12.1f %12.1f" % (name, entry["apply_fields"], entry["validate"], entry["get_fields"])
+    if report["ambiguous"]:
+        print
+        print "Ambiguous matches, synthetic paths of a template accepted by others:"
+        for (name, others) in sorted(report["ambiguous"].items()):
+            print "%-45s %s" % (name, ", ".join(others))
+    if report["errors"]:
+        print
+        print "Templates which could not be benchmarked:"
+        for (name, error) in sorted(report["errors"].items()):
+            print "%-45s %s" % (name, error)
+    print
+    print "%d templates, report written to %s" % (len(report["templates"]), options.output)
+    print "%d file names parsed by fieldextract and get_fields" % checked
+    for (name, differences) in sorted(mismatches.items()):
+        (file_name, found, expected) = differences[0]
+        print "EXTRACTION MISMATCH %s: %s extracted %s, get_fields %s" % (name, file_name, found, expected)
+
+    problems = []
+    if options.baseline:
+        problems = compare(report, load_json(options.baseline), options.tolerance)
+        for problem in problems:
+            print "REGRESSION %s" % problem
+    if problems or mismatches:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
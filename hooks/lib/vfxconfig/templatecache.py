@@ -0,0 +1,162 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Memoized template operations.
+
+A publish resolves the same few templates against the same paths many
+times. The hooks of this configuration go through the functions of this
+module rather than calling validate, get_fields and apply_fields on the
+templates, and the results are kept in a bounded, process wide cache.
+
+Results are the same as calling the templates directly: get_fields
+returns a new dictionary every time, and the errors raised by a template
+are raised again for the same arguments.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# maximum number of results remembered.
+# Can be overridden with the TK_TEMPLATE_CACHE_SIZE environment variable.
+DEFAULT_SIZE = 5000
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class TemplateCache(object):
+    """
+    Thread safe LRU cache of template results, with hit and miss counters.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        """
+        :param size: Maximum number of results remembered
+        """
+        self._size = size
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        # operation name -> [hits, misses]
+        self._stats = {}
+
+    def _call(self, operation, key, func):
+        """
+        Return the cached result of a call, calling it on a miss.
+
+        :param key: Key of the call, None if it cannot be cached
+        """
+        with self._lock:
+            counters = self._stats.setdefault(operation, [0, 0])
+            result = None
+            if key is not None:
+                result = self._results.pop(key, None)
+            if result is not None:
+                # most recently used last
+                self._results[key] = result
+                counters[0] += 1
+            else:
+                counters[1] += 1
+
+        if result is None:
+            try:
+                result = (True, func())
+            except Exception, e:
+                result = (False, e)
+            if key is not None:
+                with self._lock:
+                    self._results[key] = result
+                    while len(self._results) > self._size:
+                        self._results.popitem(last=False)
+
+        (ok, value) = result
+        if not ok:
+            raise value
+        return value
+
+    def validate(self, template, path):
+        """
+        Memoized template.validate(path).
+        """
+        return self._call("validate", ("validate", template, path), lambda: template.validate(path))
+
+    def get_fields(self, template, path):
+        """
+        Memoized template.get_fields(path).
+
+        :returns: A new fields dictionary, which the caller can modify
+        """
+        return dict(self._call("get_fields", ("get_fields", template, path), lambda: template.get_fields(path)))
+
+    def apply_fields(self, template, fields):
+        """
+        Memoized template.apply_fields(fields).
+        """
+        try:
+            key = ("apply_fields", template, frozenset(fields.items()))
+        except TypeError:
+            # unhashable field values, this call cannot be cached
+            key = None
+        return self._call("apply_fields", key, lambda: template.apply_fields(fields))
+
+    def stats(self):
+        """
+        Return the hit and miss counters.
+
+        :returns: Dictionary of operation name -> {"hits", "misses"}
+        """
+        with self._lock:
+            return dict((operation, {"hits": hits, "misses": misses})
+                        for (operation, (hits, misses)) in self._stats.items())
+
+    def clear(self):
+        """
+        Forget all the results and reset the counters.
+        """
+        with self._lock:
+            self._results.clear()
+            self._stats.clear()
+
+
+def template_cache():
+    """
+    Return the process wide template cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                size = int(os.environ.get("TK_TEMPLATE_CACHE_SIZE", DEFAULT_SIZE))
+            except ValueError:
+                size = DEFAULT_SIZE
+            _cache = TemplateCache(size)
+        return _cache
+
+
+def validate(template, path):
+    """
+    Check if a path matches a template, see TemplateCache.validate().
+    """
+    return template_cache().validate(template, path)
+
+
+def get_fields(template, path):
+    """
+    Extract the fields of a path, see TemplateCache.get_fields().
+    """
+    return template_cache().get_fields(template, path)
+
+
+def apply_fields(template, fields):
+    """
+    Build a path from fields, see TemplateCache.apply_fields().
+    """
+    return template_cache().apply_fields(template, fields)
@@ -0,0 +1,141 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Index of the templates of a configuration, to find the template matching
+a path without validating the path against every template.
+
+The static folders at the start of each path template (its storage root and
+the folders before its first key) are stored in a trie. Finding the
+templates of a path is a walk down the trie, one path component at a time,
+and only the templates found along the way are validated, most specific
+first. Templates are also filtered on their static file extension.
+"""
+
+import os
+import threading
+
+from .memo import process_memo
+from .templatecache import validate
+
+_index_lock = threading.Lock()
+
+
+def _static_prefix(template):
+    """
+    Return the components of the static folders at the start of a path
+    template, storage root included.
+    """
+    definition = template.definition.replace("/", os.sep)
+    # the static part stops at the first key or optional section
+    cut = len(definition)
+    for token in ("{", "["):
+        position = definition.find(token)
+        if position != -1:
+            cut = min(cut, position)
+    static = definition[:cut]
+    if cut < len(definition):
+        # the last component is only partly static
+        static = os.path.dirname(static) if os.sep in static else ""
+    path = os.path.join(template.root_path, static) if static else template.root_path
+    return [token for token in os.path.normcase(os.path.normpath(path)).split(os.sep) if token]
+
+
+def _static_suffix(template):
+    """
+    Return the static end of the file name of a template, for example ".ma",
+    or an empty string.
+    """
+    definition = template.definition
+    if definition.endswith("]") or definition.endswith("}"):
+        return ""
+    cut = max(definition.rfind("}"), definition.rfind("]"), definition.rfind("/"))
+    return os.path.normcase(definition[cut + 1:])
+
+
+class TemplateIndex(object):
+    """
+    Trie of the static folders of a set of templates.
+    """
+
+    def __init__(self, templates):
+        """
+        :param templates: Dictionary of template name -> template, as
+                          returned by tk.templates
+        """
+        # node: (children dict, list of (template, suffix) ending here)
+        self._trie = ({}, [])
+        # templates which are not paths, always validated last
+        self._others = []
+        for name in sorted(templates):
+            template = templates[name]
+            if getattr(template, "root_path", None) is None:
+                self._others.append(template)
+                continue
+            node = self._trie
+            for token in _static_prefix(template):
+                node = node[0].setdefault(token, ({}, []))
+            node[1].append((template, _static_suffix(template)))
+
+    def candidates(self, path):
+        """
+        Return the templates which may match a path, most specific first.
+
+        :param path: Path to match
+        :returns: List of templates
+        """
+        normalized = os.path.normcase(os.path.normpath(path))
+        found = []
+        node = self._trie
+        for token in [token for token in normalized.split(os.sep) if token]:
+            found.append(node[1])
+            node = node[0].get(token)
+            if node is None:
+                break
+        else:
+            found.append(node[1])
+
+        result = []
+        for entries in reversed(found):
+            for (template, suffix) in entries:
+                if not suffix or normalized.endswith(suffix):
+                    result.append(template)
+        return result + self._others
+
+    def match(self, path):
+        """
+        Return the template matching a path.
+
+        :param path: Path to match
+        :returns: The most specific template validating the path, or None
+        """
+        for template in self.candidates(path):
+            if validate(template, path):
+                return template
+        return None
+
+
+def get_index(tk):
+    """
+    Return the template index of a toolkit instance, built once per process
+    for each set of templates.
+
+    :param tk: Toolkit API instance
+    :returns: A TemplateIndex
+    """
+    templates = tk.templates
+    indexes = process_memo("template_index")
+    with _index_lock:
+        entry = indexes.get(id(templates))
+        # the templates are kept along with the index, so that their id
+        # cannot be reused by another dictionary
+        if entry is None or entry[0] is not templates:
+            entry = indexes[id(templates)] = (templates, TemplateIndex(templates))
+        return entry[1]
@@ -0,0 +1,286 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Allocation of publish versions between concurrent publishes.
+
+Two artists publishing the same task at the same time find the same next
+version. Before using a version, a publish reserves it by creating a
+reservation file with O_CREAT | O_EXCL in the publish folder: the file
+system lets only one of them create it, and the other one moves on to the
+next version straight away instead of failing later on the existing
+publish file.
+
+A reservation is removed once the publish is done. Reservations of a
+process of this machine which no longer runs, or older than
+TK_VERSION_RESERVATION_TTL seconds (6 hours by default), are stale and
+are collected by the next publish running into them, and by the first
+publish of a process in a publish folder.
+
+Reservation folders and files are created writable by everybody, whatever
+the umask. Where a reservation cannot be made, in a read only or foreign
+publish folder, the publish goes on without one, as it did before.
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import hashlib
+import logging
+import threading
+
+from .paths import ensure_folder
+from .jobqueue import _pid_alive
+
+log = logging.getLogger(__name__)
+
+VERSION_KEY = "version"
+
+RESERVATION_FOLDER = ".version_reservations"
+
+DEFAULT_TTL = 6 * 3600
+
+# version used to find the part of a publish path which depends on the version
+MARKER_VERSION = 987654321
+
+# versions tried before giving up
+MAX_ATTEMPTS = 100
+
+# errors meaning reservations cannot be made in a folder
+_NO_ACCESS = (errno.EACCES, errno.EPERM, errno.EROFS)
+
+_swept = set()
+_swept_lock = threading.Lock()
+
+
+class VersionAllocationError(Exception):
+    """
+    No version could be reserved.
+    """
+
+
+class Reservation(object):
+    """
+    A reserved publish version.
+    """
+
+    def __init__(self, version, path):
+        """
+        :param version: The reserved version number
+        :param path:    Path to the reservation file, None if the version
+                        could not be reserved
+        """
+        self.version = version
+        self.path = path
+
+    def release(self):
+        """
+        Remove the reservation, once the publish is done or failed.
+        """
+        if self.path is None:
+            return
+        try:
+            os.remove(self.path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                log.warning("Could not remove version reservation %s: %s" % (self.path, e))
+
+
+def _ttl():
+    try:
+        return float(os.environ.get("TK_VERSION_RESERVATION_TTL", DEFAULT_TTL))
+    except ValueError:
+        return DEFAULT_TTL
+
+
+def _create(path):
+    """
+    Atomically create a reservation file.
+
+    :returns: True if this process created it, False if it already exists
+    """
+    old_umask = os.umask(0)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+    except OSError, e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise
+    finally:
+        os.umask(old_umask)
+    try:
+        data = json.dumps({"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()})
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+    return True
+
+
+def _read(path):
+    """
+    Return the content of a reservation file, or None if it is gone.
+    """
+    try:
+        fh = open(path, "r")
+    except IOError:
+        return None
+    try:
+        return fh.read()
+    finally:
+        fh.close()
+
+
+def _is_stale(path, content):
+    try:
+        age = time.time() - os.stat(path).st_mtime
+    except OSError:
+        # already gone
+        return True
+    if age > _ttl():
+        return True
+    try:
+        owner = json.loads(content)
+    except ValueError:
+        # still being written, unless it is old
+        return age > 60
+    return owner.get("host") == socket.gethostname() and not _pid_alive(owner.get("pid"))
+
+
+def collect_stale(path):
+    """
+    Remove a reservation file if it is stale.
+
+    The file is first renamed to a name of this process, so that two
+    processes collecting it at the same time cannot remove a reservation
+    made again in between by a third one.
+
+    :returns: True if the reservation was stale and is gone
+    """
+    content = _read(path)
+    if content is None:
+        return True
+    if not _is_stale(path, content):
+        return False
+    collected = "%s.stale-%s-%d" % (path, socket.gethostname(), os.getpid())
+    try:
+        os.rename(path, collected)
+    except OSError, e:
+        # collected by someone else
+        return e.errno == errno.ENOENT
+    if _read(collected) != content:
+        # a new reservation was made after we read the stale one, put it back
+        try:
+            os.link(collected, path)
+        except OSError:
+            pass
+    try:
+        os.remove(collected)
+    except OSError:
+        pass
+    log.info("Collected stale version reservation %s" % path)
+    return True
+
+
+def sweep(folder):
+    """
+    Collect the stale reservations of a reservation folder, once per
+    process.
+
+    :returns: Number of reservations collected
+    """
+    with _swept_lock:
+        if folder in _swept:
+            return 0
+        _swept.add(folder)
+    collected = 0
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(folder, name)
+        if name.endswith(".lock") and _read(path) is not None and collect_stale(path):
+            collected += 1
+    return collected
+
+
+def reserve_version(publish_template, fields, first_version):
+    """
+    Reserve the first free publish version from a version on.
+
+    A version is free if nobody reserved it and its publish file does not
+    exist.
+
+    :param publish_template: Template of the publish files
+    :param fields:           Fields of the publish, the version is ignored
+    :param first_version:    Lowest version to reserve
+    :returns: A Reservation, to release once the publish is done
+    :raises: VersionAllocationError if no version could be reserved,
+             TankError if the publish template has no version key
+    """
+    def unreserved(error):
+        # first version without a publish file, as before reservations
+        log.warning("Publishing without a version reservation in %s: %s" % (reservations, error))
+        version = first_version
+        while os.path.exists(publish_path(version)):
+            version += 1
+        return Reservation(version, None)
+
+    def publish_path(version):
+        versioned = dict(fields)
+        versioned[VERSION_KEY] = version
+        return publish_template.apply_fields(versioned)
+
+    # the reservations go in the deepest folder which does not depend on
+    # the version, named after the publish path
+    pattern = publish_path(MARKER_VERSION)
+    marker = pattern.find(str(MARKER_VERSION))
+    if marker == -1:
+        # only reached from a toolkit hook, which reports toolkit errors
+        from tank import TankError
+        raise TankError("The publish template %s (%s) has no version key"
+                        % (publish_template.name, publish_template.definition))
+    folder = os.path.dirname(pattern[:marker])
+    name = hashlib.md5(pattern).hexdigest()[:16]
+    reservations = os.path.join(folder, RESERVATION_FOLDER)
+    old_umask = os.umask(0)
+    try:
+        ensure_folder(reservations, 0777)
+    except OSError, e:
+        if e.errno not in _NO_ACCESS:
+            raise
+        return unreserved(e)
+    finally:
+        os.umask(old_umask)
+
+    version = first_version
+    for attempt in range(MAX_ATTEMPTS):
+        path = os.path.join(reservations, "%s-v%d.lock" % (name, version))
+        try:
+            created = _create(path)
+        except OSError, e:
+            if e.errno not in _NO_ACCESS:
+                raise
+            return unreserved(e)
+        if created:
+            if not os.path.exists(publish_path(version)):
+                # reservations left behind by publishes which died
+                sweep(reservations)
+                return Reservation(version, path)
+            # published already, without a reservation
+            os.remove(path)
+        elif collect_stale(path):
+            # try the same version again
+            continue
+        version += 1
+    raise VersionAllocationError("Could not reserve a version of %s from v%03d" % (pattern, first_version))
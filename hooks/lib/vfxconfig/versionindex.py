@@ -0,0 +1,347 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Index of the versions of the work files of a work area.
+
+Finding the next version of a work file used to glob the wip folders of all
+the users of a work area. The index records the fields of every work file
+of a work area, one entry per file, and is stored as json next to the path
+cache so that all the processes of a host share it.
+
+The index is refreshed incrementally: the work area folder and each user
+folder are only listed again when their modification time changed. A
+refresh costs one stat per user folder, instead of a listing of every one.
+Modification times too close to the time of the scan are not trusted, as
+the file system may not see a change made within the same tick.
+
+Within the scan session of a publish, see scansession, an index is only
+refreshed once, unless the publish writes files.
+
+Work templates must have their files directly in the user folders,
+{cs_user_name} being a folder of its own. Other templates are resolved with
+paths_from_template as before.
+"""
+
+import os
+import time
+import json
+import hashlib
+import logging
+import threading
+
+from .memo import process_memo
+from .paths import ensure_folder
+from .cachefolders import INDEX_FOLDER
+from .fieldextract import FieldExtractor
+from .scansession import current_session, parallel_map
+
+log = logging.getLogger(__name__)
+
+USER_KEY = "cs_user_name"
+VERSION_KEY = "version"
+FLAG_KEY = "cs_publi_flag"
+
+# keys ignored to find the versions of a work file
+SKIP_KEYS = (VERSION_KEY, USER_KEY, FLAG_KEY)
+
+# user name used to find the user folder in a work template
+MARKER_USER = "vfxversionindexuser"
+
+# modification times closer than this to the scan time are not trusted
+MTIME_RESOLUTION = 2.0
+
+# stands for the keys missing from the fields of a query
+_ANY = object()
+
+_indexes_lock = threading.Lock()
+
+
+def work_area(work_template, fields):
+    """
+    Return the work area of a work file: the folder holding the user folders.
+
+    :param work_template: Template of the work files
+    :param fields:        Fields of a work file
+    :returns: Path of the work area, or None if the template does not have
+              its files directly in a user folder
+    """
+    if USER_KEY not in work_template.keys or VERSION_KEY not in work_template.keys:
+        return None
+    marked = dict(fields)
+    marked[USER_KEY] = MARKER_USER
+    marked[VERSION_KEY] = 1
+    marked.pop(FLAG_KEY, None)
+    try:
+        path = work_template.apply_fields(marked)
+    except Exception:
+        # some required fields are missing
+        return None
+    separator = os.sep + MARKER_USER + os.sep
+    if path.count(separator) != 1:
+        return None
+    (area, file_name) = path.split(separator)
+    if os.sep in file_name:
+        return None
+    return area
+
+
+class VersionIndex(object):
+    """
+    Versions of the work files of a work area.
+    """
+
+    def __init__(self, work_template, area, store_path=None):
+        """
+        :param work_template: Template of the work files
+        :param area:          Folder holding the user folders
+        :param store_path:    Json file the index is kept in, or None to
+                              keep it in memory only
+        """
+        self._template = work_template
+        self._area = area
+        self._store_path = store_path
+        # all the keys of the template but the version, in a fixed order
+        self._key_names = sorted(name for name in work_template.keys if name != VERSION_KEY)
+        self._extractor = FieldExtractor(work_template)
+        self._lock = threading.Lock()
+        self._area_state = [None, 0]
+        # user folder name -> {"mtime", "scanned", "files": [[file name, version, values]]}
+        self._folders = {}
+        # tables derived from the folders
+        self._files = set()
+        self._tables = {}
+        self._load()
+
+    def _load(self):
+        if not self._store_path or not os.path.isfile(self._store_path):
+            return
+        try:
+            fh = open(self._store_path, "r")
+            try:
+                data = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, ValueError), e:
+            log.debug("Ignoring version index %s: %s" % (self._store_path, e))
+            return
+        if (data.get("area") != self._area or data.get("definition") != self._template.definition
+                or data.get("keys") != self._key_names):
+            # written for another template
+            return
+        self._area_state = data.get("area_state") or [None, 0]
+        self._folders = data.get("folders") or {}
+        self._rebuild()
+
+    def _save(self):
+        if not self._store_path:
+            return
+        data = {"area": self._area,
+                "definition": self._template.definition,
+                "keys": self._key_names,
+                "area_state": self._area_state,
+                "folders": self._folders}
+        tmp_path = "%s.tmp-%d" % (self._store_path, os.getpid())
+        try:
+            fh = open(tmp_path, "w")
+            try:
+                json.dump(data, fh)
+            finally:
+                fh.close()
+            os.rename(tmp_path, self._store_path)
+        except (IOError, OSError), e:
+            # the index is only kept in memory then
+            log.debug("Could not write version index %s: %s" % (self._store_path, e))
+
+    def _is_current(self, state, mtime):
+        """
+        Check if a folder state recorded at scan time is still valid.
+        """
+        (recorded, scanned) = state
+        return recorded == mtime and scanned - mtime > MTIME_RESOLUTION
+
+    def _folder_mtime(self, user):
+        try:
+            return os.stat(os.path.join(self._area, user)).st_mtime
+        except OSError:
+            return None
+
+    def _scan_folder(self, user):
+        """
+        List the work files of a user folder.
+
+        :returns: List of [file name, version, values of the other keys], or
+                  None if the folder is gone
+        """
+        folder = os.path.join(self._area, user)
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return None
+        return [[file_name, fields[VERSION_KEY], [fields.get(name) for name in self._key_names]]
+                for (file_name, fields) in self._extractor.extract(folder, names)]
+
+    def _rebuild(self):
+        self._files = set()
+        for entry in self._folders.values():
+            for (file_name, version, values) in entry["files"]:
+                self._files.add(tuple(values) + (version,))
+        self._tables = {}
+
+    def refresh(self):
+        """
+        Bring the index up to date with the work area.
+        """
+        with self._lock:
+            now = time.time()
+            try:
+                area_mtime = os.stat(self._area).st_mtime
+            except OSError:
+                # no work area yet
+                if self._folders:
+                    self._folders = {}
+                    self._rebuild()
+                return
+
+            changed = False
+            if self._is_current(self._area_state, area_mtime):
+                users = self._folders.keys()
+            else:
+                users = [name for name in os.listdir(self._area)
+                         if os.path.isdir(os.path.join(self._area, name))]
+                self._area_state = [area_mtime, now]
+                changed = True
+
+            for user in set(self._folders) - set(users):
+                del self._folders[user]
+                changed = True
+            # the user folders are checked, and listed, concurrently
+            to_scan = []
+            for (user, mtime) in zip(users, parallel_map(self._folder_mtime, users)):
+                if mtime is None:
+                    self._folders.pop(user, None)
+                    changed = True
+                    continue
+                entry = self._folders.get(user)
+                if entry and self._is_current((entry["mtime"], entry["scanned"]), mtime):
+                    continue
+                to_scan.append((user, mtime))
+            scanned = parallel_map(self._scan_folder, [user for (user, mtime) in to_scan])
+            for ((user, mtime), files) in zip(to_scan, scanned):
+                if files is None:
+                    self._folders.pop(user, None)
+                else:
+                    self._folders[user] = {"mtime": mtime, "scanned": now, "files": files}
+                changed = True
+
+            if changed:
+                self._rebuild()
+                self._save()
+
+    def _query(self, fields, skip_keys):
+        return tuple(_ANY if name in skip_keys else fields.get(name, _ANY) for name in self._key_names)
+
+    def max_version(self, fields, skip_keys=SKIP_KEYS):
+        """
+        Return the highest version of the work files matching fields.
+
+        :param fields:    Fields of a work file
+        :param skip_keys: Keys which may have any value, as for
+                          paths_from_template. Keys missing from the fields
+                          may have any value too.
+        :returns: Version number, 0 if there is no matching work file
+        """
+        query = self._query(fields, skip_keys)
+        with self._lock:
+            if not self._files:
+                return 0
+            wildcards = tuple(index for (index, value) in enumerate(query) if value is _ANY)
+            table = self._tables.get(wildcards)
+            if table is None:
+                # max version per value of the keys which are not skipped
+                table = self._tables[wildcards] = {}
+                for entry in self._files:
+                    key = tuple(value for (index, value) in enumerate(entry[:-1]) if index not in wildcards)
+                    if entry[-1] > table.get(key, 0):
+                        table[key] = entry[-1]
+            key = tuple(value for value in query if value is not _ANY)
+            return table.get(key, 0)
+
+    def exists(self, fields):
+        """
+        Check if a work file exists.
+
+        :param fields: Fields of the work file, version included
+        """
+        entry = tuple(fields.get(name) for name in self._key_names) + (fields.get(VERSION_KEY),)
+        with self._lock:
+            return entry in self._files
+
+
+def _store_folder(tk):
+    """
+    Return the folder the indexes are stored in, next to the path cache.
+    """
+    try:
+        folder = os.path.join(os.path.dirname(tk.pipeline_configuration.get_path_cache_location()), INDEX_FOLDER)
+        ensure_folder(folder, 0777)
+        return folder
+    except Exception, e:
+        log.debug("Version indexes are kept in memory: %s" % e)
+        return None
+
+
+def get_version_index(tk, work_template, fields):
+    """
+    Return the up to date version index of the work area of a work file.
+
+    :param tk:            Toolkit API instance
+    :param work_template: Template of the work files
+    :param fields:        Fields of a work file
+    :returns: A VersionIndex, or None if the template cannot be indexed
+    """
+    area = work_area(work_template, fields)
+    if area is None:
+        return None
+    indexes = process_memo("version_index")
+    key = (work_template.definition, area)
+    with _indexes_lock:
+        index = indexes.get(key)
+        if index is None:
+            store_path = None
+            folder = _store_folder(tk)
+            if folder:
+                name = hashlib.md5("%s\n%s" % key).hexdigest()
+                store_path = os.path.join(folder, "%s.json" % name)
+            index = indexes[key] = VersionIndex(work_template, area, store_path)
+    # once per publish when the hooks of a publish share a scan session
+    session = current_session()
+    if session is None or session.first_refresh(("version_index",) + key):
+        index.refresh()
+    return index
+
+
+def max_work_version(tk, work_template, fields, skip_keys=SKIP_KEYS):
+    """
+    Return the highest version of the work files matching fields, through
+    the version index when the template can be indexed.
+
+    :param tk:            Toolkit API instance
+    :param work_template: Template of the work files
+    :param fields:        Fields of a work file
+    :param skip_keys:     Keys which may have any value
+    :returns: Version number, 0 if there is no matching work file
+    """
+    index = get_version_index(tk, work_template, fields)
+    if index is not None:
+        return index.max_version(fields, skip_keys)
+    existing_versions = tk.paths_from_template(work_template, fields, list(skip_keys))
+    found = FieldExtractor(work_template).extract_paths(existing_versions, [VERSION_KEY])
+    return max([file_fields.get(VERSION_KEY) for file_fields in found.values()] or [0])
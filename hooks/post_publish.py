@@ -15,6 +15,16 @@ import tank
 from tank import Hook
 from tank import TankError
 
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.templatecache import get_fields, apply_fields, template_cache
+from vfxconfig.versionindex import max_work_version
+from vfxconfig.scansession import end_session
+from vfxconfig.registration import take_failed_registrations
+
 import sys
 
 LINUX_PATH = "/s/apps/common/python/luigi/infonodelib"
@@ -82,6 +92,22 @@ class PostPublishHook(Hook):
         else:
             raise TankError("Unable to perform post publish for unhandled engine %s" % engine_name)
 
+        # end of the publish, report how much template work was saved
+        for (operation, counters) in sorted(template_cache().stats().items()):
+            self.parent.log_debug("Template %s: %d hits, %d misses" % (operation, counters["hits"], counters["misses"]))
+
+        # the next publish scans the work and publish areas again
+        end_session()
+
+        # registrations are sent to Shotgun in the background, see
+        # vfxconfig.registration, report the ones which failed for good
+        failed = take_failed_registrations()
+        if failed:
+            raise TankError("Could not register in Shotgun:\n%s\n"
+                            "Run 'python -m vfxconfig.registration retry' once Shotgun is reachable."
+                            % "\n".join("%s: %s" % (job["payload"]["args"].get("path"), job["error"])
+                                         for job in failed))
+
     def _do_maya_post_publish(self, work_template, progress_cb):
         """
         Do any Maya post-publish work
@@ -131,11 +157,11 @@ class PostPublishHook(Hook):
         lighting_pub_template = self.parent.tank.templates['maya_shot_publish_lgt']
 
         # open  the file
-        fields = lighting_pub_template.get_fields(scene_path)
+        fields = get_fields(lighting_pub_template, scene_path)
         fields['cs_user_name'] = user = tank.util.get_current_user(self.parent.tank)['login']
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version 
-        new_scene_path = work_template.apply_fields(fields)
+        new_scene_path = apply_fields(work_template, fields)
         
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (scene_path, new_scene_path))
@@ -164,10 +190,10 @@ class PostPublishHook(Hook):
 
         # increment version and construct new name:
         progress_cb(25, "Finding next version number")
-        fields = work_template.get_fields(script_path)
+        fields = get_fields(work_template, script_path)
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version
-        new_path = work_template.apply_fields(fields)
+        new_path = apply_fields(work_template, fields)
 
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (script_path, new_path))
@@ -194,10 +220,10 @@ class PostPublishHook(Hook):
 
         # increment version and construct new file name:
         progress_cb(25, "Finding next version number")
-        fields = work_template.get_fields(scene_path)
+        fields = get_fields(work_template, scene_path)
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version
-        new_scene_path = work_template.apply_fields(fields)
+        new_scene_path = apply_fields(work_template, fields)
 
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (scene_path, new_scene_path))
@@ -224,10 +250,10 @@ class PostPublishHook(Hook):
 
         # increment version and construct new file name:
         progress_cb(25, "Finding next version number")
-        fields = work_template.get_fields(scene_path)
+        fields = get_fields(work_template, scene_path)
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version
-        new_scene_path = work_template.apply_fields(fields)
+        new_scene_path = apply_fields(work_template, fields)
 
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (scene_path, new_scene_path))
@@ -269,10 +295,10 @@ class PostPublishHook(Hook):
 
         # increment version and construct new file name:
         progress_cb(25, "Finding next version number")
-        fields = work_template.get_fields(scene_path)
+        fields = get_fields(work_template, scene_path)
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version
-        new_scene_path = work_template.apply_fields(fields)
+        new_scene_path = apply_fields(work_template, fields)
 
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (scene_path, new_scene_path))
@@ -301,10 +327,10 @@ class PostPublishHook(Hook):
 
         # increment version and construct new name:
         progress_cb(25, "Finding next version number")
-        fields = work_template.get_fields(script_path)
+        fields = get_fields(work_template, script_path)
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version
-        new_path = work_template.apply_fields(fields)
+        new_path = apply_fields(work_template, fields)
 
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (script_path, new_path))
@@ -349,10 +375,10 @@ class PostPublishHook(Hook):
 
         # increment version and construct new name:
         progress_cb(25, "Finding next version number")
-        fields = work_template.get_fields(script_path)
+        fields = get_fields(work_template, script_path)
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version
-        new_path = work_template.apply_fields(fields)
+        new_path = apply_fields(work_template, fields)
 
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (script_path, new_path))
@@ -384,10 +410,10 @@ class PostPublishHook(Hook):
 
         # increment version and construct new file name:
         progress_cb(25, "Finding next version number")
-        fields = work_template.get_fields(scene_path)
+        fields = get_fields(work_template, scene_path)
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version
-        new_scene_path = work_template.apply_fields(fields)
+        new_scene_path = apply_fields(work_template, fields)
 
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (scene_path, new_scene_path))
@@ -417,10 +443,10 @@ class PostPublishHook(Hook):
 
         # increment version and construct new file name:
         progress_cb(25, "Finding next version number")
-        fields = work_template.get_fields(scene_path)
+        fields = get_fields(work_template, scene_path)
         next_version = self._get_next_work_file_version(work_template, fields)
         fields["version"] = next_version
-        new_scene_path = work_template.apply_fields(fields)
+        new_scene_path = apply_fields(work_template, fields)
 
         # log info
         self.parent.log_debug("Version up work file %s --> %s..." % (scene_path, new_scene_path))
@@ -464,16 +490,11 @@ class PostPublishHook(Hook):
         """
         Find the next available version for the specified work_file
         """
-        # self.parent.log_debug("work_template: %s"%work_template)
-        # self.parent.log_debug("fields: %s"%fields)
-        existing_versions = self.parent.tank.paths_from_template(work_template, fields, ["version","cs_user_name","cs_publi_flag"])
-        # self.parent.log_debug("existing_versions: %s" % existing_versions)
-
-        version_numbers = [work_template.get_fields(v).get("version") for v in existing_versions]
-        self.parent.log_debug("existing_versions: %s" % version_numbers)
+        # the versions of all the users, from the version index of the work area
+        max_v_no = max_work_version(self.parent.tank, work_template, fields, ["version","cs_user_name","cs_publi_flag"])
+        self.parent.log_debug("highest existing version: %s" % max_v_no)
 
         curr_v_no = fields["version"]
-        max_v_no = max(version_numbers)
         return max(curr_v_no, max_v_no) + 1
 
     def _do_nuke_scene_cleanup(self):
@@ -9,11 +9,21 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+import sys
 
 import tank
 from tank import Hook
 from tank import TankError
 
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.templatecache import validate, get_fields, apply_fields
+from vfxconfig.versionindex import max_work_version
+from vfxconfig.scansession import begin_session
+
 class PrimaryPrePublishHook(Hook):
     """
     Single hook that implements pre-publish of the primary task
@@ -60,6 +70,9 @@ class PrimaryPrePublishHook(Hook):
         :raises:                Hook should raise a TankError if the primary task
                                 can't be published!
         """
+        # the hooks of this publish share one scan of the work and publish areas
+        begin_session()
+
         # get the engine name from the parent object (app/engine/etc.)
         engine_name = self.parent.engine.name
 
@@ -381,19 +394,19 @@ class PrimaryPrePublishHook(Hook):
 
         progress_cb(25, "Validating work file")
 
-        if not work_template.validate(path):
+        if not validate(work_template, path):
             raise TankError("File '%s' is not a valid work path, unable to publish!" % path)
 
         progress_cb(50, "Validating publish path")
 
         # find the publish path:
-        fields = work_template.get_fields(path)
+        fields = get_fields(work_template, path)
         fields["TankType"] = output["tank_type"]
         publish_template = output["publish_template"]
         next_version = self._get_next_work_file_version(work_template, fields)
         fields['cs_publi_flag'] = "publi"
         fields["version"] = next_version
-        publish_path = publish_template.apply_fields(fields)
+        publish_path = apply_fields(publish_template, fields)
 
         if os.path.exists(publish_path):
             raise TankError("A published file named '%s' already exists!" % publish_path)
@@ -402,12 +415,8 @@ class PrimaryPrePublishHook(Hook):
 
         # check the version number against existing work file versions to avoid accidentally
         # bypassing more recent work!
-        existing_versions = self.parent.tank.paths_from_template(work_template, fields, ["version"])
-        version_numbers = [ work_template.get_fields(v).get("version") for v in existing_versions]
+        max_v_no = max_work_version(self.parent.tank, work_template, fields, ["version"])
         curr_v_no = fields["version"]
-        max_v_no = 0
-        if version_numbers != []:
-        	max_v_no = max(version_numbers)
         if max_v_no > curr_v_no:
             # there is a higher version number - this means that someone is working
             # on an old version of the file. Warn them about upgrading.
@@ -421,14 +430,9 @@ class PrimaryPrePublishHook(Hook):
         """
         Find the next available version for the specified work_file
         """
-        # self.parent.log_debug("work_template: %s"%work_template)
-        # self.parent.log_debug("fields: %s"%fields)
-        existing_versions = self.parent.tank.paths_from_template(work_template, fields, ["version","cs_user_name","cs_publi_flag"])
-        # self.parent.log_debug("existing_versions: %s" % existing_versions)
-
-        version_numbers = [work_template.get_fields(v).get("version") for v in existing_versions]
-        self.parent.log_debug("existing_versions: %s" % version_numbers)
+        # the versions of all the users, from the version index of the work area
+        max_v_no = max_work_version(self.parent.tank, work_template, fields, ["version","cs_user_name","cs_publi_flag"])
+        self.parent.log_debug("highest existing version: %s" % max_v_no)
 
         curr_v_no = fields["version"]
-        max_v_no = max(version_numbers)
         return max(curr_v_no, max_v_no) + 1
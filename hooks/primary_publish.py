@@ -28,6 +28,18 @@ sys.path.append(info_lib_path[sys.platform])
 
 from infonodelib import InfoNodeLib
 
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.templateindex import get_index
+from vfxconfig.templatecache import validate, get_fields, apply_fields
+from vfxconfig.versionindex import max_work_version
+from vfxconfig.scansession import session_written
+from vfxconfig.versionalloc import reserve_version
+from vfxconfig.registration import submit_registration, wait_for_registration
+
 class PrimaryPublishHook(Hook):
     """
     Single hook that implements publish of the primary task
@@ -137,7 +149,7 @@ class PrimaryPublishHook(Hook):
         # get scene path
         scene_path = os.path.abspath(cmds.file(query=True, sn=True))
 
-        if not work_template.validate(scene_path):
+        if not validate(work_template, scene_path):
             raise TankError(
                 "File '%s' is not a valid work path, unable to publish!" % scene_path)
 
@@ -147,7 +159,7 @@ class PrimaryPublishHook(Hook):
             self.parent.log_debug("%s : %s" % (out, output[out]))
 
 
-        fields = work_template.get_fields(scene_path)
+        fields = get_fields(work_template, scene_path)
         fields["TankType"] = output["tank_type"]
         if "LGT" in fields['cs_task_name']:
             publish_path = self._do_maya_lighting_publish(task, work_template, fields, dependencies, scene_path, comment, thumbnail_path, sg_task, progress_cb)
@@ -169,67 +181,75 @@ class PrimaryPublishHook(Hook):
         #---------------------------------------------
         next_version = self._get_next_work_file_version(work_template, fields)
         fields['cs_publi_flag'] = "publi"
-        fields["version"] = next_version
-
-        publish_path = publish_template.apply_fields(fields)
-
-        if os.path.exists(publish_path):
-                raise TankError(
-                    "The published file named '%s' already exists!" % publish_path)
+        # another artist publishing the same task at the same time gets
+        # the next version rather than failing on the same publish file
+        reservation = reserve_version(publish_template, fields, next_version)
+        fields["version"] = reservation.version
 
-        new_scene_path = work_template.apply_fields(fields)
-        progress_cb(20.0, "Saving the scene")
-        self.parent.log_debug("Saving the scene...")
-        cmds.file(rename=new_scene_path)
-        cmds.file(save=True, force=True)
-        old_path = scene_path
-        scene_path = new_scene_path
-
-        #---------------------------------------------
-        # STEP 2 :  Clean up processes
-        #---------------------------------------------
-        self._do_maya_scene_cleanup(scene_path,old_path,work_template,fields)
-
-        #---------------------------------------------
-        # STEP 3 :  Save As published file
-        #---------------------------------------------
-        progress_cb(60.0, "Saving Publish file")
         try:
-            publish_folder = os.path.dirname(publish_path)
-            self.parent.ensure_folder_exists(publish_folder)
-            self.parent.log_debug(
-                "Saving %s --> %s..." % (scene_path, publish_path))
-            cmds.file(rename=publish_path)
-            cmds.file(save=True, force=True)
-            # self.parent.copy_file(scene_path, publish_path, task)
-        except Exception, e:
-            raise TankError(
-                "Failed to save file from to %s - %s" % (publish_path, e))
-        #---------------------------------------------
-        # STEP 4 : hard_link last version to root folder
-        #---------------------------------------------
-        self._hard_link_last_publish(
-            progress_cb, publish_path,  task)
+            publish_path = apply_fields(publish_template, fields)
 
-        #---------------------------------------------
-        # STEP 5 : get publish name
-        #---------------------------------------------
-        publish_name = self._get_publish_name(
-            publish_path, publish_template, fields)
+            if os.path.exists(publish_path):
+                    raise TankError(
+                        "The published file named '%s' already exists!" % publish_path)
 
-        #---------------------------------------------
-        # STEP 6 : register the publish
-        #---------------------------------------------
-        progress_cb(75.0, "Registering the publish")
-        self._register_publish(publish_path,
-                               publish_name,
-                               sg_task,
-                               fields["version"],
-                               output["tank_type"],
-                               comment,
-                               thumbnail_path,
-                               dependencies)
-        return publish_path
+            new_scene_path = apply_fields(work_template, fields)
+            progress_cb(20.0, "Saving the scene")
+            self.parent.log_debug("Saving the scene...")
+            cmds.file(rename=new_scene_path)
+            cmds.file(save=True, force=True)
+            session_written(new_scene_path)
+            old_path = scene_path
+            scene_path = new_scene_path
+
+            #---------------------------------------------
+            # STEP 2 :  Clean up processes
+            #---------------------------------------------
+            self._do_maya_scene_cleanup(scene_path,old_path,work_template,fields)
+
+            #---------------------------------------------
+            # STEP 3 :  Save As published file
+            #---------------------------------------------
+            progress_cb(60.0, "Saving Publish file")
+            try:
+                publish_folder = os.path.dirname(publish_path)
+                self.parent.ensure_folder_exists(publish_folder)
+                self.parent.log_debug(
+                    "Saving %s --> %s..." % (scene_path, publish_path))
+                cmds.file(rename=publish_path)
+                cmds.file(save=True, force=True)
+                session_written(publish_path)
+                # self.parent.copy_file(scene_path, publish_path, task)
+            except Exception, e:
+                raise TankError(
+                    "Failed to save file from to %s - %s" % (publish_path, e))
+            #---------------------------------------------
+            # STEP 4 : hard_link last version to root folder
+            #---------------------------------------------
+            self._hard_link_last_publish(
+                progress_cb, publish_path,  task)
+
+            #---------------------------------------------
+            # STEP 5 : get publish name
+            #---------------------------------------------
+            publish_name = self._get_publish_name(
+                publish_path, publish_template, fields)
+
+            #---------------------------------------------
+            # STEP 6 : register the publish
+            #---------------------------------------------
+            progress_cb(75.0, "Registering the publish")
+            self._register_publish(publish_path,
+                                   publish_name,
+                                   sg_task,
+                                   fields["version"],
+                                   output["tank_type"],
+                                   comment,
+                                   thumbnail_path,
+                                   dependencies)
+            return publish_path
+        finally:
+            reservation.release()
     
     def _do_maya_lighting_publish(self,task, work_template, fields, dependencies, scene_path, comment, thumbnail_path, sg_task, progress_cb):
         import maya.cmds as cmds
@@ -241,17 +261,18 @@ class PrimaryPublishHook(Hook):
         #---------------------------------------------
         fields['cs_publi_flag'] = "publi"
 
-        publish_path = publish_template.apply_fields(fields)
+        publish_path = apply_fields(publish_template, fields)
 
         if os.path.exists(publish_path):
                 raise TankError(
                     "The published file named '%s' already exists!" % publish_path)
 
-        new_scene_path = work_template.apply_fields(fields)
+        new_scene_path = apply_fields(work_template, fields)
         progress_cb(20.0, "Saving the scene")
         self.parent.log_debug("Saving the scene...")
         cmds.file(rename=new_scene_path)
         cmds.file(save=True, force=True)
+        session_written(new_scene_path)
         old_path = scene_path
         scene_path = new_scene_path
 
@@ -271,6 +292,7 @@ class PrimaryPublishHook(Hook):
                 "Saving %s --> %s..." % (scene_path, publish_path))
             cmds.file(rename=publish_path)
             cmds.file(save=True, force=True)
+            session_written(publish_path)
             # self.parent.copy_file(scene_path, publish_path, task)
         except Exception, e:
             raise TankError(
@@ -338,12 +360,12 @@ class PrimaryPublishHook(Hook):
         # now, for each reference found, build a list of the ones
         # that resolve against a template:
         dependency_paths = []
+        template_index = get_index(self.parent.tank)
         for ref_path in ref_paths:
-            # see if there is a template that is valid for this path:
-            for template in self.parent.tank.templates.values():
-                if template.validate(ref_path):
-                    dependency_paths.append(ref_path)
-                    break
+            # see if there is a template that is valid for this path,
+            # the index only validates the templates sharing its folders:
+            if template_index.match(ref_path):
+                dependency_paths.append(ref_path)
 
         return dependency_paths
 
@@ -371,15 +393,15 @@ class PrimaryPublishHook(Hook):
             script_path = ""
         script_path = os.path.abspath(script_path)
         
-        if not work_template.validate(script_path):
+        if not validate(work_template, script_path):
             raise TankError("File '%s' is not a valid work path, unable to publish!" % script_path)
         
         # use templates to convert to publish path:
         output = task["output"]
-        fields = work_template.get_fields(script_path)
+        fields = get_fields(work_template, script_path)
         fields["TankType"] = output["tank_type"]
         publish_template = output["publish_template"]
-        publish_path = publish_template.apply_fields(fields)
+        publish_path = apply_fields(publish_template, fields)
         
         if os.path.exists(publish_path):
             raise TankError("The published file named '%s' already exists!" % publish_path)
@@ -396,6 +418,7 @@ class PrimaryPublishHook(Hook):
             self.parent.ensure_folder_exists(publish_folder)
             self.parent.log_debug("Copying %s --> %s..." % (script_path, publish_path))
             self.parent.copy_file(script_path, publish_path, task)
+            session_written(publish_path)
         except Exception, e:
             raise TankError("Failed to copy file from %s to %s - %s" % (script_path, publish_path, e))
 
@@ -427,6 +450,7 @@ class PrimaryPublishHook(Hook):
         # figure out all the inputs to the scene and pass them as dependency
         # candidates
         dependency_paths = []
+        template_index = get_index(self.parent.tank)
         for read_node in nuke.allNodes("Read"):
             # make sure we have a file path and normalize it
             # file knobs set to "" in Python will evaluate to None. This is different than
@@ -437,16 +461,15 @@ class PrimaryPublishHook(Hook):
                 continue
             file_name = file_name.replace('/', os.path.sep)
 
-            # validate against all our templates
-            for template in self.parent.tank.templates.values():
-                if template.validate(file_name):
-                    fields = template.get_fields(file_name)
-                    # translate into a form that represents the general
-                    # tank write node path.
-                    fields["SEQ"] = "FORMAT: %d"
-                    fields["eye"] = "%V"
-                    dependency_paths.append(template.apply_fields(fields))
-                    break
+            # validate against our templates
+            template = template_index.match(file_name)
+            if template:
+                fields = get_fields(template, file_name)
+                # translate into a form that represents the general
+                # tank write node path.
+                fields["SEQ"] = "FORMAT: %d"
+                fields["eye"] = "%V"
+                dependency_paths.append(apply_fields(template, fields))
 
         return dependency_paths
 
@@ -474,16 +497,16 @@ class PrimaryPublishHook(Hook):
         # get scene path
         scene_path = doc.fullName.nativePath
 
-        if not work_template.validate(scene_path):
+        if not validate(work_template, scene_path):
             raise TankError(
                 "File '%s' is not a valid work path, unable to publish!" % scene_path)
 
         # use templates to convert to publish path:
         output = task["output"]
-        fields = work_template.get_fields(scene_path)
+        fields = get_fields(work_template, scene_path)
         fields["TankType"] = output["tank_type"]
         publish_template = output["publish_template"]
-        publish_path = publish_template.apply_fields(fields)
+        publish_path = apply_fields(publish_template, fields)
 
         if os.path.exists(publish_path):
             raise TankError(
@@ -502,6 +525,7 @@ class PrimaryPublishHook(Hook):
             self.parent.log_debug(
                 "Copying %s --> %s..." % (scene_path, publish_path))
             self.parent.copy_file(scene_path, publish_path, task)
+            session_written(publish_path)
         except Exception, e:
             raise TankError(
                 "Failed to copy file from %s to %s - %s" % (scene_path, publish_path, e))
@@ -512,7 +536,7 @@ class PrimaryPublishHook(Hook):
 
         # finally, register the publish:
         progress_cb(50.0, "Registering the publish")
-        tank_publish = self._register_publish(publish_path,
+        registration = self._register_publish(publish_path,
                                               publish_name,
                                               sg_task,
                                               fields["version"],
@@ -520,6 +544,8 @@ class PrimaryPublishHook(Hook):
                                               comment,
                                               thumbnail_path,
                                               dependency_paths=[])
+        # the version below is linked to the publish entity
+        tank_publish = wait_for_registration(registration)
 
         #######################################################################
         # create a version!
@@ -581,7 +607,7 @@ class PrimaryPublishHook(Hook):
         this will return a 'versionless' name
         """
         # first, extract the fields from the path using the template:
-        fields = fields.copy() if fields else template.get_fields(path)
+        fields = fields.copy() if fields else get_fields(template, path)
         if "name" in fields and fields["name"]:
             # well, that was easy!
             name = fields["name"]
@@ -609,7 +635,7 @@ class PrimaryPublishHook(Hook):
 
                 # now use this dummy version and rebuild the path
                 fields["version"] = dummy_version
-                path = template.apply_fields(fields)
+                path = apply_fields(template, fields)
                 name, _ = os.path.splitext(os.path.basename(path))
 
                 # we can now locate the version in the name and remove it
@@ -643,8 +669,10 @@ class PrimaryPublishHook(Hook):
 
     def _register_publish(self, path, name, sg_task, publish_version, tank_type, comment, thumbnail_path, dependency_paths):
         """
-        Helper method to register publish using the
-        specified publish info.
+        Helper method to queue the registration of a publish using
+        the specified publish info.
+
+        Returns the id of the registration, see wait_for_registration()
         """
         # construct args:
         args = {
@@ -660,12 +688,10 @@ class PrimaryPublishHook(Hook):
             "published_file_type": tank_type,
         }
 
-        self.parent.log_debug("Register publish in shotgun: %s" % str(args))
-
-        # register publish;
-        sg_data = tank.util.register_publish(**args)
+        self.parent.log_debug("Queue publish registration in shotgun: %s" % str(args))
 
-        return sg_data
+        # registered in the background, the files are already on disk
+        return submit_registration(**args)
 
     def _hard_link_last_publish(self, progress_cb, publish_file_path, task):
         import re
@@ -688,16 +714,11 @@ class PrimaryPublishHook(Hook):
         """
         Find the next available version for the specified work_file
         """
-        # self.parent.log_debug("work_template: %s"%work_template)
-        # self.parent.log_debug("fields: %s"%fields)
-        existing_versions = self.parent.tank.paths_from_template(work_template, fields, ["version","cs_user_name","cs_publi_flag"])
-        # self.parent.log_debug("existing_versions: %s" % existing_versions)
-
-        version_numbers = [work_template.get_fields(v).get("version") for v in existing_versions]
-        self.parent.log_debug("existing_versions: %s" % version_numbers)
+        # the versions of all the users, from the version index of the work area
+        max_v_no = max_work_version(self.parent.tank, work_template, fields, ["version","cs_user_name","cs_publi_flag"])
+        self.parent.log_debug("highest existing version: %s" % max_v_no)
 
         curr_v_no = fields["version"]
-        max_v_no = max(version_numbers)
         return max(curr_v_no, max_v_no) + 1
 
     def _do_maya_scene_cleanup(self,scene_path,old_path,work_template,fields):
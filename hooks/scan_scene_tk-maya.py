@@ -9,12 +9,20 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+import sys
 import maya.cmds as cmds
 
 import tank
 from tank import Hook
 from tank import TankError
 
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.templatecache import get_fields, apply_fields
+
 class ScanSceneHook(Hook):
     """
     Hook to scan scene for items to publish
@@ -89,9 +97,9 @@ class ScanSceneHook(Hook):
         if "LGT" in scene_path:
             lgt_template = self.parent.tank.templates['maya_shot_render_mono_exr']
             work_template = self.parent.tank.templates['maya_shot_work']
-            fields = work_template.get_fields(scene_path)
+            fields = get_fields(work_template, scene_path)
 
-            lgt_renders = lgt_template.apply_fields(fields)
+            lgt_renders = apply_fields(lgt_template, fields)
             baseName = os.path.basename(lgt_renders)
             dirName = os.path.dirname(lgt_renders)
             if os.path.exists(dirName):
@@ -28,6 +28,17 @@ info_lib_path = {"linux2": LINUX_PATH,
 sys.path.append(info_lib_path[sys.platform])
 
 from infonodelib import InfoNodeLib
+
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.dircache import known_folders
+from vfxconfig.sequence import SequenceMapper
+from vfxconfig.templatecache import get_fields, apply_fields
+from vfxconfig.registration import submit_registration
+
 class PublishHook(Hook):
     """
     Single hook that implements publish functionality for secondary tasks
@@ -221,14 +232,14 @@ class PublishHook(Hook):
         # get the current scene path and extract fields from it
         # using the work template:
         scene_path = os.path.abspath(cmds.file(query=True, sn=True))
-        fields = work_template.get_fields(scene_path)
+        fields = get_fields(work_template, scene_path)
         publish_version = fields["version"]
         tank_type = output["tank_type"]
                 
         # create the publish path by applying the fields 
         # with the publish template:
         publish_template = output["publish_template"]
-        publish_path = publish_template.apply_fields(fields)
+        publish_path = apply_fields(publish_template, fields)
         
         # ensure the publish folder exists:
         publish_folder = os.path.dirname(publish_path)
@@ -286,7 +297,7 @@ class PublishHook(Hook):
             "dependency_paths": [primary_publish_path],
             "published_file_type":tank_type
         }
-        tank.util.register_publish(**args)
+        submit_registration(**args)
     
     def _find_scene_animation_range(self):
         """
@@ -318,7 +329,7 @@ class PublishHook(Hook):
         # using the work template:
         scene_path = os.path.abspath(cmds.file(query=True, sn=True))
         wip_path = self._get_current_work_file_version(scene_path)
-        fields = work_template.get_fields(wip_path)
+        fields = get_fields(work_template, wip_path)
         publish_version = fields["version"]
         tank_type = output["tank_type"]
 
@@ -350,7 +361,7 @@ class PublishHook(Hook):
          # create the publish path by applying the fields 
         # with the publish template:
         publish_template = output["publish_template"]
-        publish_path = publish_template.apply_fields(fields)
+        publish_path = apply_fields(publish_template, fields)
         publish_name = publish_path
         wantedPath = publish_path
         wantedDir = wantedPath
@@ -411,7 +422,7 @@ class PublishHook(Hook):
         # using the work template:
         scene_path = os.path.abspath(cmds.file(query=True, sn=True))
         wip_path = self._get_current_work_file_version(scene_path)
-        fields = work_template.get_fields(wip_path)
+        fields = get_fields(work_template, wip_path)
         publish_version = fields["version"]
         tank_type = output["tank_type"]
 
@@ -434,7 +445,7 @@ class PublishHook(Hook):
         # create the publish path by applying the fields 
         # with the publish template:
         publish_template = output["publish_template"]
-        publish_path = publish_template.apply_fields(fields)
+        publish_path = apply_fields(publish_template, fields)
 
         cachePath = cmds.getAttr( '%s.Path' % cache )
         cacheEnd = re.compile('^[^\.]+').sub('', cachePath)
@@ -513,29 +524,36 @@ class PublishHook(Hook):
 
         progress_cb(25, "Copying files")
 
-        for fi, rf in enumerate(render_files):
+        # construct the publish paths, the templates are only resolved
+        # once per sequence, not once per frame:
+        mapper = SequenceMapper(render_template, [publish_template],
+                                extra_fields={"TankType": tank_type})
+        copies = mapper.pairs(render_files)
+        for (rf, target_path) in copies:
             self.parent.log_debug("pub_file: %s"%rf)
-            progress_cb(25 + (50*(len(render_files)/(fi+1))))
 
-            # construct the publish path:
-            fields = render_template.get_fields(rf)
-            fields["TankType"] = tank_type
-            target_path = publish_template.apply_fields(fields)
+        # all the frames go to a couple of folders, create them in one go
+        self.parent.tank.execute_core_hook_method("ensure_folder_exists", "ensure_folders_exist",
+                                                  paths=[os.path.dirname(t) for (rf, t) in copies],
+                                                  bundle_obj=self.parent)
+
+        for fi, (rf, target_path) in enumerate(copies):
+            progress_cb(25 + (50*(len(render_files)/(fi+1))))
 
             # copy the file
             try:
-                target_folder = os.path.dirname(target_path)
-                self.parent.ensure_folder_exists(target_folder)
                 self._hardl_link_file(rf, target_path)
             except Exception, e:
+                # the folder may have been removed since it was created
+                known_folders().forget(os.path.dirname(target_path))
                 raise TankError("Failed to hard link file from %s to %s - %s" % (rf, target_path, e))
 
         progress_cb(40, "Publishing to Shotgun")
 
         # use the render path to work out the publish 'file' and name:
-        render_path_fields = render_template.get_fields(render_path)
+        render_path_fields = get_fields(render_template, render_path)
         render_path_fields["TankType"] = tank_type
-        publish_path = publish_template.apply_fields(render_path_fields)
+        publish_path = apply_fields(publish_template, render_path_fields)
 
         # construct publish name:
         publish_name = ""
@@ -554,20 +572,22 @@ class PublishHook(Hook):
 
 
         # register the publish:
-        sg_publish = self._register_publish(publish_path,
-                                            publish_name,
-                                            sg_task,
-                                            publish_version,
-                                            tank_type,
-                                            comment,
-                                            [published_script_path])
+        registration = self._register_publish(publish_path,
+                                              publish_name,
+                                              sg_task,
+                                              publish_version,
+                                              tank_type,
+                                              comment,
+                                              [published_script_path])
 
-        return sg_publish
+        return registration
 
     def _register_publish(self, path, name, sg_task, publish_version, tank_type, comment, dependency_paths):
         """
-        Helper method to register publish using the
-        specified publish info.
+        Helper method to queue the registration of a publish using
+        the specified publish info.
+
+        Returns the id of the registration, see wait_for_registration()
         """
         # construct args:
         args = {
@@ -582,10 +602,8 @@ class PublishHook(Hook):
             "published_file_type":tank_type,
         }
 
-        # register publish;
-        sg_data = tank.util.register_publish(**args)
-
-        return sg_data
+        # registered in the background, the files are already on disk
+        return submit_registration(**args)
     def _hardl_link_file(self,source,target):
         try:
             os.link(source, target)
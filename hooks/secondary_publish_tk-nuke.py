@@ -9,6 +9,7 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+import sys
 import shutil
 import nuke
 
@@ -16,6 +17,16 @@ import tank
 from tank import Hook
 from tank import TankError
 
+# shared helper library of this configuration
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib")
+if LIB_PATH not in sys.path:
+    sys.path.append(LIB_PATH)
+
+from vfxconfig.dircache import known_folders
+from vfxconfig.sequence import SequenceMapper
+from vfxconfig.templatecache import get_fields, apply_fields
+from vfxconfig.registration import submit_registration, wait_for_registration
+
 
 class PublishHook(Hook):
     """
@@ -157,7 +168,7 @@ class PublishHook(Hook):
                     try:
                         #generate DnxHD for edit on the farm
                         # self._generate_dnxhd(write_node)
-                        (sg_publish, thumbnail_path) = self._publish_write_node_render(task,
+                        (registration, thumbnail_path) = self._publish_write_node_render(task,
                                                                                        write_node,
                                                                                        primary_publish_path,
                                                                                        sg_task,
@@ -165,7 +176,7 @@ class PublishHook(Hook):
                                                                                        progress_cb)
 
                         # keep track of our publish data so that we can pick it up later in review
-                        render_publishes[ write_node.name() ] = (sg_publish, thumbnail_path)
+                        render_publishes[ write_node.name() ] = (registration, thumbnail_path)
                        
                     except Exception, e:
                         errors.append("Publish failed - %s" % e)
@@ -184,7 +195,9 @@ class PublishHook(Hook):
                         # pick up sg data from the render dict we are maintianing
                         # note: we assume that the rendering tasks always happen
                         # before the review tasks inside the publish...
-                        (sg_publish, thumbnail_path) = render_publishes[ write_node.name() ]
+                        (registration, thumbnail_path) = render_publishes[ write_node.name() ]
+                        # the version is linked to the publish entity
+                        sg_publish = wait_for_registration(registration)
 
                         self._send_to_screening_room (
                             write_node,
@@ -226,7 +239,7 @@ class PublishHook(Hook):
             
             render_path = self.__write_node_app.get_node_render_path(write_node)
             render_template = self.__write_node_app.get_node_render_template(write_node)
-            render_path_fields = render_template.get_fields(render_path)
+            render_path_fields = get_fields(render_template, render_path)
             job_name_template = self.parent.tank.templates["nuke_dnxhd_job_name"]
             movie_edit_template = self.parent.tank.templates["nuke_shot_render_movie_edit"]
             edit_path_template = self.parent.tank.templates["edit_dnx_folder"]
@@ -235,10 +248,10 @@ class PublishHook(Hook):
             timestamp = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
 
             render_path_fields["cs_timestamp"] = timestamp
-            edit_first_path_link = edit_path_template.apply_fields(render_path_fields)
-            edit_second_path_link = movie_edit_template.apply_fields(render_path_fields)
+            edit_first_path_link = apply_fields(edit_path_template, render_path_fields)
+            edit_second_path_link = apply_fields(movie_edit_template, render_path_fields)
             movie_name = os.path.basename(edit_first_path_link)
-            job_name = job_name_template.apply_fields(render_path_fields)
+            job_name = apply_fields(job_name_template, render_path_fields)
 
             rootName = nuke.Root().name()
             rootBaseName = os.path.splitext(os.path.dirname(rootName))[0]
@@ -279,7 +292,7 @@ class PublishHook(Hook):
         render_path = self.__write_node_app.get_node_render_path(write_node)
         render_template = self.__write_node_app.get_node_render_template(write_node)
         publish_template = self.__write_node_app.get_node_publish_template(write_node)
-        render_path_fields = render_template.get_fields(render_path)
+        render_path_fields = get_fields(render_template, render_path)
         try:
             if hasattr(self.__review_submission_app, "render_and_submit_version"):
                 # this is a recent version of the review submission app that contains
@@ -362,31 +375,37 @@ class PublishHook(Hook):
         timestamp = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
 
         progress_cb(25, "Copying files")
-        for template in targets:
-            for fi, rf in enumerate(render_files):
-
-                progress_cb(25 + (50*(len(render_files)/((fi+1)*len(targets)))))
-
-                # construct the publish path:
-                fields = render_template.get_fields(rf)
-                fields["TankType"] = tank_type
-                fields["cs_timestamp"] = timestamp
-                target_path = template.apply_fields(fields)
-                self.parent.log_debug("target_path - %s" % target_path)
-                # copy the file
-                try:
-                    target_folder = os.path.dirname(target_path)
-                    self.parent.ensure_folder_exists(target_folder)
-                    self._hardl_link_file(rf, target_path)
-                except Exception, e:
-                    raise TankError("Failed to hard link file from %s to %s - %s" % (rf, target_path, e))
+        # construct the publish paths, the templates are only resolved
+        # once per sequence, not once per frame:
+        mapper = SequenceMapper(render_template, targets,
+                                extra_fields={"TankType": tank_type, "cs_timestamp": timestamp})
+        copies = mapper.pairs(render_files)
+        for (rf, target_path) in copies:
+            self.parent.log_debug("target_path - %s" % target_path)
+
+        # all the frames go to a couple of folders, create them in one go
+        self.parent.tank.execute_core_hook_method("ensure_folder_exists", "ensure_folders_exist",
+                                                  paths=[os.path.dirname(t) for (rf, t) in copies],
+                                                  bundle_obj=self.parent)
+
+        for fi, (rf, target_path) in enumerate(copies):
+
+            progress_cb(25 + (50*(len(render_files)/(fi+1))))
+
+            # copy the file
+            try:
+                self._hardl_link_file(rf, target_path)
+            except Exception, e:
+                # the folder may have been removed since it was created
+                known_folders().forget(os.path.dirname(target_path))
+                raise TankError("Failed to hard link file from %s to %s - %s" % (rf, target_path, e))
 
         progress_cb(40, "Publishing to Shotgun")
 
         # use the render path to work out the publish 'file' and name:
-        render_path_fields = render_template.get_fields(render_path)
+        render_path_fields = get_fields(render_template, render_path)
         render_path_fields["TankType"] = tank_type
-        publish_path = publish_template.apply_fields(render_path_fields)
+        publish_path = apply_fields(publish_template, render_path_fields)
 
         # construct publish name:
         publish_name = ""
@@ -407,21 +426,23 @@ class PublishHook(Hook):
         thumbnail_path = self.__write_node_app.generate_node_thumbnail(write_node)
 
         # register the publish:
-        sg_publish = self._register_publish(publish_path,
-                                            publish_name,
-                                            sg_task,
-                                            publish_version,
-                                            tank_type,
-                                            comment,
-                                            thumbnail_path,
-                                            [published_script_path])
+        registration = self._register_publish(publish_path,
+                                              publish_name,
+                                              sg_task,
+                                              publish_version,
+                                              tank_type,
+                                              comment,
+                                              thumbnail_path,
+                                              [published_script_path])
 
-        return sg_publish, thumbnail_path
+        return registration, thumbnail_path
 
     def _register_publish(self, path, name, sg_task, publish_version, tank_type, comment, thumbnail_path, dependency_paths):
         """
-        Helper method to register publish using the
-        specified publish info.
+        Helper method to queue the registration of a publish using
+        the specified publish info.
+
+        Returns the id of the registration, see wait_for_registration()
         """
         # construct args:
         args = {
@@ -437,10 +458,8 @@ class PublishHook(Hook):
             "published_file_type":tank_type,
         }
 
-        # register publish;
-        sg_data = tank.util.register_publish(**args)
-
-        return sg_data
+        # registered in the background, the files are already on disk
+        return submit_registration(**args)
 
     def _hardl_link_file(self,source,target):
         try:
@@ -0,0 +1,88 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+The fast file name parser of vfxconfig.fieldextract must give the same
+fields as Template.get_fields, on the templates of core/templates.yml.
+
+The templates are read with the toolkit core, found as for
+vfxconfig.templatebench (python path, TK_CORE_PYTHON, or the install folder
+next to this configuration):
+
+    TK_CORE_PYTHON=<tk-core>/python python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hooks", "lib"))
+
+from vfxconfig import fieldextract
+from vfxconfig import templatebench
+
+# templates whose versions are found by the version index, which must use
+# the compiled expression rather than the template
+WORK_TEMPLATES = ("maya_shot_work", "nuke_shot_work", "photoshop_shot_work")
+
+# runs of the property check, each with its own file name mutations
+SEEDS = range(5)
+SAMPLES = 40
+
+
+class TestFieldExtract(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.templates = templatebench.load_templates()
+        except ImportError, e:
+            raise unittest.SkipTest("the toolkit core is needed to read the templates: %s" % e)
+
+    def test_same_fields_as_get_fields(self):
+        for seed in SEEDS:
+            (checked, mismatches, unsupported) = fieldextract.check(self.templates, SAMPLES, seed)
+            self.assertTrue(checked > 0)
+            self.assertEqual(mismatches, {}, "seed %d: %s" % (seed, mismatches))
+
+    def test_work_templates_are_compiled(self):
+        for name in WORK_TEMPLATES:
+            self.assertTrue(fieldextract.FieldExtractor(self.templates[name]).supported, name)
+
+    def test_listing_order_does_not_matter(self):
+        template = self.templates["maya_shot_work"]
+        extractor = fieldextract.FieldExtractor(template)
+        paths = []
+        for index in range(SAMPLES):
+            fields = templatebench.synthetic_fields(template, index)
+            if fields is not None:
+                paths.append(template.apply_fields(fields))
+        folder = os.path.dirname(paths[0])
+        names = [os.path.basename(path) for path in paths if os.path.dirname(path) == folder]
+        expected = dict(extractor.extract(folder, names))
+        rng = random.Random(0)
+        for attempt in range(10):
+            rng.shuffle(names)
+            self.assertEqual(dict(extractor.extract(folder, names)), expected)
+
+    def test_extract_paths_matches_get_fields(self):
+        template = self.templates["nuke_shot_work"]
+        paths = []
+        for index in range(SAMPLES):
+            fields = templatebench.synthetic_fields(template, index)
+            if fields is not None:
+                paths.append(template.apply_fields(fields))
+        expected = dict((path, template.get_fields(path)) for path in paths)
+        self.assertEqual(fieldextract.FieldExtractor(template).extract_paths(paths), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()